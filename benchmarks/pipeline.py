@@ -0,0 +1,232 @@
+"""
+Measures production throughput on simulated stations, without hardware.
+
+A SimulatedLine provides N stations: the fake esptool stands in for the S3 and
+H2 flash ports and pty-based factory devices answer on the factory ports. Every
+station then runs units back-to-back until it has done its share:
+
+    jobs    the unit task graph the GUI, the CLI and the station scheduler use:
+            read both MACs, flash the S3 (FlashS3Job) and H2 (FlashH2Job) at the
+            same time, reboot the S3 and run the factory sequence
+    qt      the GUI's worker threads: FlashFirmwareS3Thread and FlashFirmwareH2Thread
+            at the same time, the reboot, then SerialReaderThread until the device
+            is in factory mode (skipped when PyQt6 is not installed)
+
+Reported are units/hour, per-stage latency percentiles and the CPU time of the app
+process (all of its threads) and of the esptool processes it started, as a share
+of one core over the run.
+
+Simulated delays are realistic at --time-scale 1; lower values shorten them for
+quick regression runs, but process start-up and the app's own work stay at full
+length, so throughput is then not comparable with real lines.
+
+Usage:
+    python benchmarks/pipeline.py [--stations 2] [--units 3] [--mode jobs|qt]
+                                  [--time-scale 1.0] [--fail-rate 0] [--no-factory] [--json]
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from components.simulator.simulator import SimulatedLine  # noqa: E402
+
+PERCENTILES = (50, 90, 99)
+
+
+def has_pyqt() -> bool:
+    try:
+        import PyQt6.QtCore  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def percentile(values: List[float], percent: float) -> float:
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, -(-len(ordered) * percent // 100) - 1))]
+
+
+def run_jobs(station, utils, store, order_no: str, units: int, factory: bool) -> List[dict]:
+    """Runs units on one station with the Qt-free pipeline; returns every unit's stages."""
+    from components.station.pipeline import UnitPipeline
+
+    pipeline = UnitPipeline(station, utils, order_no, store=store, factory=factory)
+    results = []
+    try:
+        for _ in range(units):
+            result = pipeline.run()
+            if result.detail == 'order exhausted':
+                break
+            results.append(result.to_dict())
+    finally:
+        pipeline.close()
+    return results
+
+
+def run_qt(station, utils, store, order_no: str, units: int, factory: bool) -> List[dict]:
+    """Runs units on one station with the GUI's QThreads; returns every unit's stages."""
+    from components.flash.flash import FlashFirmwareH2Thread, FlashFirmwareS3Thread
+    from components.serialcom.serialcom import SerialReaderThread
+    from components.station.prefetch import certificate_uuid
+
+    utils = station.utils or utils
+    results = []
+    for _ in range(units):
+        start = time.monotonic()
+        result = {'station': station.name, 'success': False, 'stages': {}}
+        record = store.claim_next(order_no, station.name)
+        if record is None:
+            break
+        s3 = FlashFirmwareS3Thread(station.s3_port, station.s3_baud, utils.address_bootloader_flashS3,
+                                   utils.address_partition_table_flashS3, utils.address_ota_data_initial_flashS3,
+                                   utils.address_firmware_flashS3, utils.address_dac_secure_cert_partition,
+                                   utils.address_dac_data_provider_partition)
+        s3.job.serial_id, s3.job.cert_uuid = record['serial_id'], certificate_uuid(record)
+        h2 = FlashFirmwareH2Thread(station.h2_port, station.h2_baud, utils.command_flashH2,
+                                   utils.address_bootloader_flashH2, utils.address_partition_table_flashH2,
+                                   utils.address_firmware_flashH2, unit=record['serial_id'])
+        # finished is emitted from the worker thread, so the lambdas run there, when each flash ends
+        ended = {}
+        s3.finished.connect(lambda: ended.setdefault('flash_s3', time.monotonic()))
+        h2.finished.connect(lambda: ended.setdefault('flash_h2', time.monotonic()))
+        s3.start()
+        h2.start()
+        s3.wait()
+        h2.wait()
+        result['stages']['flash_s3'] = {'success': s3.success_detected_firmware, 'seconds': ended['flash_s3'] - start}
+        result['stages']['flash_h2'] = {'success': h2.success_detected, 'seconds': ended['flash_h2'] - start}
+        if s3.success_detected_certificate:
+            store.mark_flashed(record['serial_id'], '')
+        else:
+            store.release(record['serial_id'])
+            s3.job.ledger.release(s3.job.cert_uuid, record['serial_id'])
+
+        stage_start = time.monotonic()
+        rebooted = utils.esptool_reboot(station.s3_port, station.s3_baud, unit=record['serial_id'])
+        result['stages']['reboot'] = {'success': rebooted, 'seconds': time.monotonic() - stage_start}
+
+        if factory and rebooted:
+            stage_start = time.monotonic()
+            # 0 in config.ini means no deadline
+            prompt_timeout = float(utils.prompt_timeout_factoryS3) or None
+            reader = SerialReaderThread(station.factory_port, station.factory_baud, prompt_timeout=prompt_timeout, utils=utils)
+            reader.start()
+            deadline = time.monotonic() + prompt_timeout if prompt_timeout else None
+            while not reader.factory_status and reader.isRunning() and (deadline is None or time.monotonic() < deadline):
+                time.sleep(0.01)
+            result['stages']['factory_mode'] = {'success': reader.factory_status, 'seconds': time.monotonic() - stage_start}
+            reader.stop()
+            reader.wait()
+
+        result['success'] = all(stage['success'] for stage in result['stages'].values())
+        result['seconds'] = time.monotonic() - start
+        results.append(result)
+    return results
+
+
+def summarize(results: List[dict], seconds: float, cpu: Dict[str, float]) -> dict:
+    passed = sum(1 for result in results if result['success'])
+    stages: Dict[str, List[float]] = {}
+    for result in results:
+        for name, stage in result['stages'].items():
+            stages.setdefault(name, []).append(stage['seconds'])
+    cycles = [result['seconds'] for result in results]
+    if cycles:
+        stages['cycle'] = cycles
+    return {
+        'units': len(results),
+        'passed': passed,
+        'failed': len(results) - passed,
+        'seconds': round(seconds, 3),
+        'units_per_hour': round(passed / seconds * 3600, 1) if seconds else 0.0,
+        'stages': {
+            name: dict({f'p{percent}': round(percentile(values, percent), 3) for percent in PERCENTILES},
+                       max=round(max(values), 3), count=len(values))
+            for name, values in stages.items()
+        },
+        'cpu_percent': {name: round(value / seconds * 100, 1) if seconds else 0.0 for name, value in cpu.items()},
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Measures production throughput on simulated stations.')
+    parser.add_argument('--stations', type=int, default=2, help='Simulated stations (default: 2)')
+    parser.add_argument('--units', type=int, default=3, help='Units per station (default: 3)')
+    parser.add_argument('--mode', choices=('jobs', 'qt'), default='jobs', help='What runs the units (default: jobs)')
+    parser.add_argument('--config', default=os.path.join(ROOT, 'config.ini'), help='Base configuration (default: config.ini)')
+    parser.add_argument('--time-scale', type=float, default=1.0, help='Multiplies every simulated delay (default: 1.0)')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='Probability that a write_flash fails (default: 0)')
+    parser.add_argument('--no-factory', action='store_true', help='Skip the factory step')
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+    args = parser.parse_args(argv)
+
+    if args.mode == 'qt' and not has_pyqt():
+        print("qt: skipped, PyQt6 is not installed", file=sys.stderr)
+        return 0
+
+    # Everything the components print goes to stderr, so stdout carries only the report
+    cwd, stdout, sys.stdout = os.getcwd(), sys.stdout, sys.stderr
+    with tempfile.TemporaryDirectory(prefix='factory-sim-') as directory, \
+            SimulatedLine(directory, args.stations, args.stations * args.units, os.path.abspath(args.config),
+                          args.time_scale, args.fail_rate) as line:
+        # The device store, certificate ledger and metrics open their files in the working directory
+        os.chdir(directory)
+        app = None
+        try:
+            from components.devicestore.devicestore import DeviceStore
+            from components.station.station import load_stations
+            from components.utils.utils import get_utils
+
+            if args.mode == 'qt':
+                from PyQt6.QtCore import QCoreApplication
+                app = QCoreApplication([])
+            utils = get_utils(line.config_file)
+            stations = load_stations(line.config_file, utils)
+            store = DeviceStore()
+            run = run_qt if args.mode == 'qt' else run_jobs
+
+            before_self, before_children = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+            start = time.monotonic()
+            with ThreadPoolExecutor(max_workers=len(stations), thread_name_prefix='bench-station') as pool:
+                futures = [pool.submit(run, station, utils, store, line.order_no, args.units, not args.no_factory)
+                           for station in stations]
+                results = [result for future in futures for result in future.result()]
+            seconds = time.monotonic() - start
+            after_self, after_children = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+        finally:
+            os.chdir(cwd)
+            sys.stdout = stdout
+            del app
+
+    cpu = {
+        'app': (after_self.ru_utime + after_self.ru_stime) - (before_self.ru_utime + before_self.ru_stime),
+        'esptool': (after_children.ru_utime + after_children.ru_stime) - (before_children.ru_utime + before_children.ru_stime),
+    }
+    report = dict(summarize(results, seconds, cpu), mode=args.mode, stations=len(stations), time_scale=args.time_scale)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return 0
+    print(f"{report['mode']}: {report['units']} units on {report['stations']} stations in {report['seconds']:.1f} s "
+          f"(time scale {report['time_scale']}), {report['passed']} passed, {report['failed']} failed")
+    print(f"throughput  {report['units_per_hour']:.1f} units/hour")
+    print(f"cpu         app {report['cpu_percent']['app']:.1f} %   esptool {report['cpu_percent']['esptool']:.1f} %   (of one core)")
+    for name, stage in report['stages'].items():
+        print(f"{name:12} " + '   '.join(f"p{percent} {stage[f'p{percent}']:7.3f} s" for percent in PERCENTILES)
+              + f"   max {stage['max']:7.3f} s   ({stage['count']} runs)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
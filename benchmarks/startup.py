@@ -0,0 +1,90 @@
+"""
+Measures application startup in fresh interpreters.
+
+Every scenario runs in a new Python process, the way the kiosk starts the app, and
+the wall time until it is ready is reported (median, min and max over the runs):
+
+    config  import the settings module and load config.ini
+    cli     the headless 'stations' command, from launch to exit
+    gui     the main window built and one event loop pass, on the offscreen
+            Qt platform (skipped when PyQt6 is not installed)
+
+Usage:
+    python benchmarks/startup.py [--runs 10] [--config config.ini] [--json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = {
+    'config': [sys.executable, '-c',
+               'import sys; from components.utils.utils import get_utils; get_utils(sys.argv[1])', '{config}'],
+    'cli': [sys.executable, 'main.py', 'stations', '--config', '{config}'],
+    'gui': [sys.executable, '-c',
+            'import sys\n'
+            'from PyQt6.QtWidgets import QApplication\n'
+            'from components.gui.gui import SerialPortSelector\n'
+            'app = QApplication(sys.argv)\n'
+            'window = SerialPortSelector()\n'
+            'window.show()\n'
+            'app.processEvents()\n'
+            'window.close()\n'],
+}
+
+
+def has_pyqt() -> bool:
+    try:
+        import PyQt6.QtWidgets  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def measure(command, runs: int) -> list:
+    """Returns the wall time of every run of a command, in seconds."""
+    env = dict(os.environ, QT_QPA_PLATFORM='offscreen', PYTHONPATH=ROOT)
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Measures application startup in fresh interpreters.')
+    parser.add_argument('--runs', type=int, default=10, help='Runs per scenario (default: 10)')
+    parser.add_argument('--config', default='config.ini', help='Configuration file (default: config.ini)')
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+    args = parser.parse_args(argv)
+
+    results = {}
+    for name, command in SCENARIOS.items():
+        if name == 'gui' and not has_pyqt():
+            print(f"{name}: skipped, PyQt6 is not installed", file=sys.stderr)
+            continue
+        times = measure([part.format(config=args.config) for part in command], args.runs)
+        results[name] = {
+            'runs': len(times),
+            'median_ms': round(statistics.median(times) * 1000, 1),
+            'min_ms': round(min(times) * 1000, 1),
+            'max_ms': round(max(times) * 1000, 1),
+        }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for name, result in results.items():
+            print(f"{name:8} median {result['median_ms']:7.1f} ms   min {result['min_ms']:7.1f} ms   "
+                  f"max {result['max_ms']:7.1f} ms   ({result['runs']} runs)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,339 @@
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import time
+
+from typing import Dict, Iterable, List, Optional, Union
+
+
+ARCHIVE_SUFFIX = '.certpack'
+ARCHIVE_MAGIC = b'CERTPACK'
+ARCHIVE_VERSION = 1
+# magic, version, flags, device count, index offset, index size, SHA-256 of the index
+HEADER = struct.Struct('<8sHHIQQ32s')
+# Blobs start on this boundary, so every slice handed out is aligned
+BLOB_ALIGN = 16
+
+# Roles of a device's flashable certificate files, as ArtifactIndex.certificate names them
+CERTIFICATE_ROLES = ('secure_cert', 'data_provider')
+
+
+class ArchiveError(Exception):
+    """Raised when a certificate archive is malformed, truncated or fails its hash check."""
+
+
+class ArchivedFile:
+    """
+    One file inside a certificate archive.
+
+    data is a zero-copy slice of the archive's memory map. Backends that run
+    esptool in this process write it as it is; esptool processes get a file that is
+    extracted for the write (see path()) and deleted again by discard().
+    """
+
+    def __init__(self, archive: 'CertificateArchive', name: str, offset: int, size: int, sha256: str):
+        self.archive = archive
+        self.name = name
+        self.offset = offset
+        self.size = size
+        self.sha256 = sha256
+
+    @property
+    def data(self) -> memoryview:
+        return self.archive.view[self.offset:self.offset + self.size]
+
+    def verify(self) -> bool:
+        """Returns True if the file's contents still match the hash recorded when it was packed."""
+        return hashlib.sha256(self.data).hexdigest() == self.sha256
+
+    def path(self) -> str:
+        """Returns a file with the contents, extracting it; pair every call with discard()."""
+        return self.archive.extract(self)
+
+    def discard(self) -> None:
+        """Deletes the extracted file once no write uses it any more."""
+        self.archive.discard(self)
+
+    def __repr__(self):
+        return f"ArchivedFile({self.archive.path}#{self.name}, {self.size} bytes)"
+
+
+# A certificate file on disk (its path) or inside an archive
+CertificateSource = Union[str, ArchivedFile]
+
+
+def source_name(source: CertificateSource) -> str:
+    """Returns the file name of a certificate file."""
+    return source.name if isinstance(source, ArchivedFile) else os.path.basename(source)
+
+
+def source_size(source) -> int:
+    """Returns the size in bytes of a certificate file, or of an image passed as bytes."""
+    if isinstance(source, ArchivedFile):
+        return source.size
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return memoryview(source).nbytes
+    return os.path.getsize(source)
+
+
+def source_digest(source: CertificateSource) -> str:
+    """
+    Returns the SHA-256 of a certificate file.
+
+    Raises:
+        ArchiveError: If an archived file no longer matches its recorded hash.
+    """
+    if isinstance(source, ArchivedFile):
+        if not source.verify():
+            raise ArchiveError(f"{source} does not match its recorded hash")
+        return source.sha256
+    with open(source, 'rb') as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+def flash_source(source: CertificateSource, in_process: bool):
+    """
+    Returns what an esptool backend writes for a certificate file.
+
+    Args:
+        source (CertificateSource): Path or archived file.
+        in_process (bool): The backend runs esptool in this process and accepts bytes.
+
+    Returns:
+        A path, or the archived bytes as a zero-copy memoryview for in-process backends.
+    """
+    if isinstance(source, ArchivedFile):
+        return source.data if in_process else source.path()
+    return source
+
+
+def release_source(source: CertificateSource, in_process: bool) -> None:
+    """Deletes what flash_source extracted for an esptool process, once the write is over."""
+    if isinstance(source, ArchivedFile) and not in_process:
+        source.discard()
+
+
+class CertificateArchive:
+    """
+    Reader of a packed certificate archive (.certpack).
+
+    The archive holds the flashable certificate files of one order's devices: a
+    fixed header, the files back to back, and a JSON index at the end with every
+    file's offset, size and SHA-256, keyed by serial id. The file is memory-mapped,
+    so opening it reads only the header and index, and a device's files are slices
+    of the mapping that are never copied.
+
+    Files extracted for esptool processes hold device keys, so they only exist
+    while a write uses them; close() removes whatever is left. The archive can be
+    used as a context manager.
+
+    Args:
+        path (str): Archive file.
+
+    Raises:
+        ArchiveError: If the header or index is malformed or the index fails its hash check.
+    """
+
+    def __init__(self, path: str):
+        self.path = os.path.abspath(path)
+        with open(self.path, 'rb') as file:
+            size = os.fstat(file.fileno()).st_size
+            if size < HEADER.size:
+                raise ArchiveError(f"{self.path} is too short to be a certificate archive")
+            # The mapping stays valid after the file is closed
+            self.view = memoryview(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+
+        magic, version, _, count, index_offset, index_size, index_hash = HEADER.unpack_from(self.view)
+        if magic != ARCHIVE_MAGIC:
+            raise ArchiveError(f"{self.path} is not a certificate archive")
+        if version != ARCHIVE_VERSION:
+            raise ArchiveError(f"{self.path} has version {version}, only version {ARCHIVE_VERSION} can be read")
+        if index_offset + index_size > size:
+            raise ArchiveError(f"{self.path} is truncated")
+        index = self.view[index_offset:index_offset + index_size]
+        if hashlib.sha256(index).digest() != index_hash:
+            raise ArchiveError(f"The index of {self.path} does not match its hash")
+        self.index = json.loads(bytes(index))
+        if len(self.index['devices']) != count:
+            raise ArchiveError(f"{self.path} lists {len(self.index['devices'])} devices, its header {count}")
+
+        self.order_no = self.index.get('order', '')
+        self.devices: Dict[str, Dict] = self.index['devices']
+        self._by_uuid = {device['uuid']: serial_id for serial_id, device in self.devices.items()}
+        self._extract_lock = threading.Lock()
+        self._extract_dir = None
+        self._extracted: Dict[str, int] = {}  # Extracted path -> writes using it
+        self._closing = False
+
+    def __len__(self):
+        return len(self.devices)
+
+    def __enter__(self) -> 'CertificateArchive':
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def uuids(self) -> List[str]:
+        return list(self._by_uuid)
+
+    def serial_id(self, uuid: str) -> Optional[str]:
+        """Returns the serial id a certificate UUID was packed for."""
+        return self._by_uuid.get(uuid)
+
+    def certificate(self, uuid: str) -> Dict[str, ArchivedFile]:
+        """
+        Returns the certificate files of one device.
+
+        Returns:
+            Dict[str, ArchivedFile]: Files keyed by role ('secure_cert',
+            'data_provider'); empty if the UUID is not in the archive.
+        """
+        serial_id = self._by_uuid.get(uuid)
+        if serial_id is None:
+            return {}
+        return {role: ArchivedFile(self, **entry) for role, entry in self.devices[serial_id]['files'].items()}
+
+    def verify(self, uuids: Iterable[str] = None) -> List[str]:
+        """
+        Checks archived files against their recorded hashes.
+
+        Args:
+            uuids (Iterable[str], optional): Devices to check; all of them by default.
+
+        Returns:
+            List[str]: "<uuid>/<role>" of every file that does not match.
+        """
+        failed = []
+        for uuid in (self.uuids() if uuids is None else uuids):
+            for role, file in self.certificate(uuid).items():
+                if not file.verify():
+                    failed.append(f"{uuid}/{role}")
+        return failed
+
+    def extract(self, file: ArchivedFile) -> str:
+        """
+        Writes an archived file out for an esptool process and returns its path.
+
+        Files are checked against their hash and written to a private temporary
+        directory. A file extracted for several writes at once is shared; it is
+        deleted when the last of them calls discard().
+
+        Raises:
+            ArchiveError: If the file does not match its recorded hash.
+        """
+        with self._extract_lock:
+            self._closing = False
+            if self._extract_dir is None:
+                self._extract_dir = tempfile.mkdtemp(prefix='certpack-')
+            path = os.path.join(self._extract_dir, file.sha256[:16], file.name)
+            if path not in self._extracted:
+                if not file.verify():
+                    raise ArchiveError(f"{file} does not match its recorded hash")
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path + '.tmp', 'wb') as out:
+                    out.write(file.data)
+                os.replace(path + '.tmp', path)
+            self._extracted[path] = self._extracted.get(path, 0) + 1
+            return path
+
+    def discard(self, file: ArchivedFile) -> None:
+        """Releases one extract() of a file, deleting it when no write uses it any more."""
+        with self._extract_lock:
+            if self._extract_dir is None:
+                return
+            path = os.path.join(self._extract_dir, file.sha256[:16], file.name)
+            users = self._extracted.get(path, 0) - 1
+            if users > 0:
+                self._extracted[path] = users
+                return
+            self._extracted.pop(path, None)
+            shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+            if self._closing and not self._extracted:
+                self._remove_extract_dir()
+
+    def close(self) -> None:
+        """
+        Removes the files extracted for esptool processes.
+
+        Files still being written are removed by their discard(). The memory map
+        stays valid, as other stations may share the archive through the artifact
+        index; it is released with the archive.
+        """
+        with self._extract_lock:
+            if self._extracted:
+                self._closing = True
+            else:
+                self._remove_extract_dir()
+
+    def _remove_extract_dir(self) -> None:
+        if self._extract_dir is not None:
+            shutil.rmtree(self._extract_dir, ignore_errors=True)
+            self._extract_dir = None
+        self._closing = False
+
+
+def pack_certificates(devices: Iterable[Dict], output: str, order_no: str = '') -> Dict:
+    """
+    Packs the certificate files of many devices into one archive.
+
+    Args:
+        devices (Iterable[Dict]): Per device {'serial_id', 'uuid', 'files'}, files
+            mapping each role to its path, or to an ArchivedFile when repacking.
+        output (str): Archive to write; it is replaced atomically.
+        order_no (str): Order recorded in the archive's index.
+
+    Returns:
+        Dict: 'devices', 'files' and 'bytes' packed.
+
+    Raises:
+        OSError: If a file cannot be read or the archive cannot be written.
+        ArchiveError: If a file taken from another archive fails its hash check.
+    """
+    directory = os.path.dirname(os.path.abspath(output))
+    os.makedirs(directory, exist_ok=True)
+    handle, temporary = tempfile.mkstemp(prefix='.pack-', suffix=ARCHIVE_SUFFIX, dir=directory)
+    index = {'order': order_no, 'created': time.time(), 'devices': {}}
+    files = 0
+    try:
+        with os.fdopen(handle, 'wb') as archive:
+            archive.write(b'\0' * HEADER.size)
+            for device in devices:
+                entries = {}
+                for role, source in device['files'].items():
+                    if isinstance(source, ArchivedFile):
+                        if not source.verify():
+                            raise ArchiveError(f"{source} does not match its recorded hash")
+                        data = source.data
+                    else:
+                        with open(source, 'rb') as file:
+                            data = file.read()
+                    archive.write(b'\0' * (-archive.tell() % BLOB_ALIGN))
+                    entries[role] = {'name': source_name(source), 'offset': archive.tell(), 'size': len(data),
+                                     'sha256': hashlib.sha256(data).hexdigest()}
+                    archive.write(data)
+                    files += 1
+                index['devices'][device['serial_id']] = {'uuid': device['uuid'], 'files': entries}
+
+            index_data = json.dumps(index, sort_keys=True).encode('utf-8')
+            index_offset = archive.tell()
+            archive.write(index_data)
+            size = archive.tell()
+            archive.seek(0)
+            archive.write(HEADER.pack(ARCHIVE_MAGIC, ARCHIVE_VERSION, 0, len(index['devices']), index_offset,
+                                      len(index_data), hashlib.sha256(index_data).digest()))
+            archive.flush()
+            os.fsync(archive.fileno())
+        # mkstemp creates the file private to its owner; stations only need to read it
+        os.chmod(temporary, 0o644)
+        os.replace(temporary, output)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+    return {'devices': len(index['devices']), 'files': files, 'bytes': size}
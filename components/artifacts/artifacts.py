@@ -0,0 +1,227 @@
+import os
+import threading
+import time
+
+from typing import Dict, List, Optional
+
+from components.artifacts.archive import ARCHIVE_SUFFIX, ArchiveError, CertificateArchive, CertificateSource
+
+# Firmware roles and the file name keyword that identifies each of them
+FIRMWARE_ROLE_KEYWORDS = {
+    'bootloader': 'bootloader',
+    'partition-table': 'partition-table',
+    'ota_data_initial': 'ota_data_initial',
+}
+
+# Certificate roles and the suffix that follows the UUID in their file names
+SECURE_CERT_SUFFIX = '_esp_secure_cert.bin'
+DATA_PROVIDER_SUFFIX = '-partition.bin'
+
+
+class _RootIndex:
+    """Snapshot of every .bin file and certificate archive below one search directory."""
+
+    def __init__(self, root: str):
+        self.root = root
+        self.bin_files: List[str] = []  # In os.walk order, so lookups match find_bin_path
+        self.dir_mtimes: Dict[str, int] = {}
+        self.keyword_cache: Dict[str, Optional[str]] = {}
+        self.certs: Dict[str, Dict[str, CertificateSource]] = {}  # uuid -> {role: path or archived file}
+        self.serials: Dict[str, List[str]] = {}  # serial id -> uuids with a secure cert
+        self.archives: List[CertificateArchive] = []
+
+    def scan(self) -> None:
+        archives = []
+        for dirpath, dirs, files in os.walk(self.root):
+            try:
+                self.dir_mtimes[dirpath] = os.stat(dirpath).st_mtime_ns
+            except OSError:
+                continue
+            for file in files:
+                if file.endswith(ARCHIVE_SUFFIX) and not file.startswith('.'):
+                    archives.append(os.path.join(dirpath, file))
+                if not file.endswith(".bin"):
+                    continue
+                path = os.path.join(dirpath, file)
+                self.bin_files.append(path)
+                self._index_certificate(dirpath, file, path)
+        # Loose files win over archived copies of the same bundle
+        for path in archives:
+            self._index_archive(path)
+
+    def _index_archive(self, path: str) -> None:
+        try:
+            archive = CertificateArchive(path)
+        except (OSError, ArchiveError, ValueError, KeyError) as e:
+            print(f"Artifact index: skipping certificate archive {path}: {e}")
+            return
+        self.archives.append(archive)
+        for serial_id, device in archive.devices.items():
+            uuid = device['uuid']
+            certs = self.certs.setdefault(uuid, {})
+            for role, file in archive.certificate(uuid).items():
+                certs.setdefault(role, file)
+            uuids = self.serials.setdefault(serial_id, [])
+            if uuid not in uuids:
+                uuids.append(uuid)
+
+    def _index_certificate(self, dirpath: str, file: str, path: str) -> None:
+        if file.endswith(SECURE_CERT_SUFFIX):
+            uuid, role = file[:-len(SECURE_CERT_SUFFIX)], 'secure_cert'
+        elif file.endswith(DATA_PROVIDER_SUFFIX):
+            uuid, role = file[:-len(DATA_PROVIDER_SUFFIX)], 'data_provider'
+        else:
+            return
+
+        # The first espsecurecert bundle found for a UUID wins, like the directory walk did
+        self.certs.setdefault(uuid, {}).setdefault(role, path)
+        if role == 'secure_cert':
+            relative = os.path.relpath(dirpath, self.root).split(os.sep)
+            serial_id = relative[0] if relative and relative[0] != '.' else ''
+            uuids = self.serials.setdefault(serial_id, [])
+            if uuid not in uuids:
+                uuids.append(uuid)
+
+    def is_stale(self) -> bool:
+        """Returns True if any indexed directory gained, lost or renamed an entry."""
+        if self.root not in self.dir_mtimes:
+            return os.path.isdir(self.root)
+        for dirpath, mtime in self.dir_mtimes.items():
+            try:
+                if os.stat(dirpath).st_mtime_ns != mtime:
+                    return True
+            except OSError:
+                return True
+        return False
+
+    def find(self, keyword: str) -> Optional[str]:
+        if keyword not in self.keyword_cache:
+            self.keyword_cache[keyword] = next(
+                (path for path in self.bin_files if keyword in os.path.basename(path)), None
+            )
+        return self.keyword_cache[keyword]
+
+
+class ArtifactIndex:
+    """
+    Index of the firmware images and certificate binaries used for flashing.
+
+    Each search directory is walked once, on first use. After that, lookups by role,
+    keyword or certificate UUID are dictionary hits. Directory mtimes are re-checked
+    at most every check_interval seconds; when a directory changed (e.g. a new order
+    was copied into certificates/) that search directory is re-indexed.
+    """
+
+    def __init__(self, check_interval: float = 2.0):
+        self.check_interval = check_interval
+        self._roots: Dict[str, _RootIndex] = {}
+        self._last_checked: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def _root(self, search_directory: str) -> _RootIndex:
+        root = os.path.abspath(search_directory)
+        with self._lock:
+            index = self._roots.get(root)
+            now = time.monotonic()
+            if index is not None and now - self._last_checked[root] >= self.check_interval:
+                self._last_checked[root] = now
+                if index.is_stale():
+                    print(f"Artifact index: {root} changed, re-indexing.")
+                    for archive in index.archives:
+                        archive.close()
+                    index = None
+            if index is None:
+                index = _RootIndex(root)
+                index.scan()
+                self._roots[root] = index
+                self._last_checked[root] = now
+            return index
+
+    def build(self, *search_directories: str) -> None:
+        """Indexes the given directories up front, e.g. at application startup."""
+        for search_directory in search_directories:
+            if search_directory:
+                index = self._root(search_directory)
+                print(f"Artifact index: {len(index.bin_files)} images under {index.root}")
+                for archive in index.archives:
+                    print(f"Artifact index: {len(archive)} devices packed in {archive.path}")
+
+    def invalidate(self, search_directory: str = None) -> None:
+        """Drops the index of one search directory, or of all of them."""
+        with self._lock:
+            if search_directory is None:
+                self._roots.clear()
+                self._last_checked.clear()
+            else:
+                root = os.path.abspath(search_directory)
+                self._roots.pop(root, None)
+                self._last_checked.pop(root, None)
+
+    def close(self) -> None:
+        """Removes the certificate files extracted from archives for esptool processes."""
+        with self._lock:
+            archives = [archive for index in self._roots.values() for archive in index.archives]
+        for archive in archives:
+            archive.close()
+
+    def find(self, keyword: str, search_directory: str) -> Optional[str]:
+        """
+        Returns the first .bin file whose name contains the keyword.
+
+        Args:
+            keyword (str): Substring of the file name, e.g. 'bootloader' or 'rc'.
+            search_directory (str): Directory the file lives under.
+
+        Returns:
+            Optional[str]: Path of the matching file, or None if there is none.
+        """
+        return self._root(search_directory).find(keyword)
+
+    def firmware_images(self, search_directory: str, app_keyword: str) -> Dict[str, Optional[str]]:
+        """
+        Resolves all firmware images of one chip by role.
+
+        Args:
+            search_directory (str): Firmware directory of the chip.
+            app_keyword (str): File name keyword of the application image.
+
+        Returns:
+            Dict[str, Optional[str]]: Paths keyed by 'bootloader', 'partition-table',
+            'ota_data_initial' and 'app'. Missing images map to None.
+        """
+        index = self._root(search_directory)
+        images = {role: index.find(keyword) for role, keyword in FIRMWARE_ROLE_KEYWORDS.items()}
+        images['app'] = index.find(app_keyword)
+        return images
+
+    def certificate(self, uuid: str, search_directory: str) -> Dict[str, CertificateSource]:
+        """
+        Returns the certificate binaries of one device.
+
+        Args:
+            uuid (str): Certificate UUID, the prefix of the .bin file names.
+            search_directory (str): Root of the certificates tree.
+
+        Returns:
+            Dict[str, CertificateSource]: Paths keyed by 'secure_cert' and
+            'data_provider', or ArchivedFile entries for bundles that only exist in a
+            certificate archive (.certpack); empty if the UUID is unknown.
+        """
+        return dict(self._root(search_directory).certs.get(uuid, {}))
+
+    def certificate_uuids(self, serial_id: str, search_directory: str) -> List[str]:
+        """Returns the UUIDs of the secure cert bundles stored for a serial id."""
+        return list(self._root(search_directory).serials.get(serial_id, []))
+
+
+_shared_index = None
+_shared_index_lock = threading.Lock()
+
+
+def get_artifact_index() -> ArtifactIndex:
+    """Returns the process-wide artifact index shared by all flash jobs."""
+    global _shared_index
+    with _shared_index_lock:
+        if _shared_index is None:
+            _shared_index = ArtifactIndex()
+        return _shared_index
@@ -0,0 +1,39 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from PyQt6.QtCore import QThread, pyqtSignal
+from components.baudrate.profiles import BaudCalibrator, get_baud_profiles
+
+class BaudCalibrationThread(QThread):
+    rate_measured = pyqtSignal(str, int, float, int)  # Port, baud, kbit/s, errors
+    port_calibrated = pyqtSignal(str, int)  # Port, chosen baud (0 if no rate was stable)
+    all_finished = pyqtSignal()
+
+    def __init__(self, utils, ports):
+        """
+        Calibrates the baud rate of several flash ports at once, off the GUI thread.
+
+        Args:
+            utils (Utils): Loaded configuration and esptool helpers.
+            ports (list): Flash ports to calibrate.
+        """
+        super().__init__()
+        self.utils = utils
+        self.ports = list(ports)
+        self.calibrator = BaudCalibrator(
+            utils.get_esptool_backend(),
+            rates=utils.calibration_rates,
+            timeout=utils.timeout_esptool_probe,
+            on_result=lambda port, result: self.rate_measured.emit(port, result.baud, result.kbit_per_second, result.errors)
+        )
+
+    def run(self):
+        profiles = get_baud_profiles(self.utils.baud_profile_file)
+        with ThreadPoolExecutor(max_workers=max(1, len(self.ports))) as executor:
+            for port, results in zip(self.ports, executor.map(self.calibrator.calibrate, self.ports)):
+                best = profiles.store(port, results)
+                self.port_calibrated.emit(port, best.baud if best else 0)
+        self.all_finished.emit()
+
+    def stop(self):
+        """Abandons the calibration after the reads in progress."""
+        self.calibrator.cancel()
@@ -0,0 +1,208 @@
+import json
+import os
+import threading
+import time
+
+from typing import Callable, Dict, List, Optional
+
+from components.portmonitor.monitor import list_ports
+
+
+DEFAULT_CALIBRATION_RATES = (115200, 230400, 460800, 921600, 1500000, 2000000)
+
+
+def port_identity(port: str) -> str:
+    """
+    Identifies the adapter behind a serial port rather than its device name.
+
+    Returns:
+        str: "vid:pid:serial@location" for USB serial adapters, so a profile follows
+        its cable and USB-serial chip across re-enumeration; the port name otherwise.
+    """
+    info = list_ports().get(port)
+    return info.identity if info else port
+
+
+class RateResult:
+    """Throughput and errors measured at one baud rate."""
+
+    def __init__(self, baud: int, attempts: int = 0, errors: int = 0, kbit_per_second: float = 0.0):
+        self.baud = baud
+        self.attempts = attempts
+        self.errors = errors
+        self.kbit_per_second = kbit_per_second
+
+    @property
+    def stable(self) -> bool:
+        return self.attempts > 0 and self.errors == 0
+
+    def to_dict(self) -> dict:
+        return {'attempts': self.attempts, 'errors': self.errors, 'kbit_per_second': round(self.kbit_per_second, 1)}
+
+    def __repr__(self):
+        return f"RateResult({self.baud}, {self.kbit_per_second:.1f} kbit/s, {self.errors}/{self.attempts} errors)"
+
+
+class BaudCalibrator:
+    """
+    Finds the fastest stable baud rate of a port.
+
+    Rates are probed upwards. At each rate the same stretch of flash is read several
+    times; the flasher stub checks every read's digest, so a failed read is a link
+    error. Probing stops at the first rate with errors, and the stable rate with the
+    best measured throughput wins. That need not be the highest one: some USB-serial
+    chips run slower above their real limit.
+
+    Args:
+        backend: esptool backend the port is probed with.
+        rates (List[int]): Candidate baud rates.
+        size (int): Bytes read per attempt.
+        attempts (int): Reads per rate.
+        timeout (float): Seconds before one read is abandoned.
+    """
+
+    def __init__(self, backend, rates: List[int] = DEFAULT_CALIBRATION_RATES, size: int = 0x40000,
+                 attempts: int = 3, timeout: float = 60.0, on_result: Callable[[str, RateResult], None] = None):
+        self.backend = backend
+        self.rates = sorted(int(rate) for rate in rates)
+        self.size = size
+        self.attempts = attempts
+        self.timeout = timeout
+        self.on_result = on_result
+        from components.runner.process import CancelToken
+
+        self.cancel_token = CancelToken()
+
+    def measure(self, port: str, baud: int) -> RateResult:
+        """Reads flash at one rate and averages the throughput of the successful reads."""
+        from components.runner.backend import READ_PATTERN
+
+        result = RateResult(baud)
+        speeds = []
+        for _ in range(self.attempts):
+            if self.cancel_token.cancelled:
+                break
+            run = self.backend.read_flash(port, baud, 0, self.size, self.timeout, self.cancel_token)
+            result.attempts += 1
+            match = READ_PATTERN.search(run.stdout)
+            if not run.ok or not match or float(match.group(2)) <= 0:
+                result.errors += 1
+                continue
+            speeds.append(int(match.group(1)) * 8 / 1000 / float(match.group(2)))
+        result.kbit_per_second = sum(speeds) / len(speeds) if speeds else 0.0
+        return result
+
+    def calibrate(self, port: str) -> List[RateResult]:
+        """Probes a port's rates from slowest to fastest, stopping at the first unstable one."""
+        results = []
+        for baud in self.rates:
+            result = self.measure(port, baud)
+            results.append(result)
+            if self.on_result:
+                self.on_result(port, result)
+            if not result.stable or self.cancel_token.cancelled:
+                break
+        # Leave the port closed for whatever runs next
+        self.backend.close(port)
+        return results
+
+    def cancel(self) -> None:
+        self.cancel_token.cancel()
+
+
+def best_rate(results: List[RateResult]) -> Optional[RateResult]:
+    """Returns the stable rate with the highest throughput, if any."""
+    stable = [result for result in results if result.stable]
+    return max(stable, key=lambda result: result.kbit_per_second) if stable else None
+
+
+class BaudProfiles:
+    """
+    Calibrated baud rates per USB-serial adapter, stored as JSON.
+
+    Args:
+        path (str): Profile file, e.g. baud_profiles.json.
+    """
+
+    def __init__(self, path: str = 'baud_profiles.json'):
+        self.path = path
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._profiles: Dict[str, dict] = {}
+
+    def _load(self) -> None:
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            self._profiles, self._mtime = {}, None
+            return
+        if mtime == self._mtime:
+            return
+        try:
+            with open(self.path, 'r') as file:
+                self._profiles = json.load(file)
+        except (OSError, ValueError) as e:
+            print(f"Could not read baud profiles from {self.path}: {e}")
+            self._profiles = {}
+        self._mtime = mtime
+
+    def profile(self, port: str) -> Optional[dict]:
+        """Returns the stored profile of the adapter on a port, if it was calibrated."""
+        identity = port_identity(port)
+        with self._lock:
+            self._load()
+            return self._profiles.get(identity)
+
+    def baud_for(self, port: str, default) -> str:
+        """
+        Returns the calibrated baud rate of a port, or the configured one.
+
+        Args:
+            port (str): Serial port.
+            default: Baud rate from config.ini, used for uncalibrated ports.
+
+        Returns:
+            str: Baud rate, as the config values are strings.
+        """
+        profile = self.profile(port)
+        return str(profile['baud']) if profile else str(default)
+
+    def store(self, port: str, results: List[RateResult]) -> Optional[RateResult]:
+        """
+        Saves a port's calibration, keyed by its adapter identity.
+
+        Returns:
+            Optional[RateResult]: The rate that was stored, or None if no rate was
+            stable (the previous profile, if any, is kept).
+        """
+        best = best_rate(results)
+        if best is None:
+            return None
+        identity = port_identity(port)
+        with self._lock:
+            self._load()
+            self._profiles[identity] = {
+                'port': port,
+                'baud': best.baud,
+                'kbit_per_second': round(best.kbit_per_second, 1),
+                'measured_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'rates': {str(result.baud): result.to_dict() for result in results},
+            }
+            temp_path = self.path + '.tmp'
+            with open(temp_path, 'w') as file:
+                json.dump(self._profiles, file, indent=2)
+            os.replace(temp_path, self.path)
+            self._mtime = os.path.getmtime(self.path)
+        return best
+
+
+_profiles: Dict[str, BaudProfiles] = {}
+_profiles_lock = threading.Lock()
+
+
+def get_baud_profiles(path: str = 'baud_profiles.json') -> BaudProfiles:
+    """Returns the process-wide profile store of a file."""
+    with _profiles_lock:
+        if path not in _profiles:
+            _profiles[path] = BaudProfiles(path)
+        return _profiles[path]
@@ -0,0 +1,5 @@
+import sys
+
+from components.cli.cli import main
+
+sys.exit(main())
@@ -0,0 +1,294 @@
+import argparse
+import json
+import logging
+import sys
+import threading
+import time
+
+from typing import Dict, List, Optional, TextIO
+
+from components.config.config import ConfigError
+
+# Commands handled here rather than by the GUI; main.py dispatches on them before importing Qt
+COMMANDS = ('run', 'stations', 'pack-certs')
+
+
+class JsonLines:
+    """Writes one JSON object per line to a stream, from any thread."""
+
+    def __init__(self, stream: TextIO):
+        self.stream = stream
+        self._lock = threading.Lock()
+
+    def emit(self, event: str, **fields) -> None:
+        line = json.dumps({'event': event, 'time': round(time.time(), 3), **fields})
+        with self._lock:
+            self.stream.write(line + '\n')
+            self.stream.flush()
+
+
+class ReplugWaiter:
+    """
+    Blocks a station until its boards have been unplugged and a new set plugged in.
+
+    A station counts as replugged once one of its ports disappeared and all of its
+    ports are present again, so the next unit starts as soon as the operator has
+    swapped the boards in the jig.
+    """
+
+    def __init__(self, stations: List, interval: float = 1.0):
+        from components.portmonitor.monitor import FixtureMap, PortMonitor
+
+        self.fixtures = FixtureMap(stations)
+        self.monitor = PortMonitor(interval, on_added=self.on_added, on_removed=self.on_removed)
+        self._lock = threading.Lock()
+        self._unplugged = set()
+        self._replugged: Dict[str, threading.Event] = {station.name: threading.Event() for station in stations}
+
+    def start(self) -> None:
+        self.monitor.start()
+
+    def stop(self) -> None:
+        self.monitor.stop()
+
+    def on_removed(self, port) -> None:
+        station = self.fixtures.station_of(port)
+        if station is not None:
+            with self._lock:
+                self._unplugged.add(station)
+
+    def on_added(self, port) -> None:
+        station = self.fixtures.station_of(port)
+        with self._lock:
+            if station not in self._unplugged:
+                return
+        if station in self.fixtures.apply(self.monitor.ports()):
+            with self._lock:
+                self._unplugged.discard(station)
+            self._replugged[station].set()
+
+    def arm(self, station: str) -> None:
+        """Forgets earlier replugs; called when a unit starts."""
+        self._replugged[station].clear()
+
+    def wait(self, station: str, stop: threading.Event) -> bool:
+        """
+        Waits for the station's boards to be replugged.
+
+        Returns:
+            bool: False if stop was set first.
+        """
+        while not self._replugged[station].wait(0.5):
+            if stop.is_set():
+                return False
+        return not stop.is_set()
+
+
+def run_station(station, utils, args, events: JsonLines, stop: threading.Event,
+                waiter: Optional[ReplugWaiter]) -> List[bool]:
+    """
+    Runs units back-to-back on one station until the unit count, the order or stop ends it.
+
+    Returns:
+        List[bool]: Success of every unit run.
+    """
+    from components.station.pipeline import UnitPipeline
+
+    pipeline = UnitPipeline(station, utils, args.order, factory=not args.no_factory,
+                            on_stage=lambda name, stage, success: events.emit('stage', station=name, stage=stage, success=success))
+    results = []
+    try:
+        while not stop.is_set() and (args.units == 0 or len(results) < args.units):
+            if waiter is not None:
+                waiter.arm(station.name)
+            events.emit('unit_started', station=station.name, order=args.order)
+            result = pipeline.run()
+            if result.detail == 'order exhausted':
+                events.emit('order_exhausted', station=station.name, order=args.order)
+                break
+            results.append(result.success)
+            events.emit('unit', **result.to_dict())
+
+            if args.units and len(results) >= args.units:
+                break
+            if waiter is None:
+                # Without a replug the next unit would be the same board again
+                break
+            events.emit('waiting', station=station.name)
+            if not waiter.wait(station.name, stop):
+                break
+    finally:
+        # A record staged for a unit that will not run goes back to the pool
+        pipeline.close()
+    return results
+
+
+def command_run(args, events: JsonLines) -> int:
+    from concurrent.futures import ThreadPoolExecutor
+
+    from components.artifacts.artifacts import get_artifact_index
+    from components.station.station import load_stations
+    from components.utils.utils import get_utils
+
+    if args.no_wait and args.units != 1:
+        # Without a replug every further unit would burn a new serial id onto the same board
+        events.emit('error', message="--no-wait runs a single unit per station; use it with --units 1")
+        return 2
+
+    utils = get_utils(args.config)
+    stations = load_stations(args.config, utils)
+    if args.stations:
+        names = [name.strip() for name in args.stations.split(',') if name.strip()]
+        unknown = [name for name in names if name not in {station.name for station in stations}]
+        if unknown:
+            events.emit('error', message=f"Unknown stations: {', '.join(unknown)}")
+            return 2
+        stations = [station for station in stations if station.name in names]
+
+    if utils.metrics_http_port:
+        utils.get_metrics().serve(utils.metrics_http_port)
+
+    waiter = None if args.no_wait else ReplugWaiter(stations, utils.port_monitor_interval)
+    if waiter is not None:
+        waiter.start()
+        waiter.fixtures.apply(waiter.monitor.ports())
+
+    events.emit('started', order=args.order, stations=[station.name for station in stations])
+    start = time.monotonic()
+    stop = threading.Event()
+    pool = ThreadPoolExecutor(max_workers=max(1, len(stations)), thread_name_prefix='cli-station')
+    futures = [pool.submit(run_station, station, utils, args, events, stop, waiter) for station in stations]
+    try:
+        while not all(future.done() for future in futures):
+            time.sleep(0.2)
+    except KeyboardInterrupt:
+        print("Stopping after the units in progress...")
+        stop.set()
+    pool.shutdown(wait=True)
+    if waiter is not None:
+        waiter.stop()
+    # Every station is done, so the certificates extracted for their writes can go
+    get_artifact_index().close()
+
+    results = [success for future in futures for success in (future.result() if not future.exception() else [False])]
+    passed = sum(results)
+    events.emit('summary', order=args.order, units=len(results), passed=passed, failed=len(results) - passed,
+                seconds=round(time.monotonic() - start, 3))
+    return 0 if passed == len(results) else 1
+
+
+def command_stations(args, events: JsonLines) -> int:
+    from components.portmonitor.monitor import FixtureMap, list_ports
+    from components.station.station import load_stations
+    from components.utils.utils import get_utils
+
+    stations = load_stations(args.config, get_utils(args.config))
+    try:
+        assignment = FixtureMap(stations).assign(list_ports())
+    except ImportError:
+        assignment = {}
+    for station in stations:
+        events.emit('station', name=station.name, s3_port=station.s3_port, h2_port=station.h2_port,
+                    factory_port=station.factory_port, present=assignment.get(station.name, {}))
+    return 0
+
+
+def command_pack_certs(args, events: JsonLines) -> int:
+    import os
+
+    from components.artifacts.archive import ARCHIVE_SUFFIX, CertificateArchive, pack_certificates
+    from components.artifacts.artifacts import ArtifactIndex
+    from components.devicestore.devicestore import DeviceStore
+    from components.station.prefetch import certificate_uuid
+    from components.utils.utils import get_utils
+
+    utils = get_utils(args.config)
+    certs_dir = args.certificates or utils.filepath_certificatesS3 or 'certificates'
+    archive_path = args.archive or os.path.join(certs_dir, f"{args.order}{ARCHIVE_SUFFIX}")
+    records = DeviceStore(args.db).order_records(args.order)
+    if not records:
+        events.emit('error', message=f"Order {args.order} has no device records in {args.db}")
+        return 2
+
+    # A fresh index, so the bundles are resolved from what is on disk now
+    index = ArtifactIndex()
+    devices, missing = [], 0
+    for record in records:
+        uuid = certificate_uuid(record)
+        cert = index.certificate(uuid, certs_dir) if uuid else {}
+        if 'secure_cert' not in cert or 'data_provider' not in cert:
+            events.emit('missing', serial_id=record['serial_id'], uuid=uuid)
+            missing += 1
+            continue
+        devices.append({'serial_id': record['serial_id'], 'uuid': uuid,
+                        'files': {role: cert[role] for role in ('secure_cert', 'data_provider')}})
+
+    start = time.monotonic()
+    packed = pack_certificates(devices, archive_path, args.order)
+    with CertificateArchive(archive_path) as archive:
+        failed = archive.verify()
+    events.emit('packed', order=args.order, archive=os.path.abspath(archive_path), missing=missing,
+                corrupt=failed, seconds=round(time.monotonic() - start, 3), **packed)
+    return 1 if missing or failed else 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--config', default='config.ini', help='Configuration file (default: config.ini)')
+    common.add_argument('--output', default='-', help='File the JSON lines are appended to (default: stdout)')
+
+    parser = argparse.ArgumentParser(prog='python -m components.cli',
+                                     description='Runs the production line without the GUI and reports JSON lines on stdout.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', parents=[common], help='Flash and test units back-to-back')
+    run.add_argument('--order', required=True, help='Order the device records are claimed from')
+    run.add_argument('--stations', default='', help='Comma-separated station names (default: all configured stations)')
+    run.add_argument('--units', type=int, default=1, help='Units per station; 0 runs until the order is exhausted (default: 1)')
+    run.add_argument('--no-factory', action='store_true', help='Skip the factory sequence after flashing')
+    run.add_argument('--no-wait', action='store_true',
+                     help='Run one unit per station without watching for the boards to be replugged (requires --units 1)')
+    run.set_defaults(handler=command_run)
+
+    stations = commands.add_parser('stations', parents=[common], help='List the configured stations and the ports present')
+    stations.set_defaults(handler=command_stations)
+
+    pack = commands.add_parser('pack-certs', parents=[common],
+                               help="Pack an order's certificate binaries into one indexed archive")
+    pack.add_argument('--order', required=True, help='Order whose device records are packed')
+    pack.add_argument('--db', default='device_data.db', help='Device database (default: device_data.db)')
+    pack.add_argument('--certificates', default='',
+                      help='Certificates tree the binaries are read from (default: the configured S3 certificates directory)')
+    pack.add_argument('--archive', default='', help='Archive to write (default: <certificates>/<order>.certpack)')
+    pack.set_defaults(handler=command_pack_certs)
+    return parser
+
+
+def main(argv: List[str] = None) -> int:
+    """
+    Runs a CLI command.
+
+    stdout carries only the JSON lines; everything the components print goes to
+    stderr, so the output can be piped into another tool as it is.
+
+    Returns:
+        int: Process exit code; 1 if any unit failed, 2 for an invalid configuration.
+    """
+    args = build_parser().parse_args(argv)
+    stream = sys.stdout if args.output == '-' else open(args.output, 'a')
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(funcName)s - %(message)s',
+        handlers=[logging.StreamHandler(sys.stderr)]
+    )
+    stdout, sys.stdout = sys.stdout, sys.stderr
+    events = JsonLines(stream)
+    try:
+        return args.handler(args, events)
+    except ConfigError as e:
+        events.emit('error', message=f"{e.config_file} is invalid", problems=e.problems)
+        return 2
+    finally:
+        sys.stdout = stdout
+        if stream is not stdout:
+            stream.close()
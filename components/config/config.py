@@ -0,0 +1,451 @@
+import configparser
+import os
+import re
+
+from enum import Enum
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+ESPTOOL_BACKENDS = ('subprocess', 'library')
+
+# Flash sector size; every image and erase boundary must be aligned to it
+SECTOR_SIZE = 0x1000
+BAUD_RANGE = (9600, 5000000)
+
+# Marks a field without a default: a missing or empty value is a problem
+REQUIRED = object()
+
+
+class ConfigError(Exception):
+    """
+    Raised when config.ini has missing or invalid values.
+
+    Every problem in the file is collected before raising, so one run reports them all.
+
+    Args:
+        problems (List[str]): One line per problem, e.g. "[flash_firmware_esp32h2] ...".
+        config_file (str): File the problems were found in.
+    """
+
+    def __init__(self, problems: List[str], config_file: str = 'config.ini'):
+        self.problems = list(problems)
+        self.config_file = config_file
+        super().__init__(f"{config_file} has {len(self.problems)} problem(s):\n" + '\n'.join(f"  {problem}" for problem in self.problems))
+
+
+class EsptoolCommand(str, Enum):
+    """esptool commands the flash and erase sections can name; members compare equal to their names."""
+    WRITE_FLASH = 'write_flash'
+    ERASE_FLASH = 'erase_flash'
+    ERASE_REGION = 'erase_region'
+
+    def __str__(self):
+        return self.value
+
+
+class FactoryStep(str, Enum):
+    """Steps of the factory sequence that send a command configured in config.ini."""
+    READ_MAC = 'read_mac'
+    WRITE_PRODUCT_NAME = 'write_product_name'
+    READ_PRODUCT_NAME = 'read_product_name'
+    WRITE_SERIAL_NUMBER = 'write_serial_number'
+    READ_SERIAL_NUMBER = 'read_serial_number'
+    WRITE_MATTER_QR = 'write_matter_qr'
+    READ_MATTER_QR = 'read_matter_qr'
+    SAVE_DEVICE_DATA = 'save_device_data'
+
+    def __str__(self):
+        return self.value
+
+
+# Factory commands are addressed to a channel of the device, e.g. "FF:3;MAC?"
+FACTORY_COMMAND_PATTERN = re.compile(r'^FF:\d+;\S')
+
+
+def parse_text(value: str) -> str:
+    return value
+
+
+def parse_bool(value: str) -> bool:
+    states = configparser.ConfigParser.BOOLEAN_STATES
+    if value.lower() not in states:
+        raise ValueError("expected True or False")
+    return states[value.lower()]
+
+
+def parse_int(value: str) -> int:
+    try:
+        number = int(value, 0)
+    except ValueError:
+        raise ValueError("expected an integer") from None
+    if number < 0:
+        raise ValueError("must not be negative")
+    return number
+
+
+def parse_float(value: str) -> float:
+    try:
+        number = float(value)
+    except ValueError:
+        raise ValueError("expected a number") from None
+    if number < 0:
+        raise ValueError("must not be negative")
+    return number
+
+
+def parse_address(value: str) -> int:
+    """Parses a flash offset such as 0x10000; it must be sector aligned."""
+    try:
+        address = int(value, 0)
+    except ValueError:
+        raise ValueError("expected a flash address such as 0x10000") from None
+    if address < 0:
+        raise ValueError("must not be negative")
+    if address % SECTOR_SIZE:
+        raise ValueError(f"must be a multiple of 0x{SECTOR_SIZE:x}")
+    return address
+
+
+def parse_baud(value: str) -> int:
+    try:
+        baud = int(value)
+    except ValueError:
+        raise ValueError("expected a baud rate such as 921600") from None
+    if not BAUD_RANGE[0] <= baud <= BAUD_RANGE[1]:
+        raise ValueError(f"must be between {BAUD_RANGE[0]} and {BAUD_RANGE[1]}")
+    return baud
+
+
+def parse_bauds(value: str) -> List[int]:
+    return [parse_baud(rate.strip()) for rate in value.split(',') if rate.strip()]
+
+
+def parse_tcp_port(value: str) -> int:
+    port = parse_int(value)
+    if port > 65535:
+        raise ValueError("must be between 0 and 65535")
+    return port
+
+
+def choice(*values: str) -> Callable[[str], str]:
+    """Returns a parser that accepts one of the given values, case-insensitively, and returns that value."""
+    def parse(value: str) -> str:
+        for allowed in values:
+            if value.lower() == allowed:
+                return allowed
+        raise ValueError(f"expected one of {', '.join(values)}")
+    return parse
+
+
+def parse_factory_command(value: str) -> str:
+    if not FACTORY_COMMAND_PATTERN.match(value):
+        raise ValueError("expected a device command such as FF:3;MAC?")
+    return value
+
+
+# Short station keys and the settings they override
+STATION_ALIASES = {
+    's3_port': 'flash_firmware_esp32s3_port',
+    's3_baud': 'flash_firmware_esp32s3_baud',
+    's3_usb': 'flash_firmware_esp32s3_usb',
+    'h2_port': 'flash_firmware_esp32h2_port',
+    'h2_baud': 'flash_firmware_esp32h2_baud',
+    'h2_usb': 'flash_firmware_esp32h2_usb',
+    'factory_port': 'factory_esp32s3_port',
+    'factory_baud': 'factory_esp32s3_baud',
+    'factory_usb': 'factory_esp32s3_usb',
+    'auto_start': 'station_auto_start',
+}
+
+
+class _Source:
+    """
+    Looks settings up in a parsed config file, optionally through a station section.
+
+    A station section's own keys, full names or the short aliases above, win over the
+    section the setting normally lives in.
+    """
+
+    def __init__(self, parser: configparser.ConfigParser, station_section: str = None):
+        self.parser = parser
+        self.station_section = station_section
+        self.overrides: Dict[str, str] = {}
+        if station_section:
+            defaults = parser.defaults()
+            for key, value in parser[station_section].items():
+                # Keys inherited from [DEFAULT] are not overrides unless the station changed them
+                if key not in defaults or defaults[key] != value:
+                    self.overrides[STATION_ALIASES.get(key, key)] = value
+
+    def get(self, section: str, key: str) -> Optional[str]:
+        if key in self.overrides:
+            return self.overrides[key]
+        if section == 'DEFAULT':
+            return self.parser.defaults().get(key)
+        if not self.parser.has_section(section):
+            return None
+        return self.parser[section].get(key)
+
+    def where(self, section: str, key: str) -> str:
+        """Returns the section a problem with a key should be reported in."""
+        return self.station_section if key in self.overrides else section
+
+
+class SettingsGroup:
+    """
+    A typed group of settings read from one config.ini section.
+
+    Subclasses list their settings in FIELDS as (attribute, key, parser, default);
+    keys are prefixed with the prefix the group is read with. Groups are read-only.
+    """
+
+    FIELDS: Tuple[Tuple[str, str, Callable[[str], Any], Any], ...] = ()
+
+    def __init__(self, section: str, values: Dict[str, Any]):
+        self.section = section
+        for attribute, value in values.items():
+            setattr(self, attribute, value)
+        self._frozen = True
+
+    def __setattr__(self, name, value):
+        if getattr(self, '_frozen', False):
+            raise AttributeError(f"Configuration is read-only, cannot set {name}")
+        super().__setattr__(name, value)
+
+    def __repr__(self):
+        values = ', '.join(f"{attribute}={getattr(self, attribute)!r}" for attribute, _, _, _ in self.FIELDS)
+        return f"{type(self).__name__}([{self.section}] {values})"
+
+    @classmethod
+    def keys(cls, prefix: str) -> List[str]:
+        return [prefix + key for _, key, _, _ in cls.FIELDS]
+
+    @classmethod
+    def read(cls, source: _Source, section: str, prefix: str, problems: List[str]) -> 'SettingsGroup':
+        values = {}
+        for attribute, key, parse, default in cls.FIELDS:
+            key = prefix + key
+            raw = source.get(section, key)
+            raw = raw.strip() if raw is not None else ''
+            values[attribute] = None if default is REQUIRED else default
+            if not raw:
+                if default is REQUIRED:
+                    problems.append(f"[{source.where(section, key)}] {key}: missing")
+                continue
+            try:
+                values[attribute] = parse(raw)
+            except ValueError as e:
+                problems.append(f"[{source.where(section, key)}] {key} = {raw}: {e}")
+        group = cls(section, values)
+        group.validate(problems)
+        return group
+
+    def validate(self, problems: List[str]) -> None:
+        """Adds problems that involve more than one field."""
+
+
+class GeneralSettings(SettingsGroup):
+    FIELDS = (
+        ('tool_path', 'tool_path', parse_text, 'esptool.py'),
+        ('esptool_backend', 'esptool_backend', choice(*ESPTOOL_BACKENDS), 'subprocess'),
+        ('baud_profile_file', 'baud_profile_file', parse_text, 'baud_profiles.json'),
+        ('baud_calibration_rates', 'baud_calibration_rates', parse_bauds, None),
+        ('esptool_probe_timeout', 'esptool_probe_timeout', parse_float, 30.0),
+        ('esptool_flash_timeout', 'esptool_flash_timeout', parse_float, 300.0),
+        ('port_monitor_interval', 'port_monitor_interval', parse_float, 1.0),
+        ('station_auto_start', 'station_auto_start', parse_bool, False),
+        ('metrics_file', 'metrics_file', parse_text, 'metrics.prom'),
+        ('metrics_http_port', 'metrics_http_port', parse_tcp_port, 0),
+        ('order_file_path', 'order_file_path', parse_text, ''),
+    )
+
+    def validate(self, problems: List[str]) -> None:
+        for attribute in ('esptool_probe_timeout', 'esptool_flash_timeout', 'port_monitor_interval'):
+            if getattr(self, attribute) == 0:
+                problems.append(f"[DEFAULT] {attribute}: must be above 0")
+
+
+class EraseSettings(SettingsGroup):
+    FIELDS = (
+        ('enable', 'enable', parse_bool, False),
+        ('command', 'command', choice(EsptoolCommand.ERASE_FLASH, EsptoolCommand.ERASE_REGION), EsptoolCommand.ERASE_FLASH),
+        ('start_address', 'start_address', parse_address, 0),
+        ('end_address', 'end_address', parse_address, None),
+    )
+
+    def validate(self, problems: List[str]) -> None:
+        if self.enable and self.command == EsptoolCommand.ERASE_REGION and self.end_address is None:
+            problems.append(f"[{self.section}] end_address is required for {EsptoolCommand.ERASE_REGION}")
+        if self.enable and self.end_address is not None and self.end_address <= self.start_address:
+            problems.append(f"[{self.section}] end_address 0x{self.end_address:x} must be above start_address 0x{self.start_address:x}")
+
+
+class FlashSettings(SettingsGroup):
+    FIELDS = (
+        ('filepath', 'filepath', parse_text, ''),
+        ('port', 'port', parse_text, ''),
+        ('usb', 'usb', parse_text, ''),
+        ('baud', 'baud', parse_baud, REQUIRED),
+        ('command', 'command', choice(EsptoolCommand.WRITE_FLASH), EsptoolCommand.WRITE_FLASH),
+        ('bootloader_address', 'bootloader_address', parse_address, REQUIRED),
+        ('partition_table_address', 'partition_table_address', parse_address, REQUIRED),
+        ('ota_data_initial_address', 'ota_data_initial_address', parse_address, None),
+        ('firmware_address', 'address', parse_address, REQUIRED),
+        ('use_esptool', 'use_esptool', parse_bool, False),
+        ('combined', 'combined', parse_bool, False),
+        ('differential', 'differential', parse_bool, False),
+    )
+
+    def addresses(self) -> Dict[str, int]:
+        """Returns the configured image addresses, keyed by attribute."""
+        names = ('bootloader_address', 'partition_table_address', 'ota_data_initial_address', 'firmware_address')
+        return {name: getattr(self, name) for name in names if getattr(self, name) is not None}
+
+    def validate(self, problems: List[str]) -> None:
+        seen = {}
+        for name, address in self.addresses().items():
+            if address in seen:
+                problems.append(f"[{self.section}] {name} and {seen[address]} are both 0x{address:x}")
+            seen[address] = name
+
+
+class DacSettings(SettingsGroup):
+    FIELDS = (
+        ('filepath', 'flash_cert_esp32s3_filepath', parse_text, ''),
+        ('command', 'flash_cert_esp32s3_command', choice(EsptoolCommand.WRITE_FLASH), EsptoolCommand.WRITE_FLASH),
+        ('secure_cert_partition', 'flash_dac_esp32s3_secure_cert_partition', parse_address, REQUIRED),
+        ('data_provider_partition', 'flash_dac_esp32s3_data_provider_partition', parse_address, REQUIRED),
+        ('use_esptool', 'flash_dac_esp32s3_use_esptool', parse_bool, False),
+    )
+
+
+class FactorySettings(SettingsGroup):
+    FIELDS = (
+        ('port', 'port', parse_text, ''),
+        ('usb', 'usb', parse_text, ''),
+        ('baud', 'baud', parse_baud, REQUIRED),
+        ('read_timeout', 'read_timeout', parse_float, 0.5),
+        ('prompt_timeout', 'prompt_timeout', parse_float, 0.0),
+        ('password', 'password', parse_text, ''),
+        ('command_timeout', 'command_timeout', parse_float, 2.0),
+        ('command_retries', 'command_retries', parse_int, 2),
+    )
+
+
+# Groups of Settings: (attribute, class, section, key prefix)
+GROUPS = (
+    ('general', GeneralSettings, 'DEFAULT', ''),
+    ('erase_s3', EraseSettings, 'erase_flash_esp32s3', 'erase_flash_esp32s3_'),
+    ('erase_h2', EraseSettings, 'erase_flash_esp32h2', 'erase_flash_esp32h2_'),
+    ('flash_s3', FlashSettings, 'flash_firmware_esp32s3', 'flash_firmware_esp32s3_'),
+    ('flash_h2', FlashSettings, 'flash_firmware_esp32h2', 'flash_firmware_esp32h2_'),
+    ('dac', DacSettings, 'flash_dac_esp32s3', ''),
+    ('factory', FactorySettings, 'factory_esp32s3', 'factory_esp32s3_'),
+)
+
+# Factory sequence commands: (step, section, key)
+FACTORY_COMMANDS = (
+    (FactoryStep.READ_MAC, 'read_mac_address', 'read_mac_address_command'),
+    (FactoryStep.WRITE_PRODUCT_NAME, 'write_product_name', 'write_product_name_command'),
+    (FactoryStep.READ_PRODUCT_NAME, 'read_product_name', 'read_product_name_command'),
+    (FactoryStep.WRITE_SERIAL_NUMBER, 'write_serial_number', 'write_serial_number_command'),
+    (FactoryStep.READ_SERIAL_NUMBER, 'read_serial_number', 'read_serial_number_command'),
+    (FactoryStep.WRITE_MATTER_QR, 'write_matter_qr', 'write_matter_qr_command'),
+    (FactoryStep.READ_MATTER_QR, 'read_matter_qr', 'read_matter_qr_command'),
+    (FactoryStep.SAVE_DEVICE_DATA, 'save_device_data', 'save_device_data_command'),
+)
+PRODUCT_NAME = ('read_product_name', 'read_product_name_data')
+
+
+class Settings:
+    """
+    Typed, validated contents of config.ini.
+
+    Addresses and bauds are ints, esptool commands are EsptoolCommand members and
+    factory_commands maps every FactoryStep to the device command it sends.
+    stations maps every [station_<name>] section to the Settings that station runs
+    with: the file's values with the section's overrides applied.
+
+    Args:
+        parser (configparser.ConfigParser): The parsed file.
+    """
+
+    def __init__(self, parser: configparser.ConfigParser, general: GeneralSettings, erase_s3: EraseSettings,
+                 erase_h2: EraseSettings, flash_s3: FlashSettings, flash_h2: FlashSettings, dac: DacSettings,
+                 factory: FactorySettings, factory_commands: Dict[FactoryStep, str], product_name: str,
+                 stations: Dict[str, 'Settings'] = None):
+        self.parser = parser
+        self.general = general
+        self.erase_s3 = erase_s3
+        self.erase_h2 = erase_h2
+        self.flash_s3 = flash_s3
+        self.flash_h2 = flash_h2
+        self.dac = dac
+        self.factory = factory
+        self.factory_commands = dict(factory_commands)
+        self.product_name = product_name
+        self.stations = dict(stations or {})
+
+    def station(self, name: str) -> 'Settings':
+        """Returns the settings of a station, or the file's own ones if it has no section."""
+        return self.stations.get(name, self)
+
+    @classmethod
+    def read(cls, parser: configparser.ConfigParser, problems: List[str], station_section: str = None) -> 'Settings':
+        source = _Source(parser, station_section)
+        groups = {attribute: group.read(source, section, prefix, problems) for attribute, group, section, prefix in GROUPS}
+        commands = {}
+        for step, section, key in FACTORY_COMMANDS:
+            raw = (source.get(section, key) or '').strip()
+            commands[step] = raw
+            if not raw:
+                problems.append(f"[{source.where(section, key)}] {key}: missing")
+                continue
+            try:
+                parse_factory_command(raw)
+            except ValueError as e:
+                problems.append(f"[{source.where(section, key)}] {key} = {raw}: {e}")
+        product_name = (source.get(*PRODUCT_NAME) or '').strip()
+
+        dac, flash_s3 = groups['dac'], groups['flash_s3']
+        for name in ('secure_cert_partition', 'data_provider_partition'):
+            address = getattr(dac, name)
+            for image, image_address in flash_s3.addresses().items():
+                if address is not None and address == image_address:
+                    problems.append(f"[{dac.section}] {name} 0x{address:x} is also the S3 {image}")
+
+        if station_section:
+            known = set(STATION_ALIASES) | {key for _, _, key in FACTORY_COMMANDS} | {PRODUCT_NAME[1]}
+            for _, group, _, prefix in GROUPS:
+                known.update(group.keys(prefix))
+            defaults = parser.defaults()
+            for key in parser[station_section]:
+                if key not in known and key not in defaults:
+                    problems.append(f"[{station_section}] {key}: unknown setting")
+        return cls(parser, factory_commands=commands, product_name=product_name, **groups)
+
+
+def load_settings(config_file: str = 'config.ini') -> Settings:
+    """
+    Reads and validates a config file, including every station section.
+
+    Raises:
+        ConfigError: The file is missing or has invalid values.
+    """
+    if not os.path.isfile(config_file):
+        raise ConfigError([f"{config_file}: file not found"], config_file)
+    parser = configparser.ConfigParser()
+    try:
+        parser.read(config_file)
+    except configparser.Error as e:
+        raise ConfigError([str(e)], config_file) from None
+
+    problems = []
+    settings = Settings.read(parser, problems)
+    for section in parser.sections():
+        if section.startswith('station_'):
+            settings.stations[section[len('station_'):]] = Settings.read(parser, problems, section)
+    if problems:
+        # Station sections re-read the shared sections, so their problems repeat
+        raise ConfigError(list(dict.fromkeys(problems)), config_file)
+    return settings
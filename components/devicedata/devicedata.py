@@ -0,0 +1,25 @@
+from PyQt6.QtCore import QThread, pyqtSignal
+from components.devicedata.importer import DeviceDataImporter
+
+class DeviceDataImportThread(QThread):
+    progress = pyqtSignal(int)  # Rows written so far
+    import_finished = pyqtSignal(int, int, float)  # Rows, skipped lines (malformed or cert id conflicts), rows per second
+    import_failed = pyqtSignal(str)
+
+    def __init__(self, device_data_file, db_name='device_data.db'):
+        super().__init__()
+        self.device_data_file = device_data_file
+        self.importer = DeviceDataImporter(db_name)
+
+    def run(self):
+        """Imports the device data file without blocking the GUI thread."""
+        try:
+            result = self.importer.import_file(self.device_data_file, on_progress=self.progress.emit)
+        except FileNotFoundError:
+            self.import_failed.emit(f"File not found: {self.device_data_file}")
+            return
+        except Exception as e:
+            self.import_failed.emit(f"An error occurred while processing the device data: {e}")
+            return
+        print(f"Device data import: {result}")
+        self.import_finished.emit(result.rows, result.skipped, result.rows_per_second)
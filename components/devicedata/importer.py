@@ -0,0 +1,163 @@
+import time
+
+from typing import Callable, Iterator, Optional, Tuple
+
+from components.devicestore.devicestore import connect, migrate
+
+
+# Keys of a device_data.txt record, in the order of the devices table columns
+DEVICE_FIELDS = (
+    ('order-no', 'order_no'),
+    ('mac-address', 'mac_address'),
+    ('serial-id', 'serial_id'),
+    ('cert-id', 'cert_id'),
+    ('esp-secure-cert-partition', 'esp_secure_cert_partition'),
+    ('commissionable-data-provider-partition', 'commissionable_data_provider_partition'),
+    ('qrcode', 'qrcode'),
+    ('manualcode', 'manualcode'),
+    ('discriminator', 'discriminator'),
+    ('passcode', 'passcode'),
+)
+DEVICE_COLUMNS = tuple(column for _, column in DEVICE_FIELDS)
+INTEGER_FIELDS = ('discriminator', 'passcode')
+
+# Re-importing a file updates the existing rows. A MAC address already recorded for a
+# device is kept when the file does not carry one. A record whose cert_id belongs to
+# another serial id changes nothing, whether it is new or moves an existing serial id.
+UPSERT_DEVICE = f'''
+    INSERT INTO devices ({', '.join(DEVICE_COLUMNS)})
+    VALUES ({', '.join('?' for _ in DEVICE_COLUMNS)})
+    ON CONFLICT(serial_id) DO UPDATE SET
+        order_no = excluded.order_no,
+        mac_address = COALESCE(NULLIF(excluded.mac_address, ''), devices.mac_address),
+        cert_id = excluded.cert_id,
+        esp_secure_cert_partition = excluded.esp_secure_cert_partition,
+        commissionable_data_provider_partition = excluded.commissionable_data_provider_partition,
+        qrcode = excluded.qrcode,
+        manualcode = excluded.manualcode,
+        discriminator = excluded.discriminator,
+        passcode = excluded.passcode
+    WHERE NOT EXISTS (
+        SELECT 1 FROM devices d WHERE d.cert_id = excluded.cert_id AND d.serial_id != excluded.serial_id
+    )
+    ON CONFLICT(cert_id) DO NOTHING
+'''
+
+
+def parse_device_line(line: str) -> Optional[Tuple]:
+    """
+    Parses one device_data.txt record in a single pass.
+
+    Args:
+        line (str): A line such as "order-no: X, mac-address: , serial-id: A0900...".
+
+    Returns:
+        Optional[Tuple]: Column values in DEVICE_COLUMNS order, or None if the line is
+        not a device record or is missing a field.
+    """
+    if 'order-no' not in line:
+        return None
+
+    values = {}
+    for part in line.split(','):
+        key, _, value = part.partition(':')
+        values[key.strip()] = value.strip()
+
+    try:
+        record = []
+        for key, _ in DEVICE_FIELDS:
+            value = values[key]
+            record.append(int(value) if key in INTEGER_FIELDS else value)
+        return tuple(record)
+    except (KeyError, ValueError):
+        return None
+
+
+class ImportResult:
+    """Outcome of one import run."""
+
+    def __init__(self, rows: int, skipped: int, seconds: float):
+        self.rows = rows
+        self.skipped = skipped
+        self.seconds = seconds
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds > 0 else float(self.rows)
+
+    def __str__(self):
+        return (f"{self.rows} rows imported, {self.skipped} lines skipped "
+                f"in {self.seconds:.2f}s ({self.rows_per_second:.0f} rows/s)")
+
+
+class DeviceDataImporter:
+    """
+    Streams device_data.txt into the devices table.
+
+    The file is read line by line and written with executemany in batches, all inside
+    a single transaction, so a failed import leaves the database untouched. Imports
+    are idempotent: each record is upserted on serial_id, and a record whose cert_id
+    already belongs to another serial id is skipped rather than duplicated. The
+    allocation status of existing records is left as it is.
+    """
+
+    def __init__(self, db_name: str = 'device_data.db', batch_size: int = 1000):
+        self.db_name = db_name
+        self.batch_size = batch_size
+
+    @staticmethod
+    def _write(conn, batch: list, counts: dict) -> None:
+        # Records the upsert left alone for a cert_id of another serial id count as skipped
+        changes = conn.total_changes
+        conn.executemany(UPSERT_DEVICE, batch)
+        written = conn.total_changes - changes
+        counts['rows'] += written
+        counts['skipped'] += len(batch) - written
+
+    def _records(self, device_data_file: str, counts: dict) -> Iterator[Tuple]:
+        with open(device_data_file, 'r') as file:
+            for line in file:
+                if not line.strip():
+                    continue
+                record = parse_device_line(line)
+                if record is None:
+                    counts['skipped'] += 1
+                    continue
+                yield record
+
+    def import_file(self, device_data_file: str,
+                    on_progress: Optional[Callable[[int], None]] = None) -> ImportResult:
+        """
+        Imports every record of a device data file.
+
+        Args:
+            device_data_file (str): Path to the file containing device data.
+            on_progress (Callable[[int], None], optional): Called with the number of
+                rows written so far after each batch.
+
+        Returns:
+            ImportResult: Row counts and throughput of the import.
+        """
+        start = time.monotonic()
+        counts = {'rows': 0, 'skipped': 0}
+
+        conn = connect(self.db_name)
+        try:
+            migrate(conn)
+            with conn:
+                batch = []
+                for record in self._records(device_data_file, counts):
+                    batch.append(record)
+                    if len(batch) >= self.batch_size:
+                        self._write(conn, batch, counts)
+                        batch.clear()
+                        if on_progress:
+                            on_progress(counts['rows'])
+                if batch:
+                    self._write(conn, batch, counts)
+                    if on_progress:
+                        on_progress(counts['rows'])
+        finally:
+            conn.close()
+
+        return ImportResult(counts['rows'], counts['skipped'], time.monotonic() - start)
@@ -0,0 +1,176 @@
+import os
+import sqlite3
+import threading
+
+from typing import Dict, List, Optional
+
+from components.devicestore.devicestore import DeviceStore
+
+
+# Bytes at the start of the file and before the parsed offset that must be unchanged
+# for the file to count as appended to
+SAMPLE_SIZE = 256
+
+
+def order_of_line(line: bytes) -> Optional[str]:
+    """
+    Returns the order number of a device_data.txt line, e.g. "order-no: X, mac-address: , ...".
+
+    Returns:
+        Optional[str]: The order number, or None if the line names none.
+    """
+    start = line.find(b'order-no:')
+    if start < 0:
+        return None
+    start += len(b'order-no:')
+    end = line.find(b',', start)
+    order_no = line[start:end if end >= 0 else len(line)].strip().decode('utf-8', 'replace')
+    return order_no or None
+
+
+class OrderIndex:
+    """
+    The distinct orders of a device data file, with per-order unit counts.
+
+    The file is parsed once; later calls re-check its size and mtime and, when it
+    grew and its first bytes and the bytes before the parsed offset are unchanged
+    (it was appended to), parse just the new lines, so a refresh costs the same no
+    matter how large the file is. A file that was rewritten or replaced is parsed
+    again from the start. Unit counts come from the device database with a single
+    grouped query, which is only re-run after another connection changed the
+    database.
+
+    Args:
+        file_path (str): Device data file, e.g. device_data.txt.
+        store (DeviceStore, optional): Device records the flashed and remaining
+            counts are taken from.
+    """
+
+    def __init__(self, file_path: str, store: DeviceStore = None):
+        self.file_path = file_path
+        self.store = store
+        self._lock = threading.Lock()
+        self._totals: Dict[str, int] = {}  # Order -> record lines, in order of first appearance
+        self._pending: Optional[str] = None  # Order of a last line without a newline yet
+        self._offset = 0
+        self._head = b''
+        self._tail = b''
+        self._stat = None
+        self._db_counts: Dict[str, Dict] = {}
+        self._db_version = None
+
+    def orders(self) -> List[str]:
+        """Returns the distinct order numbers of the file, in order of first appearance."""
+        with self._lock:
+            self._refresh()
+            return list(self._file_totals())
+
+    def counts(self) -> List[Dict]:
+        """
+        Returns every order with its unit counts.
+
+        Orders of the file come first, in file order, followed by orders that are only
+        in the device database.
+
+        Returns:
+            List[Dict]: 'order_no', 'total', 'flashed', 'rejected' and 'remaining'
+            units per order. Orders not imported yet count all of their units as
+            remaining.
+        """
+        with self._lock:
+            self._refresh()
+            totals = self._file_totals()
+            database = self._database_counts()
+        summaries = []
+        for order_no in list(totals) + [order_no for order_no in database if order_no not in totals]:
+            row = database.get(order_no, {})
+            total = max(totals.get(order_no, 0), row.get('total') or 0)
+            flashed, rejected = row.get('flashed') or 0, row.get('rejected') or 0
+            summaries.append({'order_no': order_no, 'total': total, 'flashed': flashed, 'rejected': rejected,
+                              'remaining': max(0, total - flashed - rejected)})
+        return summaries
+
+    def _file_totals(self) -> Dict[str, int]:
+        totals = dict(self._totals)
+        if self._pending:
+            totals[self._pending] = totals.get(self._pending, 0) + 1
+        return totals
+
+    def _refresh(self) -> None:
+        try:
+            stat = os.stat(self.file_path)
+        except FileNotFoundError:
+            print(f"File not found: {self.file_path}")
+            self._reset()
+            return
+        key = (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        if key == self._stat:
+            return
+
+        try:
+            with open(self.file_path, 'rb') as file:
+                if not self._appended(file, stat):
+                    self._reset()
+                file.seek(self._offset)
+                data = file.read()
+        except OSError as e:
+            print(f"An error occurred while reading the file: {e}")
+            return
+
+        # Only complete lines move the offset; a last line without a newline may still be written
+        complete = data.rfind(b'\n') + 1
+        for line in data[:complete].splitlines():
+            order_no = order_of_line(line)
+            if order_no:
+                self._totals[order_no] = self._totals.get(order_no, 0) + 1
+        self._pending = order_of_line(data[complete:])
+        self._offset += complete
+        self._head = (self._head + data[:complete])[:SAMPLE_SIZE]
+        self._tail = (self._tail + data[:complete])[-SAMPLE_SIZE:]
+        self._stat = key
+
+    def _appended(self, file, stat: os.stat_result) -> bool:
+        """Returns True if everything parsed so far is still at the start of the file."""
+        if self._stat is None or (stat.st_dev, stat.st_ino) != self._stat[:2] or stat.st_size <= self._stat[2]:
+            return False
+        if file.read(len(self._head)) != self._head:
+            return False
+        file.seek(self._offset - len(self._tail))
+        return file.read(len(self._tail)) == self._tail
+
+    def _reset(self) -> None:
+        self._totals = {}
+        self._pending = None
+        self._offset = 0
+        self._head = b''
+        self._tail = b''
+        self._stat = None
+
+    def _database_counts(self) -> Dict[str, Dict]:
+        try:
+            if self.store is None:
+                self.store = DeviceStore()
+            conn = self.store.connection()
+            # data_version changes whenever another connection commits to the database
+            version = (threading.get_ident(), conn.execute('PRAGMA data_version').fetchone()[0])
+            if version != self._db_version:
+                self._db_counts = {row['order_no']: row for row in self.store.order_counts()}
+                self._db_version = version
+        except sqlite3.Error as e:
+            print(f"Order index: device database unavailable: {e}")
+            return {}
+        return self._db_counts
+
+
+_shared_indexes: Dict[str, OrderIndex] = {}
+_shared_indexes_lock = threading.Lock()
+
+
+def get_order_index(file_path: str = 'device_data.txt') -> OrderIndex:
+    """Returns the process-wide order index of a device data file."""
+    path = os.path.abspath(file_path)
+    with _shared_indexes_lock:
+        index = _shared_indexes.get(path)
+        if index is None:
+            index = _shared_indexes[path] = OrderIndex(file_path)
+        return index
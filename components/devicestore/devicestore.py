@@ -0,0 +1,576 @@
+import ast
+import os
+import sqlite3
+import threading
+import time
+
+from typing import Dict, List, Optional
+
+
+class DeviceStatus:
+    """Allocation states of a device record."""
+    FREE = 'free'
+    CLAIMED = 'claimed'
+    FLASHED = 'flashed'
+    REJECTED = 'rejected'
+
+
+DEVICE_COLUMNS = (
+    'order_no',
+    'mac_address',
+    'serial_id',
+    'cert_id',
+    'esp_secure_cert_partition',
+    'commissionable_data_provider_partition',
+    'qrcode',
+    'manualcode',
+    'discriminator',
+    'passcode',
+)
+
+
+def _migrate_v1(conn: sqlite3.Connection) -> None:
+    """Keys the devices table on serial_id and adds the allocation columns and indexes."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS devices (
+            order_no TEXT,
+            mac_address TEXT,
+            serial_id TEXT,
+            cert_id TEXT,
+            esp_secure_cert_partition TEXT,
+            commissionable_data_provider_partition TEXT,
+            qrcode TEXT,
+            manualcode TEXT,
+            discriminator INTEGER,
+            passcode INTEGER
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE devices_v1 (
+            serial_id TEXT PRIMARY KEY NOT NULL,
+            order_no TEXT NOT NULL,
+            mac_address TEXT NOT NULL DEFAULT '',
+            cert_id TEXT NOT NULL,
+            esp_secure_cert_partition TEXT,
+            commissionable_data_provider_partition TEXT,
+            qrcode TEXT,
+            manualcode TEXT,
+            discriminator INTEGER,
+            passcode INTEGER,
+            status TEXT NOT NULL DEFAULT 'free',
+            claimed_by TEXT,
+            claimed_at REAL,
+            flashed_at REAL
+        )
+    ''')
+    # Earlier imports appended duplicates; keep the first copy of every serial and cert id
+    columns = ', '.join(DEVICE_COLUMNS)
+    legacy_rows = conn.execute('SELECT COUNT(*) FROM devices').fetchone()[0]
+    conn.execute(f'''
+        INSERT OR IGNORE INTO devices_v1 ({columns})
+        SELECT {columns} FROM devices
+        WHERE serial_id IS NOT NULL AND cert_id IS NOT NULL
+          AND rowid IN (SELECT MIN(rowid) FROM devices GROUP BY cert_id)
+        ORDER BY rowid
+    ''')
+    dropped = legacy_rows - conn.execute('SELECT COUNT(*) FROM devices_v1').fetchone()[0]
+    if dropped:
+        print(f"Device store: dropped {dropped} duplicate or incomplete device row(s) while migrating")
+    conn.execute('''
+        UPDATE devices_v1 SET status = 'flashed' WHERE mac_address IS NOT NULL AND mac_address != ''
+    ''')
+    conn.execute('DROP TABLE devices')
+    conn.execute('ALTER TABLE devices_v1 RENAME TO devices')
+    conn.execute('CREATE UNIQUE INDEX idx_devices_cert_id ON devices (cert_id)')
+    conn.execute('CREATE INDEX idx_devices_order_mac ON devices (order_no, mac_address)')
+    conn.execute('CREATE INDEX idx_devices_mac_address ON devices (mac_address)')
+    conn.execute("CREATE INDEX idx_devices_free ON devices (order_no, serial_id) WHERE status = 'free'")
+
+
+def _migrate_v2(conn: sqlite3.Connection) -> None:
+    """Adds the certificate ledger that replaces used_cert_ids.pkl."""
+    conn.execute('''
+        CREATE TABLE cert_ledger (
+            cert_key TEXT PRIMARY KEY NOT NULL,
+            serial_id TEXT,
+            station TEXT,
+            status TEXT NOT NULL,
+            reserved_at REAL,
+            consumed_at REAL
+        )
+    ''')
+    conn.execute("CREATE INDEX idx_cert_ledger_reserved ON cert_ledger (reserved_at) WHERE status = 'reserved'")
+
+
+def _migrate_v3(conn: sqlite3.Connection) -> None:
+    """Adds per-unit stage timings."""
+    conn.execute('''
+        CREATE TABLE stage_timings (
+            id INTEGER PRIMARY KEY,
+            unit TEXT NOT NULL,
+            port TEXT,
+            stage TEXT NOT NULL,
+            started_at REAL NOT NULL,
+            seconds REAL NOT NULL,
+            success INTEGER NOT NULL,
+            detail TEXT
+        )
+    ''')
+    conn.execute('CREATE INDEX idx_stage_timings_unit ON stage_timings (unit, started_at)')
+    conn.execute('CREATE INDEX idx_stage_timings_stage ON stage_timings (stage, started_at)')
+
+
+def _migrate_v4(conn: sqlite3.Connection) -> None:
+    """Adds the throughput esptool reported for every flashed region."""
+    conn.execute('''
+        CREATE TABLE flash_throughput (
+            id INTEGER PRIMARY KEY,
+            unit TEXT NOT NULL,
+            port TEXT,
+            address INTEGER NOT NULL,
+            bytes INTEGER NOT NULL,
+            seconds REAL NOT NULL,
+            kbit_per_second REAL NOT NULL,
+            recorded_at REAL NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX idx_flash_throughput_port ON flash_throughput (port, recorded_at)')
+    conn.execute('CREATE INDEX idx_flash_throughput_unit ON flash_throughput (unit)')
+
+
+# Schema migrations, applied in order; PRAGMA user_version records the last one applied
+MIGRATIONS = (
+    _migrate_v1,
+    _migrate_v2,
+    _migrate_v3,
+    _migrate_v4,
+)
+
+
+def connect(db_name: str = 'device_data.db') -> sqlite3.Connection:
+    """
+    Opens the device database with the pragmas shared by imports and flashing stations.
+
+    WAL lets stations keep reading while another connection writes, and
+    synchronous=NORMAL is crash-safe in WAL mode while avoiding an fsync per commit.
+    """
+    conn = sqlite3.connect(db_name, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    conn.execute('PRAGMA cache_size=-16000')
+    return conn
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """
+    Brings the database schema up to date.
+
+    Each migration runs in its own write transaction and the schema version is read
+    inside it, so stations starting at the same time never apply a migration twice.
+
+    Returns:
+        int: The schema version after migrating.
+    """
+    if conn.execute('PRAGMA user_version').fetchone()[0] >= len(MIGRATIONS):
+        return len(MIGRATIONS)
+
+    while True:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            if version >= len(MIGRATIONS):
+                conn.execute('COMMIT')
+                return version
+            print(f"Device store: migrating schema to version {version + 1}")
+            MIGRATIONS[version](conn)
+            conn.execute(f'PRAGMA user_version = {version + 1}')
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+
+class CertStatus:
+    """States of a certificate in the ledger."""
+    RESERVED = 'reserved'
+    CONSUMED = 'consumed'
+
+
+class DeviceStore:
+    """
+    Query layer over the devices table.
+
+    Every thread gets its own SQLite connection, so a single store can be shared by
+    all flashing stations. Claiming a record is one UPDATE ... RETURNING statement,
+    which SQLite executes atomically, so two stations can never claim the same
+    serial/cert record.
+    """
+
+    def __init__(self, db_name: str = 'device_data.db'):
+        self.db_name = db_name
+        self._local = threading.local()
+        self._migrated = False
+        self._migrate_lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        return connect(self.db_name)
+
+    def connection(self) -> sqlite3.Connection:
+        """Returns this thread's connection, migrating the schema on first use."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            with self._migrate_lock:
+                if not self._migrated:
+                    migrate(conn)
+                    self._migrated = True
+            self._local.conn = conn
+        return conn
+
+    def close(self) -> None:
+        """Closes this thread's connection."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def claim_next(self, order_no: str, station: str = '') -> Optional[Dict]:
+        """
+        Atomically claims the next free device record of an order.
+
+        Args:
+            order_no (str): Order the device belongs to.
+            station (str, optional): Name of the station claiming the record.
+
+        Returns:
+            Optional[Dict]: The claimed record, or None if the order has no free records.
+        """
+        conn = self.connection()
+        with conn:
+            row = conn.execute('''
+                UPDATE devices
+                SET status = 'claimed', claimed_by = ?, claimed_at = ?
+                WHERE serial_id = (
+                    SELECT serial_id FROM devices
+                    WHERE order_no = ? AND status = 'free'
+                    ORDER BY serial_id
+                    LIMIT 1
+                )
+                RETURNING *
+            ''', (station, time.time(), order_no)).fetchone()
+        return dict(row) if row else None
+
+    def mark_flashed(self, serial_id: str, mac_address: str) -> bool:
+        """
+        Records that a claimed device was flashed onto the board with the given MAC.
+
+        Returns:
+            bool: True if the record existed and was updated.
+        """
+        conn = self.connection()
+        with conn:
+            cursor = conn.execute('''
+                UPDATE devices SET status = 'flashed', mac_address = ?, flashed_at = ?
+                WHERE serial_id = ?
+            ''', (mac_address, time.time(), serial_id))
+        return cursor.rowcount == 1
+
+    def release(self, serial_id: str) -> bool:
+        """
+        Returns a claimed but unflashed record to the pool, e.g. after a failed flash.
+
+        Returns:
+            bool: True if the record was claimed and is free again.
+        """
+        conn = self.connection()
+        with conn:
+            cursor = conn.execute('''
+                UPDATE devices SET status = 'free', claimed_by = NULL, claimed_at = NULL
+                WHERE serial_id = ? AND status = 'claimed'
+            ''', (serial_id,))
+        return cursor.rowcount == 1
+
+    def reject(self, serial_id: str) -> bool:
+        """
+        Takes a claimed record out of the pool for good, e.g. when its certificate bundle is missing.
+
+        Returns:
+            bool: True if the record was claimed and is now rejected.
+        """
+        conn = self.connection()
+        with conn:
+            cursor = conn.execute('''
+                UPDATE devices SET status = 'rejected'
+                WHERE serial_id = ? AND status = 'claimed'
+            ''', (serial_id,))
+        return cursor.rowcount == 1
+
+    def get(self, serial_id: str) -> Optional[Dict]:
+        """Returns the record of a serial id."""
+        row = self.connection().execute('SELECT * FROM devices WHERE serial_id = ?', (serial_id,)).fetchone()
+        return dict(row) if row else None
+
+    def order_records(self, order_no: str) -> List[Dict]:
+        """Returns every record of an order, whatever its status, in serial id order."""
+        rows = self.connection().execute(
+            'SELECT * FROM devices WHERE order_no = ? ORDER BY serial_id', (order_no,)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def find_by_mac(self, mac_address: str, order_no: str = None) -> Optional[Dict]:
+        """Returns the record flashed onto the board with the given MAC address."""
+        if order_no is None:
+            row = self.connection().execute(
+                'SELECT * FROM devices WHERE mac_address = ?', (mac_address,)
+            ).fetchone()
+        else:
+            row = self.connection().execute(
+                'SELECT * FROM devices WHERE order_no = ? AND mac_address = ?', (order_no, mac_address)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def order_counts(self) -> List[Dict]:
+        """Returns, per order, the number of free, claimed, flashed and rejected records."""
+        rows = self.connection().execute('''
+            SELECT order_no,
+                   COUNT(*) AS total,
+                   SUM(status = 'free') AS free,
+                   SUM(status = 'claimed') AS claimed,
+                   SUM(status = 'flashed') AS flashed,
+                   SUM(status = 'rejected') AS rejected
+            FROM devices
+            GROUP BY order_no
+            ORDER BY MIN(rowid)
+        ''').fetchall()
+        return [dict(row) for row in rows]
+
+
+class CertificateLedger(DeviceStore):
+    """
+    Records which DAC certificates have been issued, one row per certificate.
+
+    A certificate is reserved (committed to disk) before it is written to a board
+    and marked consumed once the write succeeded. Both are single-row statements on
+    the primary key, so recording a consumption costs the same no matter how many
+    certificates were issued before, and any number of stations can check and
+    reserve certificates concurrently. A reservation left behind by a crash
+    mid-flash stays in the ledger, so that certificate is never handed to a
+    different serial id.
+
+    Ledger connections use synchronous=FULL: losing a committed reservation on
+    power failure could lead to the same DAC being issued twice.
+    """
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = connect(self.db_name)
+        conn.execute('PRAGMA synchronous=FULL')
+        return conn
+
+    def reserve(self, cert_key: str, serial_id: str, station: str = '') -> bool:
+        """
+        Reserves a certificate for a serial id before it is flashed.
+
+        Reserving again for the same serial id on the same station succeeds as long as
+        the certificate was not consumed yet, so a failed or interrupted flash can be
+        retried there. Any other station is refused, even for the same serial id.
+
+        Args:
+            cert_key (str): Certificate UUID.
+            serial_id (str): Serial id the certificate belongs to.
+            station (str, optional): Name of the station flashing it.
+
+        Returns:
+            bool: True if the certificate may be flashed for this serial id.
+        """
+        conn = self.connection()
+        with conn:
+            row = conn.execute('''
+                INSERT INTO cert_ledger (cert_key, serial_id, station, status, reserved_at)
+                VALUES (?, ?, ?, 'reserved', ?)
+                ON CONFLICT(cert_key) DO UPDATE SET reserved_at = excluded.reserved_at
+                WHERE cert_ledger.status = 'reserved' AND cert_ledger.serial_id = excluded.serial_id
+                    AND cert_ledger.station = excluded.station
+                RETURNING cert_key
+            ''', (cert_key, serial_id, station, time.time())).fetchone()
+        return row is not None
+
+    def consume(self, cert_key: str) -> bool:
+        """
+        Marks a reserved certificate as written to a board.
+
+        Returns:
+            bool: True if the certificate was reserved and is now consumed.
+        """
+        conn = self.connection()
+        with conn:
+            cursor = conn.execute('''
+                UPDATE cert_ledger SET status = 'consumed', consumed_at = ?
+                WHERE cert_key = ? AND status = 'reserved'
+            ''', (time.time(), cert_key))
+        return cursor.rowcount == 1
+
+    def release(self, cert_key: str, serial_id: str) -> bool:
+        """
+        Drops a reservation whose certificate was never written, e.g. when its record goes back to the pool.
+
+        Returns:
+            bool: True if the certificate was reserved for this serial id and is free again.
+        """
+        conn = self.connection()
+        with conn:
+            cursor = conn.execute('''
+                DELETE FROM cert_ledger WHERE cert_key = ? AND serial_id = ? AND status = 'reserved'
+            ''', (cert_key, serial_id))
+        return cursor.rowcount == 1
+
+    def is_used(self, cert_key: str) -> bool:
+        """Returns True if the certificate is reserved or consumed."""
+        row = self.connection().execute('SELECT 1 FROM cert_ledger WHERE cert_key = ?', (cert_key,)).fetchone()
+        return row is not None
+
+    def entry(self, cert_key: str) -> Optional[Dict]:
+        """Returns the ledger row of a certificate."""
+        row = self.connection().execute('SELECT * FROM cert_ledger WHERE cert_key = ?', (cert_key,)).fetchone()
+        return dict(row) if row else None
+
+    def pending_reservations(self, older_than: float = 0.0) -> List[Dict]:
+        """
+        Returns reservations that were never consumed, e.g. after a crash mid-flash.
+
+        Args:
+            older_than (float, optional): Only return reservations at least this many seconds old.
+        """
+        rows = self.connection().execute('''
+            SELECT * FROM cert_ledger WHERE status = 'reserved' AND reserved_at <= ?
+            ORDER BY reserved_at
+        ''', (time.time() - older_than,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def import_legacy_file(self, path: str = 'used_cert_ids.pkl') -> int:
+        """
+        Imports the certificates recorded in a legacy used_cert_ids.pkl file.
+
+        The file holds a Python set literal of secure cert paths. Each entry is
+        recorded as consumed under its UUID; afterwards the file is renamed to
+        <path>.imported so it is not read again.
+
+        Returns:
+            int: Number of certificates added to the ledger.
+
+        Raises:
+            ValueError: If the file is not a set literal of paths.
+        """
+        if not os.path.exists(path):
+            return 0
+
+        with open(path, 'rb') as file:
+            content = file.read()
+        try:
+            used = ast.literal_eval(content.decode('utf-8'))
+        except (UnicodeDecodeError, ValueError, SyntaxError) as e:
+            raise ValueError(f"{path} is not a set literal of certificate paths: {e}") from None
+        if not isinstance(used, (set, frozenset, list, tuple)):
+            raise ValueError(f"{path} is not a set literal of certificate paths")
+
+        keys = {cert_key_from_path(entry) for entry in used}
+        conn = self.connection()
+        with conn:
+            cursor = conn.executemany('''
+                INSERT OR IGNORE INTO cert_ledger (cert_key, serial_id, station, status, consumed_at)
+                VALUES (?, NULL, 'legacy', 'consumed', ?)
+            ''', [(key, time.time()) for key in sorted(keys)])
+        os.replace(path, path + '.imported')
+        print(f"Certificate ledger: imported {cursor.rowcount} certificate(s) from {path}")
+        return cursor.rowcount
+
+
+class StageTimingStore(DeviceStore):
+    """Stage timings of every unit, one row per stage run, and the throughput of every flashed region."""
+
+    def record(self, unit: str, stage: str, started_at: float, seconds: float, success: bool,
+               port: str = '', detail: str = '') -> None:
+        """
+        Stores one stage run.
+
+        Args:
+            unit (str): Serial id of the device, or its MAC address or port while the serial id is not known.
+            stage (str): Stage name, e.g. 'flash_firmware'.
+            started_at (float): Wall-clock start time.
+            seconds (float): Duration, measured on the monotonic clock.
+            success (bool): Whether the stage succeeded.
+            port (str, optional): Port the stage ran on.
+            detail (str, optional): Failure reason or other notes.
+        """
+        conn = self.connection()
+        with conn:
+            conn.execute('''
+                INSERT INTO stage_timings (unit, port, stage, started_at, seconds, success, detail)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (unit, port, stage, started_at, seconds, int(success), detail))
+
+    def unit_timings(self, unit: str) -> List[Dict]:
+        """Returns the stage runs of a unit in the order they started."""
+        rows = self.connection().execute(
+            'SELECT * FROM stage_timings WHERE unit = ? ORDER BY started_at', (unit,)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def record_throughput(self, unit: str, port: str, address: int, bytes: int, seconds: float, kbit_per_second: float) -> None:
+        """Stores the throughput esptool reported for one written region."""
+        conn = self.connection()
+        with conn:
+            conn.execute('''
+                INSERT INTO flash_throughput (unit, port, address, bytes, seconds, kbit_per_second, recorded_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (unit, port, address, bytes, seconds, kbit_per_second, time.time()))
+
+    def port_throughput(self, since: float = 0.0) -> List[Dict]:
+        """
+        Returns, per port, the number of regions written and their mean and lowest throughput.
+
+        Only regions of at least 64 KiB are counted; smaller ones are dominated by
+        per-region overhead rather than by the link.
+        """
+        rows = self.connection().execute('''
+            SELECT port,
+                   COUNT(*) AS regions,
+                   SUM(bytes) * 8 / 1000.0 / SUM(seconds) AS kbit_per_second,
+                   MIN(kbit_per_second) AS min_kbit_per_second
+            FROM flash_throughput
+            WHERE recorded_at >= ? AND bytes >= 65536 AND seconds > 0
+            GROUP BY port
+            ORDER BY kbit_per_second
+        ''', (since,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def stage_summary(self, since: float = 0.0) -> List[Dict]:
+        """
+        Returns, per stage, the number of runs and failures and their total, mean and longest duration.
+
+        Args:
+            since (float, optional): Only count stage runs started at or after this wall-clock time.
+        """
+        rows = self.connection().execute('''
+            SELECT stage,
+                   COUNT(*) AS count,
+                   SUM(success = 0) AS failures,
+                   SUM(seconds) AS total_seconds,
+                   AVG(seconds) AS mean_seconds,
+                   MAX(seconds) AS max_seconds
+            FROM stage_timings
+            WHERE started_at >= ?
+            GROUP BY stage
+            ORDER BY total_seconds DESC
+        ''', (since,)).fetchall()
+        return [dict(row) for row in rows]
+
+
+def cert_key_from_path(path: str) -> str:
+    """Returns the certificate UUID of a secure cert path, or the file name if it has none."""
+    name = os.path.basename(str(path))
+    for suffix in ('_esp_secure_cert.bin', '-partition.bin'):
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return name
@@ -0,0 +1,356 @@
+import asyncio
+import os
+import re
+import time
+
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+from components.serialcom.framing import LineFramer
+
+
+MAC_PATTERN = r'((?:[0-9A-Fa-f]{2}[:-]?){5}[0-9A-Fa-f]{2})'
+PROMPT = '.'
+# The device acknowledges a write it applied with "OK" and answers a command it refused with an error line
+ACK_PATTERN = r'^OK$'
+ERROR_PATTERN = re.compile(r'^(?:ERR|ERROR|FAIL)\b', re.IGNORECASE)
+
+
+class FactoryCommandError(Exception):
+    """Raised when a factory command gets no matching response after all retries."""
+
+
+class FactoryCommand:
+    """
+    One request of the factory test protocol.
+
+    Args:
+        name (str): Step name used in results, e.g. 'write_serial_number'.
+        payload (str): Text sent to the device, without the line terminator.
+        expect (str, optional): Regular expression a response line must match. The
+            first group, if any, becomes the command's value; otherwise the whole line.
+            Without a pattern, the first line received completes the command.
+        timeout (float): Seconds to wait for the response of one attempt.
+        retries (int): Extra attempts after the first one timed out.
+    """
+
+    def __init__(self, name: str, payload: str, expect: str = None, timeout: float = 2.0, retries: int = 2):
+        self.name = name
+        self.payload = payload
+        self.expect = re.compile(expect) if expect else None
+        self.timeout = timeout
+        self.retries = retries
+
+    def match(self, line: str) -> Optional[str]:
+        """Returns the command's value if the line answers it, else None."""
+        if self.expect is None:
+            return line
+        found = self.expect.search(line)
+        if not found:
+            return None
+        return found.group(1) if found.groups() else found.group(0)
+
+    def __repr__(self):
+        return f"FactoryCommand({self.name!r}, {self.payload!r})"
+
+
+class FactoryResult:
+    """Outcome of one factory command."""
+
+    def __init__(self, name: str, success: bool, value: str = '', attempts: int = 0, seconds: float = 0.0, error: str = ''):
+        self.name = name
+        self.success = success
+        self.value = value
+        self.attempts = attempts
+        self.seconds = seconds
+        self.error = error
+
+    def __repr__(self):
+        status = 'ok' if self.success else f'failed: {self.error}'
+        return f"FactoryResult({self.name!r}, {status}, value={self.value!r}, {self.seconds:.3f}s)"
+
+
+class _Pending:
+    def __init__(self, command: FactoryCommand, future: asyncio.Future):
+        self.command = command
+        self.future = future
+
+
+class FactoryCommandEngine:
+    """
+    Asyncio request/response engine over a factory port.
+
+    A single reader coroutine frames incoming bytes into lines and hands each line to
+    the oldest outstanding request it matches, so several commands can be in flight
+    at once and their responses are paired in order. An error line (ERROR_PATTERN)
+    fails the oldest outstanding request. Lines no request is waiting for are passed
+    to on_line.
+
+    The engine works on any pyserial-compatible object. On POSIX it waits for data
+    with the event loop's reader callbacks, so an idle port costs no CPU; elsewhere
+    reads run in the default executor.
+    """
+
+    def __init__(self, serial_conn, terminator: str = '\r\n', on_line: Callable[[str], None] = None):
+        self.serial_conn = serial_conn
+        self.terminator = terminator
+        self.on_line = on_line
+        self.framer = LineFramer()
+        self._pending: deque = deque()
+        self._waiters: List[tuple] = []  # (pattern, future) for wait_for_line
+        self._reader_task = None
+        self._data_ready = None
+        self._uses_fd_reader = False
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def start(self) -> None:
+        """Starts the reader coroutine."""
+        loop = asyncio.get_running_loop()
+        self._data_ready = asyncio.Event()
+        if os.name == 'posix' and hasattr(self.serial_conn, 'fileno'):
+            try:
+                loop.add_reader(self.serial_conn.fileno(), self._data_ready.set)
+                self._uses_fd_reader = True
+            except (OSError, ValueError, NotImplementedError):
+                self._uses_fd_reader = False
+        self._reader_task = asyncio.create_task(self._read_loop())
+
+    async def close(self) -> None:
+        """Stops the reader and fails every outstanding request."""
+        if self._uses_fd_reader:
+            asyncio.get_running_loop().remove_reader(self.serial_conn.fileno())
+            self._uses_fd_reader = False
+        if self._reader_task:
+            self._reader_task.cancel()
+            try:
+                await self._reader_task
+            except asyncio.CancelledError:
+                pass
+            self._reader_task = None
+        for pending in self._pending:
+            if not pending.future.done():
+                pending.future.set_exception(FactoryCommandError("Engine closed."))
+        self._pending.clear()
+
+    async def _read_chunk(self) -> bytes:
+        if self._uses_fd_reader:
+            await self._data_ready.wait()
+            self._data_ready.clear()
+            # Readiness callbacks can fire once more after the data was consumed; only
+            # read what is buffered so the event loop never blocks in read()
+            waiting = self.serial_conn.in_waiting
+            return self.serial_conn.read(waiting) if waiting else b''
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, lambda: self.serial_conn.read(self.serial_conn.in_waiting or 1))
+
+    async def _read_loop(self) -> None:
+        while True:
+            chunk = await self._read_chunk()
+            if not chunk:
+                continue
+            for line in self.framer.feed(chunk):
+                if line:
+                    self._dispatch(line)
+
+    def _dispatch(self, line: str) -> None:
+        for waiter in list(self._waiters):
+            pattern, future = waiter
+            if not future.done() and pattern.search(line):
+                future.set_result(line)
+                self._waiters.remove(waiter)
+                return
+
+        if ERROR_PATTERN.match(line):
+            # The device answers in order, so the refusal is for the oldest request
+            pending = next((pending for pending in self._pending if not pending.future.done()), None)
+            if pending is not None:
+                pending.future.set_exception(FactoryCommandError(f"{pending.command.payload!r} refused: {line}"))
+                self._pending.remove(pending)
+                return
+
+        # The factory prompt is repeated until the password is accepted; it never answers a request
+        for pending in (self._pending if line != PROMPT else ()):
+            if pending.future.done():
+                continue
+            value = pending.command.match(line)
+            if value is not None:
+                pending.future.set_result(value)
+                self._pending.remove(pending)
+                return
+
+        if self.on_line:
+            self.on_line(line)
+
+    def write(self, text: str) -> None:
+        """Writes one line to the device."""
+        self.serial_conn.write((text + self.terminator).encode('utf-8'))
+
+    async def wait_for_line(self, pattern: str, timeout: float) -> str:
+        """
+        Waits for a line matching a pattern that no request asked for, e.g. a prompt.
+
+        Raises:
+            asyncio.TimeoutError: If no such line arrives within the timeout.
+        """
+        future = asyncio.get_running_loop().create_future()
+        waiter = (re.compile(pattern), future)
+        self._waiters.append(waiter)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    async def request(self, command: FactoryCommand) -> FactoryResult:
+        """Sends a command and waits for its response, retrying on timeout."""
+        start = time.monotonic()
+        attempts = 0
+        for attempts in range(1, command.retries + 2):
+            future = asyncio.get_running_loop().create_future()
+            pending = _Pending(command, future)
+            self._pending.append(pending)
+            self.write(command.payload)
+            try:
+                value = await asyncio.wait_for(future, command.timeout)
+                return FactoryResult(command.name, True, value, attempts, time.monotonic() - start)
+            except asyncio.TimeoutError:
+                if pending in self._pending:
+                    self._pending.remove(pending)
+            except FactoryCommandError as e:
+                return FactoryResult(command.name, False, '', attempts, time.monotonic() - start, str(e))
+        return FactoryResult(command.name, False, '', attempts, time.monotonic() - start,
+                             f"No response to {command.payload!r} after {attempts} attempt(s)")
+
+    async def pipeline(self, commands: List[FactoryCommand], window: int = 4) -> List[FactoryResult]:
+        """
+        Runs several commands with up to `window` of them in flight at once.
+
+        Returns:
+            List[FactoryResult]: Results in the order of the commands.
+        """
+        semaphore = asyncio.Semaphore(max(1, window))
+
+        async def run(command):
+            async with semaphore:
+                return await self.request(command)
+
+        return list(await asyncio.gather(*(run(command) for command in commands)))
+
+
+class FactorySequence:
+    """
+    The factory write/read-back sequence for one device, run as a single coroutine.
+
+    Args:
+        commands (Dict[str, str]): Factory command strings from config.ini, keyed by
+            'read_mac', 'write_product_name', 'read_product_name', 'write_serial_number',
+            'read_serial_number', 'write_matter_qr', 'read_matter_qr' and 'save_device_data'.
+        password (str): Factory mode password sent after the "." prompt.
+        product_name (str): Expected product name when reading it back.
+        prompt_timeout (float, optional): Seconds to wait for the "." prompt; None waits without a deadline.
+        timeout (float): Per-attempt response timeout of every command.
+        retries (int): Extra attempts per command.
+        on_result (Callable[[FactoryResult], None], optional): Called after every step.
+    """
+
+    def __init__(self, commands: Dict[str, str], password: str, product_name: str = '',
+                 prompt_timeout: Optional[float] = 30.0, timeout: float = 2.0, retries: int = 2,
+                 on_result: Callable[[FactoryResult], None] = None):
+        self.commands = commands
+        self.password = password
+        self.product_name = product_name
+        self.prompt_timeout = prompt_timeout
+        self.timeout = timeout
+        self.retries = retries
+        self.on_result = on_result
+        self.results: List[FactoryResult] = []
+
+    def _command(self, name: str, payload: str, expect: str = None) -> FactoryCommand:
+        return FactoryCommand(name, payload, expect, self.timeout, self.retries)
+
+    def _record(self, result: FactoryResult) -> FactoryResult:
+        self.results.append(result)
+        if self.on_result:
+            self.on_result(result)
+        return result
+
+    async def run(self, engine: FactoryCommandEngine, serial_id: str, qrcode: str) -> bool:
+        """
+        Enters factory mode, writes the device identity, reads it back and saves it.
+
+        Args:
+            engine (FactoryCommandEngine): Started engine on the device's factory port.
+            serial_id (str): Serial number to write.
+            qrcode (str): Matter QR payload to write.
+
+        Returns:
+            bool: True if every step succeeded and every read-back matched.
+        """
+        return await self.enter_factory_mode(engine) and await self.run_commands(engine, serial_id, qrcode)
+
+    async def enter_factory_mode(self, engine: FactoryCommandEngine) -> bool:
+        """
+        Waits for the "." prompt and sends the password.
+
+        Returns:
+            bool: False if no prompt arrived within prompt_timeout.
+        """
+        start = time.monotonic()
+        try:
+            await engine.wait_for_line('^' + re.escape(PROMPT) + '$', self.prompt_timeout)
+        except asyncio.TimeoutError:
+            self._record(FactoryResult('factory_mode', False, '', 1, time.monotonic() - start,
+                                       f"No factory prompt within {self.prompt_timeout}s"))
+            return False
+        engine.write(self.password)
+        self._record(FactoryResult('factory_mode', True, '', 1, time.monotonic() - start))
+        return True
+
+    async def run_commands(self, engine: FactoryCommandEngine, serial_id: str, qrcode: str) -> bool:
+        """
+        Writes the device identity, reads it back and saves it; the device must be in factory mode.
+
+        Args:
+            engine (FactoryCommandEngine): Started engine on the device's factory port.
+            serial_id (str): Serial number to write.
+            qrcode (str): Matter QR payload to write.
+
+        Returns:
+            bool: True if every step succeeded and every read-back matched.
+        """
+        # Writes are independent of each other, so they are pipelined; each one only counts once acknowledged
+        writes = [
+            self._command('write_product_name', self.commands['write_product_name'], ACK_PATTERN),
+            self._command('write_serial_number', self.commands['write_serial_number'] + serial_id, ACK_PATTERN),
+            self._command('write_matter_qr', self.commands['write_matter_qr'] + qrcode, ACK_PATTERN),
+        ]
+        for result in await engine.pipeline(writes):
+            self._record(result)
+
+        # Read-backs only count when the device returns what was written
+        reads = [
+            self._command('read_mac', self.commands['read_mac'], MAC_PATTERN),
+            self._command('read_product_name', self.commands['read_product_name'], re.escape(self.product_name) if self.product_name else None),
+            self._command('read_serial_number', self.commands['read_serial_number'], re.escape(serial_id)),
+            self._command('read_matter_qr', self.commands['read_matter_qr'], re.escape(qrcode)),
+        ]
+        for result in await engine.pipeline(reads):
+            self._record(result)
+
+        if all(result.success for result in self.results):
+            self._record(await engine.request(self._command('save_device_data', self.commands['save_device_data'], ACK_PATTERN)))
+
+        return all(result.success for result in self.results) and self.results[-1].name == 'save_device_data'
+
+    def value(self, name: str) -> str:
+        """Returns the value of a completed step, or '' if it did not succeed."""
+        for result in self.results:
+            if result.name == name and result.success:
+                return result.value
+        return ''
@@ -0,0 +1,210 @@
+import hashlib
+import json
+import os
+import threading
+
+from typing import Callable, Dict, List, Tuple
+
+from components.flash.imagecache import get_image_cache
+from components.flash.partitions import FLASH_SECTOR_SIZE
+from components.runner.process import CancelToken, ExitStatus, ProcessResult
+
+
+DIGEST_SUFFIX = '.sectors.json'
+
+
+class ImageDigests:
+    """
+    MD5 digests of a firmware image, whole and per flash sector.
+
+    The image is padded to a multiple of 4 bytes with 0xFF, as esptool does before
+    writing, so the digests match what the chip's flash holds after a full write.
+    """
+
+    def __init__(self, path: str, size: int, md5: str, sectors: List[str]):
+        self.path = path
+        self.size = size
+        self.md5 = md5
+        self.sectors = sectors
+
+    def sector_range(self, index: int) -> Tuple[int, int]:
+        """Returns the (offset, size) of a sector within the image."""
+        start = index * FLASH_SECTOR_SIZE
+        return start, min(FLASH_SECTOR_SIZE, self.size - start)
+
+
+def compute_digests(path: str) -> ImageDigests:
+    """Hashes an image whole and sector by sector."""
+    image = get_image_cache().get(path)
+    sectors = [hashlib.md5(image.read(start, FLASH_SECTOR_SIZE)).hexdigest()
+               for start in range(0, image.size, FLASH_SECTOR_SIZE)]
+    return ImageDigests(path, image.size, image.md5, sectors)
+
+
+_digest_cache: Dict[str, Tuple[Tuple[int, int], ImageDigests]] = {}
+_digest_lock = threading.Lock()
+
+
+def image_digests(path: str) -> ImageDigests:
+    """
+    Returns an image's digests, computing them at most once per build.
+
+    Digests are kept in memory and in a <image>.sectors.json file next to the image,
+    both keyed by the image's size and mtime. If the firmware directory is read-only,
+    only the in-memory copy is kept.
+    """
+    stat = os.stat(path)
+    key = (stat.st_size, stat.st_mtime_ns)
+    with _digest_lock:
+        cached = _digest_cache.get(path)
+        if cached and cached[0] == key:
+            return cached[1]
+
+    cache_file = path + DIGEST_SUFFIX
+    digests = None
+    try:
+        with open(cache_file, 'r') as file:
+            stored = json.load(file)
+        if (stored['file_size'], stored['file_mtime_ns']) == key:
+            digests = ImageDigests(path, stored['size'], stored['md5'], stored['sectors'])
+    except (OSError, ValueError, KeyError):
+        pass
+
+    if digests is None:
+        digests = compute_digests(path)
+        try:
+            with open(cache_file, 'w') as file:
+                json.dump({'file_size': key[0], 'file_mtime_ns': key[1], 'size': digests.size,
+                           'md5': digests.md5, 'sectors': digests.sectors}, file)
+        except OSError as e:
+            print(f"Could not store sector digests for {path}: {e}")
+
+    with _digest_lock:
+        _digest_cache[path] = (key, digests)
+    return digests
+
+
+def changed_runs(local: List[str], device: List[str]) -> List[Tuple[int, int]]:
+    """
+    Groups differing sectors into runs.
+
+    Returns:
+        List[Tuple[int, int]]: (first sector, sector count) of every run of sectors
+        whose digests differ.
+    """
+    runs = []
+    start = None
+    for index, (ours, theirs) in enumerate(zip(local, device)):
+        if ours != theirs:
+            if start is None:
+                start = index
+        elif start is not None:
+            runs.append((start, index - start))
+            start = None
+    if start is not None:
+        runs.append((start, len(local) - start))
+    return runs
+
+
+class DifferentialFlasher:
+    """
+    write_flash that only writes what differs from the chip's flash.
+
+    With the in-process esptool backend each region's flash MD5 is compared with the
+    image first; for regions that differ, the sectors are compared one by one and
+    only the runs of differing sectors are erased and written. The subprocess backend
+    cannot hash sectors cheaply, so it compares whole regions with one verify_flash
+    run and rewrites the regions that differ.
+
+    Unchanged regions are reported as "Unchanged N bytes at 0x..." lines and partly
+    rewritten ones as "Patched N of M bytes at 0x..." lines, next to esptool's own
+    "Wrote ..." lines. The chip is reset at the end even if nothing was written.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.bytes_skipped = 0
+        self.bytes_written = 0
+
+    def write_flash(self, port: str, baud, regions: List[Tuple[str, str]], timeout: float = None,
+                    on_line: Callable[[str], None] = None, cancel_token: CancelToken = None,
+                    reset: bool = True, command: str = 'write_flash') -> ProcessResult:
+        """Same arguments and result as the backend's write_flash."""
+        self.bytes_skipped = 0
+        self.bytes_written = 0
+        if self.backend.in_process:
+            writes, notes, patches, result = self._sector_plan(port, baud, regions, timeout, cancel_token)
+        else:
+            writes, notes, patches, result = self._region_plan(port, baud, regions, timeout, cancel_token)
+        if result is not None:
+            return result
+
+        for note in notes:
+            if on_line:
+                on_line(note)
+        if writes:
+            result = self.backend.write_flash(port, baud, writes, timeout, on_line, cancel_token, reset, command)
+        elif reset:
+            result = self.backend.reset(port, baud, timeout, cancel_token)
+        else:
+            result = ProcessResult([command], ExitStatus.OK, 0)
+        # A partly rewritten region only counts as written once its sectors were
+        if result.ok:
+            for patch in patches:
+                if on_line:
+                    on_line(patch)
+            notes += patches
+        result.stdout = ''.join(notes) + result.stdout
+        return result
+
+    def _region_plan(self, port, baud, regions, timeout, cancel_token):
+        probe, verified = self.backend.verify_flash(port, baud, regions, timeout, cancel_token)
+        if probe.status in (ExitStatus.CANCELLED, ExitStatus.TIMEOUT, ExitStatus.NOT_FOUND):
+            return None, None, None, probe
+        writes, notes = [], []
+        for address, path in regions:
+            size = os.path.getsize(path)
+            if verified.get(int(address, 0)):
+                notes.append(f"Unchanged {size} bytes at 0x{int(address, 0):08x}\n")
+                self.bytes_skipped += size
+            else:
+                writes.append((address, path))
+                self.bytes_written += size
+        return writes, notes, [], None
+
+    def _sector_plan(self, port, baud, regions, timeout, cancel_token):
+        digests = [image_digests(path) for _, path in regions]
+        probe, device = self.backend.flash_md5(port, baud, [(int(address, 0), image.size)
+                                                            for (address, _), image in zip(regions, digests)],
+                                               timeout, cancel_token)
+        if not probe.ok:
+            return None, None, None, probe
+
+        writes, notes, patches = [], [], []
+        for (address, path), image, flash_md5 in zip(regions, digests, device):
+            offset = int(address, 0)
+            if flash_md5 == image.md5:
+                notes.append(f"Unchanged {image.size} bytes at 0x{offset:08x}\n")
+                self.bytes_skipped += image.size
+                continue
+            if offset % FLASH_SECTOR_SIZE:
+                writes.append((address, path))
+                self.bytes_written += image.size
+                continue
+
+            ranges = [image.sector_range(index) for index in range(len(image.sectors))]
+            probe, device_sectors = self.backend.flash_md5(port, baud, [(offset + start, size) for start, size in ranges],
+                                                           timeout, cancel_token)
+            if not probe.ok:
+                return None, None, None, probe
+            data = get_image_cache().get(path)
+            patched = 0
+            for first, count in changed_runs(image.sectors, device_sectors):
+                start = first * FLASH_SECTOR_SIZE
+                chunk = data.read(start, count * FLASH_SECTOR_SIZE)
+                writes.append((hex(offset + start), chunk))
+                patched += len(chunk)
+            patches.append(f"Patched {patched} of {image.size} bytes at 0x{offset:08x}\n")
+            self.bytes_written += patched
+            self.bytes_skipped += image.size - patched
+        return writes, notes, patches, None
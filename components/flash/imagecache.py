@@ -0,0 +1,160 @@
+import hashlib
+import mmap
+import os
+import threading
+import zlib
+
+from typing import Dict, List, Tuple
+
+
+# esptool pads every image to a multiple of 4 bytes with 0xFF before writing it
+IMAGE_ALIGN = 4
+COMPRESSION_LEVEL = 9
+
+
+class CachedImage:
+    """
+    A firmware image mapped into memory, with the values every flash job needs.
+
+    The file is memory-mapped once; its MD5 (of the padded image, as esptool checks
+    it after writing), SHA-256 (of the file) and the zlib payload sent to the flasher
+    stub are computed on first use and then shared by every station.
+    """
+
+    def __init__(self, path: str, data):
+        self.path = path
+        self.data = data
+        self.pad = b'\xff' * (-len(data) % IMAGE_ALIGN)
+        self._lock = threading.Lock()
+        self._sha256 = None
+        self._md5 = None
+        self._compressed = None
+        self._blocks: Dict[int, List[Tuple[int, int]]] = {}
+
+    @classmethod
+    def from_bytes(cls, data: bytes, name: str = '<bytes>') -> 'CachedImage':
+        """Wraps image data that is not a file, e.g. a differential chunk."""
+        return cls(name, memoryview(data))
+
+    @property
+    def size(self) -> int:
+        """Size of the padded image, i.e. the number of bytes written to flash."""
+        return len(self.data) + len(self.pad)
+
+    def read(self, start: int = 0, length: int = None) -> bytes:
+        """Returns bytes of the padded image."""
+        end = self.size if length is None else min(self.size, start + length)
+        data = bytes(self.data[start:min(end, len(self.data))])
+        if end > len(self.data):
+            data += self.pad[:end - max(start, len(self.data))]
+        return data
+
+    @property
+    def sha256(self) -> str:
+        """SHA-256 of the file contents, which keys the cache."""
+        with self._lock:
+            if self._sha256 is None:
+                self._sha256 = hashlib.sha256(self.data).hexdigest()
+            return self._sha256
+
+    @property
+    def md5(self) -> str:
+        """MD5 of the padded image, as the chip reports it after a write."""
+        with self._lock:
+            if self._md5 is None:
+                digest = hashlib.md5(self.data)
+                digest.update(self.pad)
+                self._md5 = digest.hexdigest()
+            return self._md5
+
+    @property
+    def compressed(self) -> bytes:
+        """zlib payload of the padded image for the stub's compressed write."""
+        with self._lock:
+            if self._compressed is None:
+                compressor = zlib.compressobj(COMPRESSION_LEVEL)
+                self._compressed = compressor.compress(self.data) + compressor.compress(self.pad) + compressor.flush()
+            return self._compressed
+
+    def blocks(self, write_size: int) -> List[Tuple[int, int]]:
+        """
+        Splits the compressed payload into flasher blocks.
+
+        Args:
+            write_size (int): The chip's FLASH_WRITE_SIZE.
+
+        Returns:
+            List[Tuple[int, int]]: (payload offset, uncompressed bytes) per block, so
+            write timeouts and progress need no decompression while writing.
+        """
+        payload = self.compressed
+        with self._lock:
+            if write_size not in self._blocks:
+                decompressor = zlib.decompressobj()
+                self._blocks[write_size] = [
+                    (start, len(decompressor.decompress(payload[start:start + write_size])))
+                    for start in range(0, len(payload), write_size)
+                ]
+            return self._blocks[write_size]
+
+
+class ImageCache:
+    """
+    Process-wide cache of firmware images, keyed by path and checked by size and mtime.
+
+    Images with identical contents share one compressed payload, whichever path they
+    were found under.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._images: Dict[str, Tuple[Tuple[int, int], CachedImage]] = {}
+        self._by_hash: Dict[str, CachedImage] = {}
+
+    def get(self, path: str) -> CachedImage:
+        """
+        Returns the cached image of a file, mapping it again if the file changed.
+
+        Raises:
+            OSError: If the file cannot be read.
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        key = (stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            cached = self._images.get(path)
+            if cached and cached[0] == key:
+                return cached[1]
+
+        image = CachedImage(path, _map_file(path))
+        sha256 = image.sha256
+        with self._lock:
+            image = self._by_hash.setdefault(sha256, image)
+            self._images[path] = (key, image)
+        return image
+
+    def clear(self) -> None:
+        with self._lock:
+            self._images.clear()
+            self._by_hash.clear()
+
+
+def _map_file(path: str):
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return memoryview(b'')
+        # The mapping stays valid after the file is closed
+        return memoryview(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+_image_cache = None
+_image_cache_lock = threading.Lock()
+
+
+def get_image_cache() -> ImageCache:
+    """Returns the image cache shared by every flash job in this process."""
+    global _image_cache
+    with _image_cache_lock:
+        if _image_cache is None:
+            _image_cache = ImageCache()
+        return _image_cache
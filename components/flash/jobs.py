@@ -0,0 +1,532 @@
+import os
+import logging
+
+from components.artifacts.archive import ArchivedFile, flash_source, release_source, source_size
+from components.artifacts.artifacts import get_artifact_index
+from components.config.config import EsptoolCommand
+from components.devicestore.devicestore import CertificateLedger
+from components.flash.differential import DifferentialFlasher
+from components.flash.partitions import (
+    FlashPlanError, FlashRegion, erase_plan, merge_ranges, plan_regions, read_partition_table, record_written_regions
+)
+from components.flash.progress import ProgressParser
+from components.metrics.metrics import Stage
+from components.runner.process import CancelToken, ExitStatus, ProcessResult
+from components.utils.utils import get_utils
+
+
+def describe_failure(result: ProcessResult) -> str:
+    """Returns a one-line description of a failed esptool run for error messages."""
+    if result.status == ExitStatus.TIMEOUT:
+        return f"esptool timed out after {result.seconds:.0f}s"
+    if result.status == ExitStatus.CANCELLED:
+        return "cancelled"
+    if result.status == ExitStatus.NOT_FOUND:
+        return f"esptool not found: {result.stderr}"
+    if result.reason == 'no_reset':
+        return "esptool did not reset the chip"
+    return result.stderr.strip() or f"esptool exited with {result.returncode} ({result.reason or 'unknown error'})"
+
+
+def progress_lines(regions, on_progress=None, on_region=None, prefix=''):
+    """
+    Returns a write_flash on_line callback that prints esptool's output and parses its progress.
+
+    Args:
+        regions (list): (address, path or bytes) tuples being written.
+        on_progress (Callable[[FlashProgress], None], optional): Called after every progress line.
+        on_region (Callable[[RegionThroughput], None], optional): Called for every region written.
+        prefix (str, optional): Printed before every line.
+    """
+    parser = ProgressParser([(int(address, 0), source_size(path)) for address, path in regions], on_progress, on_region)
+
+    def on_line(line):
+        print(prefix + line, end='')
+        parser.feed(line)
+    return on_line
+
+
+def erase_ranges(command, start_address, end_address, partition_table=None):
+    """
+    Returns the flash ranges a job erases before its writes, per the erase section of config.ini.
+
+    erase_region erases the configured start..end range. erase_flash no longer erases
+    the whole chip: only the partitions that could keep stale data are erased (see
+    erase_plan), and only within start..end.
+
+    Args:
+        command (str): erase_flash or erase_region.
+        start_address (str): Start address as in config.ini.
+        end_address (str): End address as in config.ini, '' for the end of flash.
+        partition_table (str, optional): Partition table image written with the
+            firmware; required for erase_flash.
+
+    Returns:
+        list: Sector-aligned (offset, size) pairs.
+
+    Raises:
+        OSError: If the partition table cannot be read.
+    """
+    start = int(start_address or '0', 0)
+    end = int(end_address, 0) if end_address else None
+    if command == EsptoolCommand.ERASE_REGION:
+        return merge_ranges([(start, end)])
+    return erase_plan(read_partition_table(partition_table), start, end)
+
+
+class FlashS3Job:
+    """
+    Certificate and firmware flashing for a single ESP32-S3.
+
+    This holds the flashing logic used by FlashFirmwareS3Thread without any Qt
+    dependency, so it can also be run from a worker pool by the station scheduler.
+    """
+
+    def __init__(self, port, baud, bootloader_address, partition_table_address, ota_data_address, firmware_address, secure_cert_partition_address, data_provider_partition_address, on_message=None, ledger=None, on_progress=None, on_region=None, utils=None, station=''):
+        self.utils = utils or get_utils()
+        self.backend = self.utils.get_esptool_backend()
+        # Firmware writes skip what the chip already holds when differential flashing is on
+        self.firmware_writer = DifferentialFlasher(self.backend) if self.utils.differential_flashS3 else self.backend
+        self.ledger = ledger or CertificateLedger()
+        self.metrics = self.utils.get_metrics()
+        self.port = port
+        # Certificates are reserved under the station name, the same key the prefetcher uses
+        self.station = station or port
+        self.baud = self.utils.flash_baud(port, baud)
+        if self.baud != str(baud):
+            print(f"Using calibrated baud rate {self.baud} for {port} instead of {baud}")
+        self.bootloader_address = bootloader_address
+        self.partition_table_address = partition_table_address
+        self.ota_data_address = ota_data_address
+        self.firmware_address = firmware_address
+        self.secure_cert_partition_address = secure_cert_partition_address
+        self.data_provider_partition_address = data_provider_partition_address
+        self.on_message = on_message
+        self.on_progress = on_progress
+        self.on_region = on_region
+        self.cancel_token = CancelToken()
+        self.success_detected_firmware = False  # Initialize instance variable
+        self.success_detected_certificate = False  # Initialize instance variable
+        self.regions = []  # Plan of the last combined write
+
+        # Device identity flashed by run(), from the claimed device record
+        self.serial_id = ''
+        self.cert_uuid = ''
+        # Certificate bundle already resolved, checked and reserved ahead of the flash (a StagedCertificate)
+        self.staged = None
+
+        self.main_dir = os.path.dirname(os.path.abspath(os.path.join(__file__, '../../')))
+
+    def show_message(self, title, message):
+        """Forwards a message to the registered callback, if any."""
+        if self.on_message:
+            self.on_message(title, message)
+
+    def cancel(self):
+        """Stops the esptool operation of this job, if one is running."""
+        self.cancel_token.cancel()
+
+    def region_written(self, unit):
+        """Returns a callback that stores each written region's throughput under a unit and forwards it."""
+        def on_region(throughput):
+            self.metrics.record_throughput(unit, self.port, throughput.offset, throughput.bytes, throughput.seconds, throughput.kbit_per_second)
+            if self.on_region:
+                self.on_region(throughput)
+        return on_region
+
+    def run(self):
+        """
+        Runs the certificate and firmware flashing processes.
+
+        Returns:
+            bool: True if both the certificate and the firmware were flashed.
+        """
+        if not self.serial_id or not self.cert_uuid:
+            self.show_message("Error", "No device record to flash: claim a serial id and certificate first.")
+            return False
+
+        if not self.erase():
+            self.show_message("Error", "Erasing flash failed.")
+            return False
+
+        if self.utils.combined_flashS3:
+            if not self.flash_combined(self.serial_id, self.cert_uuid):
+                self.show_message("Error", "Certificate and firmware flashing failed.")
+                return False
+            self.show_message("Success", "Firmware and certificate flashing completed successfully!")
+            return True
+
+        # Flash certificate
+        if not self.flash_certificate(self.serial_id, self.cert_uuid):
+            self.show_message("Error", "Certificate flashing failed.")
+            return False
+
+        # Flash firmware
+        if not self.flash_firmware():
+            self.show_message("Error", "Firmware flashing failed.")
+            return False
+
+        self.show_message("Success", "Firmware and certificate flashing completed successfully!")
+        return True
+
+    def erase(self):
+        """
+        Erases stale flash ahead of the writes, timed as the unit's erase_flash stage.
+
+        Does nothing unless erase_flash_esp32s3_enable is set in config.ini.
+        """
+        if not self.utils.enable_erase_flashS3:
+            return True
+        with self.metrics.stage(self.serial_id, Stage.ERASE_FLASH, self.port) as timer:
+            timer.success = self._erase()
+        return timer.success
+
+    def _erase(self):
+        command = self.utils.command_erase_flashS3
+        partition_table = None
+        if command == EsptoolCommand.ERASE_FLASH:
+            partition_table = get_artifact_index().firmware_images(self.utils.filepath_firmwareS3, 'rc')['partition-table']
+            if partition_table is None:
+                self.show_message("Error", f"Partition table not found in {self.utils.filepath_firmwareS3}; cannot plan the erase.")
+                return False
+        try:
+            ranges = erase_ranges(command, self.utils.address_start_erase_flashS3, self.utils.address_end_erase_flashS3, partition_table)
+        except OSError as e:
+            self.show_message("Error", f"Cannot read the partition table: {e}")
+            return False
+
+        print(f"Erasing: {', '.join(f'0x{offset:x}+0x{size:x}' for offset, size in ranges)} on {self.port}")
+        result = self.backend.erase_region(self.port, self.baud, ranges,
+                                           timeout=self.utils.timeout_esptool_flash,
+                                           on_line=lambda line: print("Erasing: " + line, end=''),
+                                           cancel_token=self.cancel_token)
+        if result is not None and not result.ok:
+            self.show_message("Error", f"An error occurred while erasing the flash: {describe_failure(result)}")
+            return False
+        return True
+
+    def firmware_regions(self):
+        """
+        Resolves the firmware images to write.
+
+        Returns:
+            list: (label, address, path) tuples, or None if an image is missing.
+        """
+        print(f"Address Bootloader: {self.bootloader_address}")
+        print(f"Address Partition Table: {self.partition_table_address}")
+        print(f"Address OTA Data Initial: {self.ota_data_address}")
+        print(f"Address Firmware: {self.firmware_address}")
+
+        images = get_artifact_index().firmware_images(self.utils.filepath_firmwareS3, 'rc')
+        missing = [role for role, path in images.items() if path is None]
+        if missing:
+            self.show_message("Error", f"Firmware image(s) not found in {self.utils.filepath_firmwareS3}: {', '.join(missing)}")
+            return None
+
+        return [
+            ('bootloader', self.bootloader_address, images['bootloader']),
+            ('partition-table', self.partition_table_address, images['partition-table']),
+            ('ota_data_initial', self.ota_data_address, images['ota_data_initial']),
+            ('app', self.firmware_address, images['app'])
+        ]
+
+    def certificate_regions(self, serialnumber, uuid):
+        """
+        Resolves a device's certificate bundle and reserves it in the ledger.
+
+        Returns:
+            list: (label, address, source) tuples, or None if the bundle is missing or
+            already issued. A source is a path, or an ArchivedFile when the bundle is
+            packed in a certificate archive.
+        """
+        print(f"Flashing Cert: Address Secure Cert Partition: {self.secure_cert_partition_address}")
+        print(f"Flashing Cert: Address Data Provider Partition: {self.data_provider_partition_address}")
+        addresses = {'secure_cert': self.secure_cert_partition_address, 'data_provider': self.data_provider_partition_address}
+
+        # A staged bundle was found, checked and reserved while the previous unit flashed
+        staged = self.staged
+        if staged is not None and (staged.serial_id, staged.cert_uuid) == (str(serialnumber), str(uuid)) and staged.unchanged():
+            print(f"Flashing Cert: using the bundle staged for {serialnumber}")
+            return [(label, addresses[label], path) for label, _, path in staged.regions]
+
+        self.certs_dir = self.utils.filepath_certificatesS3 or os.path.join(self.main_dir, 'certificates')
+        logging.info(f"Flashing Cert: {self.certs_dir}")
+        print(f"Flashing Cert: {self.certs_dir}")
+
+        # Resolve this device's bundle by UUID from the artifact index instead of walking the tree
+        cert = get_artifact_index().certificate(str(uuid), self.certs_dir)
+        if 'secure_cert' not in cert or 'data_provider' not in cert:
+            self.show_message("Error", f"Flashing Cert: Certificate binaries for {serialnumber} ({uuid}) not found in {self.certs_dir}.")
+            return None
+        self.cert_bin_path = os.path.dirname(cert['secure_cert'].archive.path if isinstance(cert['secure_cert'], ArchivedFile)
+                                             else cert['secure_cert'])
+        print(f"Certificate binary: {self.cert_bin_path}")
+
+        # Reserve the DAC before writing it so it can never be issued to another serial id
+        if not self.ledger.reserve(str(uuid), str(serialnumber), station=self.station):
+            entry = self.ledger.entry(str(uuid))
+            self.show_message("Error", f"Flashing Cert: Certificate {uuid} was already issued ({entry['status']} for {entry['serial_id']}).")
+            return None
+
+        return [
+            ('secure_cert', addresses['secure_cert'], cert['secure_cert']),
+            ('data_provider', addresses['data_provider'], cert['data_provider'])
+        ]
+
+    def flash_firmware(self):
+        """Flashes the firmware, timed as the unit's flash_firmware stage."""
+        with self.metrics.stage(self.serial_id, Stage.FLASH_FIRMWARE, self.port) as timer:
+            timer.success = self._flash_firmware()
+        return timer.success
+
+    def _flash_firmware(self):
+        regions = self.firmware_regions()
+        if regions is None:
+            return False
+
+        print(f"Command: write_flash {regions} on {self.port} at {self.baud}")
+
+        self.success_detected_firmware = False  # Reset success_detected before starting
+        # The firmware is the unit's last write, so the chip is reset after it
+        writes = [(address, path) for _, address, path in regions]
+        result = self.firmware_writer.write_flash(self.port, self.baud, writes,
+                                                  timeout=self.utils.timeout_esptool_flash,
+                                                  on_line=progress_lines(writes, self.on_progress, self.region_written(self.serial_id)),
+                                                  cancel_token=self.cancel_token, reset=True)
+        if not result.ok:
+            self.show_message("Error", f"An error occurred while flashing the firmware: {describe_failure(result)}")
+            return False
+        self.success_detected_firmware = True
+        return self.success_detected_firmware
+
+    def flash_certificate(self, serialnumber, uuid):
+        """Runs the certificate flashing process, timed as the unit's flash_certificate stage."""
+        with self.metrics.stage(str(serialnumber), Stage.FLASH_CERTIFICATE, self.port) as timer:
+            timer.success = self._flash_certificate(serialnumber, uuid)
+        return timer.success
+
+    def _flash_certificate(self, serialnumber, uuid):
+        regions = self.certificate_regions(serialnumber, uuid)
+        if regions is None:
+            return False
+
+        print(f"Flashing Cert: {regions}")
+
+        self.success_detected_certificate = False  # Reset success_detected before starting
+        # The firmware is written next, so an in-process session stays open
+        # Archived certificates go to an in-process backend as slices of the archive's mapping
+        writes = [(address, flash_source(source, self.backend.in_process)) for _, address, source in regions]
+        try:
+            result = self.backend.write_flash(self.port, self.baud, writes,
+                                              timeout=self.utils.timeout_esptool_flash,
+                                              on_line=progress_lines(writes, self.on_progress, self.region_written(str(serialnumber)), "Flashing Cert: "),
+                                              cancel_token=self.cancel_token, reset=False)
+        finally:
+            # Certificates extracted for an esptool process hold device keys; they go with the write
+            for _, _, source in regions:
+                release_source(source, self.backend.in_process)
+        if not result.ok:
+            self.show_message("Error", f"Flashing Cert: An error occurred while flashing the certificate: {describe_failure(result)}")
+            return False
+        self.success_detected_certificate = True
+        self.ledger.consume(str(uuid))
+        return self.success_detected_certificate
+
+    def flash_combined(self, serialnumber, uuid):
+        """
+        Writes the certificate bundle and the firmware with a single write_flash.
+
+        The regions are checked against each other and against the partition table
+        being written before anything is flashed. self.regions keeps the plan with
+        each region's written flag and time from esptool's output. The write is timed
+        as the unit's flash_combined stage.
+        """
+        with self.metrics.stage(str(serialnumber), Stage.FLASH_COMBINED, self.port) as timer:
+            timer.success = self._flash_combined(serialnumber, uuid)
+        return timer.success
+
+    def _flash_combined(self, serialnumber, uuid):
+        firmware = self.firmware_regions()
+        if firmware is None:
+            return False
+        certificate = self.certificate_regions(serialnumber, uuid)
+        if certificate is None:
+            return False
+
+        try:
+            partition_table = dict((label, path) for label, _, path in firmware)['partition-table']
+            self.regions = plan_regions(
+                [FlashRegion(label, address, path, source_size(path)) for label, address, path in certificate + firmware],
+                read_partition_table(partition_table),
+                int(self.partition_table_address, 0)
+            )
+        except (OSError, FlashPlanError) as e:
+            self.show_message("Error", f"Cannot combine certificate and firmware: {e}")
+            return False
+        for region in self.regions:
+            print(f"Region: {region.label} 0x{region.offset:x}-0x{region.end:x} -> {region.partition}")
+
+        self.success_detected_certificate = False
+        self.success_detected_firmware = False
+        # The differential writer hashes its images from files, so only the plain backend gets archive slices
+        in_process = self.firmware_writer is self.backend and self.backend.in_process
+        writes = [(region.address, flash_source(region.path, in_process)) for region in self.regions]
+        try:
+            result = self.firmware_writer.write_flash(self.port, self.baud, writes,
+                                                      timeout=self.utils.timeout_esptool_flash,
+                                                      on_line=progress_lines(writes, self.on_progress, self.region_written(str(serialnumber))),
+                                                      cancel_token=self.cancel_token, reset=True)
+        finally:
+            for region in self.regions:
+                release_source(region.path, in_process)
+        record_written_regions(self.regions, result.stdout)
+        for region in self.regions:
+            print(f"Region {region.label}: {'written in %.1fs' % region.seconds if region.written else 'not written'}")
+
+        written = dict((region.label, region.written) for region in self.regions)
+        self.success_detected_certificate = result.ok and written['secure_cert'] and written['data_provider']
+        self.success_detected_firmware = result.ok and all(written[label] for label, _, _ in firmware)
+        if not result.ok:
+            not_written = ', '.join(region.label for region in self.regions if not region.written)
+            self.show_message("Error", f"An error occurred while flashing ({not_written} not written): {describe_failure(result)}")
+            return False
+        if self.success_detected_certificate:
+            self.ledger.consume(str(uuid))
+        return self.success_detected_certificate and self.success_detected_firmware
+
+
+class FlashH2Job:
+    """
+    Firmware flashing for a single ESP32-H2.
+
+    This holds the flashing logic used by FlashFirmwareH2Thread without any Qt
+    dependency, so it can also be run from a worker pool by the station scheduler.
+    """
+
+    def __init__(self, port, baud, command, bootloader_address, partition_table_address, firmware_address, on_message=None, unit='', on_progress=None, on_region=None, utils=None):
+        self.utils = utils or get_utils()
+        self.metrics = self.utils.get_metrics()
+        # Serial id the flash is timed under; the port until the unit is known
+        self.unit = unit or port
+        self.backend = self.utils.get_esptool_backend()
+        # Firmware writes skip what the chip already holds when differential flashing is on
+        self.firmware_writer = DifferentialFlasher(self.backend) if self.utils.differential_flashH2 else self.backend
+        self.port = port
+        self.baud = self.utils.flash_baud(port, baud)
+        if self.baud != str(baud):
+            print(f"Using calibrated baud rate {self.baud} for {port} instead of {baud}")
+        self.command = command
+        self.bootloader_address = bootloader_address
+        self.partition_table_address = partition_table_address
+        self.firmware_address = firmware_address
+        self.on_message = on_message
+        self.on_progress = on_progress
+        self.on_region = on_region
+        self.cancel_token = CancelToken()
+        self.success_detected = False  # Initialize instance variable
+
+    def show_message(self, title, message):
+        """Forwards a message to the registered callback, if any."""
+        if self.on_message:
+            self.on_message(title, message)
+
+    def cancel(self):
+        """Stops the esptool operation of this job, if one is running."""
+        self.cancel_token.cancel()
+
+    def region_written(self, throughput):
+        """Stores a written region's throughput under the unit and forwards it."""
+        self.metrics.record_throughput(self.unit, self.port, throughput.offset, throughput.bytes, throughput.seconds, throughput.kbit_per_second)
+        if self.on_region:
+            self.on_region(throughput)
+
+    def run(self):
+        """
+        Runs the firmware flashing processes.
+
+        Returns:
+            bool: True if the firmware was flashed.
+        """
+        if not self.erase():
+            self.show_message("Error", "Erasing flash failed.")
+            return False
+
+        # Flash firmware
+        if not self.flash_firmware():
+            self.show_message("Error", "Firmware flashing failed.")
+            return False
+
+        self.show_message("Success", "H2 Firmware flashing completed successfully!")
+        return True
+
+    def erase(self):
+        """
+        Erases stale flash ahead of the write, timed as the unit's erase_flash_h2 stage.
+
+        Does nothing unless erase_flash_esp32h2_enable is set in config.ini.
+        """
+        if not self.utils.enable_erase_flashH2:
+            return True
+        with self.metrics.stage(self.unit, Stage.ERASE_FLASH_H2, self.port) as timer:
+            timer.success = self._erase()
+        return timer.success
+
+    def _erase(self):
+        command = self.utils.command_erase_flashH2
+        partition_table = None
+        if command == EsptoolCommand.ERASE_FLASH:
+            partition_table = get_artifact_index().firmware_images(self.utils.filepath_firmwareH2, 'H2')['partition-table']
+            if partition_table is None:
+                self.show_message("Error", f"Partition table not found in {self.utils.filepath_firmwareH2}; cannot plan the erase.")
+                return False
+        try:
+            ranges = erase_ranges(command, self.utils.address_start_erase_flashH2, self.utils.address_end_erase_flashH2, partition_table)
+        except OSError as e:
+            self.show_message("Error", f"Cannot read the partition table: {e}")
+            return False
+
+        print(f"Erasing: {', '.join(f'0x{offset:x}+0x{size:x}' for offset, size in ranges)} on {self.port}")
+        result = self.backend.erase_region(self.port, self.baud, ranges,
+                                           timeout=self.utils.timeout_esptool_flash,
+                                           on_line=lambda line: print("Erasing: " + line, end=''),
+                                           cancel_token=self.cancel_token)
+        if result is not None and not result.ok:
+            self.show_message("Error", f"An error occurred while erasing the flash: {describe_failure(result)}")
+            return False
+        return True
+
+    def flash_firmware(self):
+        """Flashes the firmware, timed as the unit's flash_firmware_h2 stage."""
+        with self.metrics.stage(self.unit, Stage.FLASH_FIRMWARE_H2, self.port) as timer:
+            timer.success = self._flash_firmware()
+        return timer.success
+
+    def _flash_firmware(self):
+        print(f"Address Bootloader: {self.bootloader_address}")
+        print(f"Address Partition Table: {self.partition_table_address}")
+        print(f"Address Firmware: {self.firmware_address}")
+
+        images = get_artifact_index().firmware_images(self.utils.filepath_firmwareH2, 'H2')
+        missing = [role for role in ('bootloader', 'partition-table', 'app') if images[role] is None]
+        if missing:
+            self.show_message("Error", f"Firmware image(s) not found in {self.utils.filepath_firmwareH2}: {', '.join(missing)}")
+            return False
+
+        regions = [
+            (self.bootloader_address, images['bootloader']),
+            (self.partition_table_address, images['partition-table']),
+            (self.firmware_address, images['app'])
+        ]
+
+        print(f"Command: {self.command} {regions}")
+
+        self.success_detected = False  # Reset success_detected before starting
+        result = self.firmware_writer.write_flash(self.port, self.baud, regions,
+                                                  timeout=self.utils.timeout_esptool_flash,
+                                                  on_line=progress_lines(regions, self.on_progress, self.region_written),
+                                                  cancel_token=self.cancel_token, command=self.command)
+        if not result.ok:
+            self.show_message("Error", f"An error occurred while flashing the firmware: {describe_failure(result)}")
+            return False
+        self.success_detected = True
+        return self.success_detected
@@ -0,0 +1,228 @@
+import re
+import struct
+
+from typing import Dict, List, Optional, Tuple
+
+
+PARTITION_TABLE_ADDRESS = 0x8000
+PARTITION_ENTRY_SIZE = 32
+PARTITION_MAGIC = b'\xaa\x50'
+PARTITION_MD5_MAGIC = b'\xeb\xeb'
+FLASH_SECTOR_SIZE = 0x1000
+APP_PARTITION_TYPE = 0x00
+# Gaps up to this size between ranges to erase are erased too: that costs less than
+# another esptool connection, and the gap is unused or about to be rewritten anyway
+ERASE_BRIDGE_SIZE = 0x10000
+
+# esptool's summary line for each region it wrote, e.g.
+# "Wrote 21136 bytes (13090 compressed) at 0x00000000 in 0.4 seconds (effective 430.0 kbit/s)..."
+WROTE_PATTERN = re.compile(r'Wrote (\d+) bytes.*? at 0x([0-9a-fA-F]+) in ([\d.]+) seconds')
+# Regions a differential write left alone or only partly rewrote
+SKIPPED_PATTERN = re.compile(r'(?:Unchanged|Patched) (\d+)(?: of \d+)? bytes at 0x([0-9a-fA-F]+)')
+
+
+class FlashPlanError(ValueError):
+    """Raised when flash regions overlap each other or do not fit the partition table."""
+
+
+class Partition:
+    """One entry of an ESP-IDF partition table."""
+
+    def __init__(self, name: str, type: int, subtype: int, offset: int, size: int):
+        self.name = name
+        self.type = type
+        self.subtype = subtype
+        self.offset = offset
+        self.size = size
+
+    @property
+    def end(self) -> int:
+        return self.offset + self.size
+
+    def __repr__(self):
+        return f"Partition({self.name!r}, 0x{self.offset:x}, 0x{self.size:x})"
+
+
+def parse_partition_table(data: bytes) -> List[Partition]:
+    """
+    Parses a binary ESP-IDF partition table.
+
+    Args:
+        data (bytes): Contents of partition-table.bin.
+
+    Returns:
+        List[Partition]: Entries in table order. Parsing stops at the MD5 entry or
+        the first erased entry.
+    """
+    partitions = []
+    for start in range(0, len(data) - PARTITION_ENTRY_SIZE + 1, PARTITION_ENTRY_SIZE):
+        entry = data[start:start + PARTITION_ENTRY_SIZE]
+        if entry[:2] != PARTITION_MAGIC:
+            break
+        type, subtype, offset, size = struct.unpack('<BBII', entry[2:12])
+        name = entry[12:28].split(b'\0', 1)[0].decode('ascii', errors='replace')
+        partitions.append(Partition(name, type, subtype, offset, size))
+    return partitions
+
+
+def read_partition_table(path: str) -> List[Partition]:
+    """Reads and parses a partition-table.bin file."""
+    with open(path, 'rb') as file:
+        return parse_partition_table(file.read())
+
+
+class FlashRegion:
+    """
+    One image to write and, once planned, where it lands.
+
+    Args:
+        label (str): What the image is, e.g. 'bootloader' or 'secure_cert'.
+        address (str): Flash address as written in config.ini, e.g. '0xD000'.
+        path (str): Image file.
+        size (int): Image size in bytes.
+    """
+
+    def __init__(self, label: str, address: str, path: str, size: int):
+        self.label = label
+        self.address = address
+        self.path = path
+        self.size = size
+        self.offset = int(address, 0)
+        self.partition = ''
+        # Filled in from esptool's output by record_written_regions
+        self.written = False
+        self.seconds = 0.0
+
+    @property
+    def end(self) -> int:
+        return self.offset + self.size
+
+    @property
+    def erase_end(self) -> int:
+        """End of the last flash sector write_flash erases for this image."""
+        return -(-self.end // FLASH_SECTOR_SIZE) * FLASH_SECTOR_SIZE
+
+    def __repr__(self):
+        return f"FlashRegion({self.label!r}, 0x{self.offset:x}-0x{self.end:x}, {self.partition or '-'})"
+
+
+def plan_regions(regions: List[FlashRegion], partitions: List[Partition],
+                 table_address: int = PARTITION_TABLE_ADDRESS) -> List[FlashRegion]:
+    """
+    Checks that images can be written together and assigns each to its partition.
+
+    Images are compared on the flash sectors write_flash erases, not only on their
+    bytes, since two images sharing a sector would erase each other. Everything
+    below the partition table is the bootloader area; every image above it must fit
+    inside a single partition.
+
+    Args:
+        regions (List[FlashRegion]): Images to write.
+        partitions (List[Partition]): The table that is written along with them.
+        table_address (int): Offset of the partition table.
+
+    Returns:
+        List[FlashRegion]: The regions sorted by offset, with partition set.
+
+    Raises:
+        FlashPlanError: If two images overlap or one does not fit its partition.
+    """
+    planned = sorted(regions, key=lambda region: region.offset)
+    for previous, region in zip(planned, planned[1:]):
+        if region.offset < previous.erase_end:
+            raise FlashPlanError(f"{region.label} at 0x{region.offset:x} overlaps {previous.label} "
+                                 f"(0x{previous.offset:x}-0x{previous.erase_end:x})")
+
+    for region in planned:
+        if region.offset < table_address:
+            if region.end > table_address:
+                raise FlashPlanError(f"{region.label} at 0x{region.offset:x} runs into the partition table at 0x{table_address:x}")
+            region.partition = '(bootloader)'
+        elif region.offset == table_address:
+            region.partition = '(partition table)'
+        else:
+            partition = _containing_partition(partitions, region)
+            if partition is None:
+                raise FlashPlanError(f"{region.label} at 0x{region.offset:x}-0x{region.end:x} does not fit inside any partition")
+            region.partition = partition.name
+    return planned
+
+
+def _containing_partition(partitions: List[Partition], region: FlashRegion) -> Optional[Partition]:
+    for partition in partitions:
+        if partition.offset <= region.offset and region.end <= partition.end:
+            return partition
+    return None
+
+
+def erase_plan(partitions: List[Partition], start: int = 0, end: Optional[int] = None) -> List[Tuple[int, int]]:
+    """
+    Returns the flash ranges to erase so a rewritten unit keeps no stale data.
+
+    Every partition that is not an application partition is erased: NVS, OTA data,
+    certificate and storage partitions are read by the firmware as a whole, while an
+    application partition is only read up to the image that write_flash puts there
+    (and erases itself). Partitions closer than ERASE_BRIDGE_SIZE are merged, so a
+    typical table gives one or two ranges instead of the whole chip.
+
+    Args:
+        partitions (List[Partition]): The table written with the unit's firmware.
+        start (int): Nothing below this offset is erased.
+        end (int, optional): Nothing from this offset on is erased.
+
+    Returns:
+        List[Tuple[int, int]]: Sector-aligned (offset, size) pairs, sorted by offset.
+    """
+    ranges = []
+    for partition in sorted(partitions, key=lambda partition: partition.offset):
+        if partition.type == APP_PARTITION_TYPE:
+            continue
+        ranges.append((max(partition.offset, start), partition.end if end is None else min(partition.end, end)))
+    return merge_ranges(ranges, ERASE_BRIDGE_SIZE)
+
+
+def merge_ranges(ranges: List[Tuple[int, int]], bridge: int = 0) -> List[Tuple[int, int]]:
+    """
+    Aligns (start, end) ranges to flash sectors and merges the ones that touch.
+
+    Args:
+        ranges (List[Tuple[int, int]]): (start, end) offsets.
+        bridge (int): Ranges separated by at most this many bytes are merged as well.
+
+    Returns:
+        List[Tuple[int, int]]: (offset, size) pairs, sorted by offset; empty ranges are dropped.
+    """
+    merged = []
+    for start, end in sorted(ranges):
+        start = start // FLASH_SECTOR_SIZE * FLASH_SECTOR_SIZE
+        end = -(-end // FLASH_SECTOR_SIZE) * FLASH_SECTOR_SIZE
+        if end <= start:
+            continue
+        if merged and start <= merged[-1][1] + bridge:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [(start, end - start) for start, end in merged]
+
+
+def record_written_regions(regions: List[FlashRegion], output: str) -> Dict[int, Tuple[int, float]]:
+    """
+    Marks the regions esptool reported as written.
+
+    Args:
+        regions (List[FlashRegion]): Planned regions.
+        output (str): esptool's output.
+
+    Returns:
+        Dict[int, Tuple[int, float]]: Bytes and seconds per written offset.
+    """
+    written = {}
+    for match in WROTE_PATTERN.finditer(output):
+        written[int(match.group(2), 16)] = (int(match.group(1)), float(match.group(3)))
+    for match in SKIPPED_PATTERN.finditer(output):
+        written.setdefault(int(match.group(2), 16), (int(match.group(1)), 0.0))
+    for region in regions:
+        if region.offset in written:
+            region.written = True
+            region.seconds = written[region.offset][1]
+    return written
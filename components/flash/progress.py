@@ -0,0 +1,150 @@
+import re
+import time
+
+from typing import Callable, Dict, List, Optional, Tuple
+
+from components.flash.partitions import SKIPPED_PATTERN, WROTE_PATTERN
+
+
+# esptool's progress line, e.g. "Writing at 0x00012000... (6 %)"
+WRITING_PATTERN = re.compile(r'Writing at 0x([0-9a-fA-F]+)\.*\s*\((\d+) ?%\)')
+EFFECTIVE_PATTERN = re.compile(r'effective ([\d.]+) kbit/s')
+
+
+class FlashProgress:
+    """
+    Progress of a write_flash run, after one line of esptool output.
+
+    Args:
+        offset (int): Flash offset of the region being written.
+        bytes_written (int): Bytes of all regions written (or found unchanged) so far.
+        bytes_total (int): Bytes of all regions.
+        kbit_per_second (float): Throughput of the run so far; 0 before the first block.
+        eta_seconds (float): Estimated seconds left, or None while unknown.
+    """
+
+    def __init__(self, offset: int, bytes_written: int, bytes_total: int, kbit_per_second: float, eta_seconds: Optional[float]):
+        self.offset = offset
+        self.bytes_written = bytes_written
+        self.bytes_total = bytes_total
+        self.kbit_per_second = kbit_per_second
+        self.eta_seconds = eta_seconds
+
+    @property
+    def percent(self) -> int:
+        return 100 * self.bytes_written // self.bytes_total if self.bytes_total else 100
+
+    def __repr__(self):
+        eta = f"{self.eta_seconds:.1f}s" if self.eta_seconds is not None else '?'
+        return f"FlashProgress(0x{self.offset:x}, {self.percent} %, {self.kbit_per_second:.1f} kbit/s, ETA {eta})"
+
+
+class RegionThroughput:
+    """Bytes, time and effective throughput esptool reported for one written region."""
+
+    def __init__(self, offset: int, bytes: int, seconds: float, kbit_per_second: float):
+        self.offset = offset
+        self.bytes = bytes
+        self.seconds = seconds
+        self.kbit_per_second = kbit_per_second
+
+    def __repr__(self):
+        return f"RegionThroughput(0x{self.offset:x}, {self.bytes} bytes, {self.seconds:.1f}s, {self.kbit_per_second:.1f} kbit/s)"
+
+
+class ProgressParser:
+    """
+    Turns esptool's write_flash output into progress events.
+
+    Feed it every line of output. "Writing at 0x... (NN %)" lines advance the region
+    they fall in, "Wrote N bytes ... in X seconds" lines complete it and report its
+    effective throughput, and a differential write's "Unchanged ..." lines count a
+    region as done without writing it. Throughput and ETA are measured on the
+    monotonic clock from the first block written.
+
+        on_progress(FlashProgress)
+        on_region(RegionThroughput)
+
+    Args:
+        regions (List[Tuple[int, int]]): (offset, size) of every region of the run.
+    """
+
+    def __init__(self, regions: List[Tuple[int, int]], on_progress: Callable[[FlashProgress], None] = None,
+                 on_region: Callable[[RegionThroughput], None] = None):
+        self.regions = sorted(regions)
+        self.bytes_total = sum(size for _, size in self.regions)
+        self.on_progress = on_progress
+        self.on_region = on_region
+        self.throughput: List[RegionThroughput] = []
+        self._written: Dict[int, int] = {offset: 0 for offset, _ in self.regions}
+        self._skipped = 0
+        self._start = None
+
+    def _region(self, address: int) -> Optional[Tuple[int, int]]:
+        for offset, size in self.regions:
+            if offset <= address < offset + max(size, 1):
+                return offset, size
+        return None
+
+    def _advance(self, offset: int, size: int, written: int) -> None:
+        self._written[offset] = min(size, max(self._written[offset], written))
+
+    def feed(self, text: str) -> None:
+        """Parses one or more lines of esptool output."""
+        # Progress lines are rewritten with '\r' when esptool runs on a terminal
+        for line in text.replace('\r', '\n').split('\n'):
+            if line.strip():
+                self._parse(line)
+
+    def _parse(self, line: str) -> None:
+        match = WRITING_PATTERN.search(line)
+        if match:
+            region = self._region(int(match.group(1), 16))
+            if region is None:
+                return
+            if self._start is None:
+                self._start = time.monotonic()
+            offset, size = region
+            # The line is printed before a block is sent and its address counts the
+            # uncompressed bytes sent so far, so it is exact for differential chunks too
+            self._advance(offset, size, int(match.group(1), 16) - offset)
+            self._report(offset)
+            return
+
+        match = WROTE_PATTERN.search(line)
+        if match:
+            count, address, seconds = int(match.group(1)), int(match.group(2), 16), float(match.group(3))
+            region = self._region(address)
+            if region is None:
+                return
+            offset, size = region
+            self._advance(offset, size, address + count - offset)
+            effective = EFFECTIVE_PATTERN.search(line)
+            kbit_per_second = float(effective.group(1)) if effective else (count * 8 / 1000 / seconds if seconds else 0.0)
+            throughput = RegionThroughput(address, count, seconds, kbit_per_second)
+            self.throughput.append(throughput)
+            if self.on_region:
+                self.on_region(throughput)
+            self._report(offset)
+            return
+
+        match = SKIPPED_PATTERN.search(line)
+        if match and line.startswith('Unchanged'):
+            region = self._region(int(match.group(2), 16))
+            if region is not None:
+                offset, size = region
+                self._skipped += size - self._written[offset]
+                self._advance(offset, size, size)
+                self._report(offset)
+
+    def progress(self, offset: int = 0) -> FlashProgress:
+        """Returns the progress of the run so far."""
+        written = sum(self._written.values())
+        elapsed = time.monotonic() - self._start if self._start is not None else 0.0
+        rate = (written - self._skipped) / elapsed if elapsed > 0 else 0.0
+        eta = (self.bytes_total - written) / rate if rate > 0 else (0.0 if written >= self.bytes_total else None)
+        return FlashProgress(offset, written, self.bytes_total, rate * 8 / 1000, eta)
+
+    def _report(self, offset: int) -> None:
+        if self.on_progress:
+            self.on_progress(self.progress(offset))
@@ -1,40 +1,94 @@
-from PyQt6.QtWidgets import QMainWindow, QComboBox, QLabel, QVBoxLayout, QHBoxLayout, QWidget, QPushButton, QMessageBox, QSizePolicy, QGroupBox
+from PyQt6.QtWidgets import QMainWindow, QComboBox, QLabel, QVBoxLayout, QHBoxLayout, QWidget, QPushButton, QMessageBox, QSizePolicy, QGroupBox, QProgressBar
 from PyQt6.QtGui import QAction, QFont
-from PyQt6.QtCore import Qt
-from components.serialcom.serialcom import SerialCommunicator, SerialReaderThread
-from components.utils.utils import Utils
-from components.flash.flash import FlashFirmwareS3Thread, FlashFirmwareH2Thread
+from PyQt6.QtCore import Qt, QObject, QTimer, pyqtSignal
+from components.utils.utils import get_utils
+from components.station.station import default_station, load_stations
+from components.artifacts.artifacts import get_artifact_index
+from components.portmonitor.monitor import FixtureMap
+from components.portmonitor.portmonitor import PortMonitorBridge
+
+# Flashing, factory, import and calibration threads (and the esptool runners, serial
+# and sqlite behind them) are imported when first used, so the window opens sooner
+
+class StationSchedulerBridge(QObject):
+    """Re-emits StationScheduler callbacks, which arrive on worker threads, as Qt signals."""
+    state_changed = pyqtSignal(str, str)
+    progress_changed = pyqtSignal(int, int)
+
+class UnitPipelineBridge(QObject):
+    """Re-emits UnitPipeline callbacks, which arrive on worker threads, as Qt signals."""
+    stage_finished = pyqtSignal(str, str, bool)  # Station, stage, success
+    flash_progress = pyqtSignal(str, object)  # 's3' or 'h2', FlashProgress
+    factory_step_finished = pyqtSignal(str, bool, str)  # Step name, success, value or error
+    unit_finished = pyqtSignal(object)  # UnitResult
+
+class StartupBridge(QObject):
+    """Reports startup work that runs on the worker pool back to the GUI thread."""
+    index_built = pyqtSignal(str)  # Error message, empty on success
+    orders_counted = pyqtSignal(object)  # Order summaries, see OrderIndex.counts
+
 class SerialPortSelector(QMainWindow):
     def __init__(self):
         super().__init__()
         self.setWindowTitle("Serial Port Selector")
         self.setGeometry(100, 100, 800, 600)  # Set initial size and position of the window
         
-        # Create instances of Utils and SerialCommunicator
-        self.utils = Utils()
-        self.serialcom = SerialCommunicator()
+        # Settings are parsed once and shared with every thread the window starts
+        self.utils = get_utils()
+        # Database and index work waits until the window is shown
+        QTimer.singleShot(0, self.finish_startup)
         
         # Initialization
-        self.serial_thread = None
+        self.import_thread = None
+        self.calibration_thread = None
+        self.unit_pool = None
+        self.unit_pipeline = None
+        self.unit_run = None
+        self.unit_bridge = UnitPipelineBridge(self)
+        self.unit_bridge.stage_finished.connect(self.on_unit_stage_finished)
+        self.unit_bridge.flash_progress.connect(self.on_unit_flash_progress)
+        self.unit_bridge.factory_step_finished.connect(self.on_factory_step_finished)
+        self.unit_bridge.unit_finished.connect(self.on_unit_finished)
+        self.startup_bridge = StartupBridge(self)
+        self.startup_bridge.index_built.connect(self.on_artifact_index_built)
+        self.startup_bridge.orders_counted.connect(self.fill_order_combo_box)
+        self.station_scheduler = None
+        self.station_bridge = StationSchedulerBridge(self)
+        self.station_bridge.state_changed.connect(self.on_station_state_changed)
+        self.station_bridge.progress_changed.connect(self.on_station_progress_changed)
+        self.station_fixtures = FixtureMap(load_stations(utils=self.utils))
+
+        # Watch for jigs being plugged in and out; the first scan runs here
+        self.port_monitor = PortMonitorBridge(self.utils.port_monitor_interval, self)
+        self.port_monitor.start()
+        self.port_monitor.port_added.connect(self.on_port_added)
+        self.port_monitor.port_removed.connect(self.on_port_removed)
+        ports = sorted(self.port_monitor.ports())
 
         # Create GUI components
         self.flash_port_label = self.create_label("ESP32S3 Flash Port    :")
-        self.flash_port_combo_box = self.create_combo_box(self.serialcom.get_serial_ports_as_str())
+        self.flash_port_combo_box = self.create_combo_box(ports)
         self.flash_baud_rate_label = self.create_label("Baud Rate:")
         self.flash_baud_rate_combo_box = self.create_baud_rate_combo_box()
 
         self.factory_port_label = self.create_label("ESP32S3 Factory Port:")
-        self.factory_port_combo_box = self.create_combo_box(self.serialcom.get_serial_ports_as_str())
+        self.factory_port_combo_box = self.create_combo_box(ports)
         self.factory_baud_rate_label = self.create_label("Baud Rate:")
         self.factory_baud_rate_combo_box = self.create_baud_rate_combo_box()
 
         self.h2_flash_port_label = self.create_label("ESP32H2 Flash Port    :")
-        self.h2_flash_port_combo_box = self.create_combo_box(self.serialcom.get_serial_ports_as_str())
+        self.h2_flash_port_combo_box = self.create_combo_box(ports)
         self.h2_flash_baud_rate_label = self.create_label("Baud Rate:")
         self.h2_flash_baud_rate_combo_box = self.create_baud_rate_combo_box()
 
         self.order_id_label = self.create_label("Order ID:")
-        self.order_id_combo_box = self.create_combo_box(self.utils.read_order('device_data.txt'))
+        # Filled by finish_startup, once the order file and the database have been read
+        self.order_id_combo_box = self.create_combo_box([])
+        
+        self.s3_flash_progress_label = self.create_label("ESP32S3 Flash Progress:")
+        self.s3_flash_progress_bar = self.create_progress_bar()
+        self.h2_flash_progress_label = self.create_label("ESP32H2 Flash Progress:")
+        self.h2_flash_progress_bar = self.create_progress_bar()
         
         # Connect signal to print selected order ID
         self.order_id_combo_box.currentIndexChanged.connect(self.print_selected_order_id)
@@ -65,12 +119,16 @@ class SerialPortSelector(QMainWindow):
         factory_port_layout = self.create_section_layout(self.factory_port_label, self.factory_port_combo_box, self.factory_baud_rate_label, self.factory_baud_rate_combo_box)
         h2_flash_port_layout = self.create_section_layout(self.h2_flash_port_label, self.h2_flash_port_combo_box, self.h2_flash_baud_rate_label, self.h2_flash_baud_rate_combo_box)
         order_id_layout = self.create_section_layout(self.order_id_label, self.order_id_combo_box, None, None)
+        s3_flash_progress_layout = self.create_section_layout(self.s3_flash_progress_label, self.s3_flash_progress_bar, None, None)
+        h2_flash_progress_layout = self.create_section_layout(self.h2_flash_progress_label, self.h2_flash_progress_bar, None, None)
         
         # Add layouts for each section
         main_layout.addLayout(flash_port_layout)
         main_layout.addLayout(factory_port_layout)
         main_layout.addLayout(h2_flash_port_layout)
         main_layout.addLayout(order_id_layout)
+        main_layout.addLayout(s3_flash_progress_layout)
+        main_layout.addLayout(h2_flash_progress_layout)
         
         # Create a horizontal layout for Semi Auto Test and Manual Test
         test_group_layout = QHBoxLayout()
@@ -110,11 +168,18 @@ class SerialPortSelector(QMainWindow):
         esptool_action.triggered.connect(self.check_esptool)
         file_menu.addAction(esptool_action)
         
-        # Use a lambda to delay the execution of process_device_data
         load_device_data_action = QAction("Load Device Data", self)
-        load_device_data_action.triggered.connect(lambda: self.utils.process_device_data('device_data.txt'))
+        load_device_data_action.triggered.connect(self.load_device_data)
         file_menu.addAction(load_device_data_action)
 
+        self.start_all_stations_action = QAction("Start All Stations", self)
+        self.start_all_stations_action.triggered.connect(self.start_all_stations)
+        file_menu.addAction(self.start_all_stations_action)
+
+        calibrate_baud_action = QAction("Calibrate Baud Rates", self)
+        calibrate_baud_action.triggered.connect(self.calibrate_baud_rates)
+        file_menu.addAction(calibrate_baud_action)
+
         # Help menu
         help_menu = menu_bar.addMenu("Help")
         
@@ -145,9 +210,17 @@ class SerialPortSelector(QMainWindow):
         """Creates and returns a baud rate combo box."""
         combo_box = QComboBox(self)
         combo_box.setSizePolicy(QSizePolicy.Policy.Preferred, QSizePolicy.Policy.Fixed)  # Make combo boxes fixed vertically
-        combo_box.addItems(["9600", "19200", "38400", "57600", "115200", "230400", "460800", "921600"])
+        combo_box.addItems(["9600", "19200", "38400", "57600", "115200", "230400", "460800", "921600", "1500000", "2000000"])
         return combo_box
 
+    def create_progress_bar(self):
+        """Creates and returns a flash progress bar."""
+        progress_bar = QProgressBar(self)
+        progress_bar.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Fixed)
+        progress_bar.setRange(0, 100)
+        progress_bar.setValue(0)
+        return progress_bar
+
     def create_section_layout(self, label1, widget1, label2, widget2):
         """Creates and returns a horizontal layout for various widgets."""
         layout = QHBoxLayout()
@@ -284,7 +357,7 @@ class SerialPortSelector(QMainWindow):
         factory_baud_rate = self.factory_baud_rate_combo_box.currentText()
         h2_flash_port = self.h2_flash_port_combo_box.currentText()
         h2_flash_baud_rate = self.h2_flash_baud_rate_combo_box.currentText()
-        order_id = self.order_id_combo_box.currentText()
+        order_id = self.selected_order()
         
         print(self.utils.tool_path)
         print(f"Port Flash ESP32S3: {self.utils.port_flashS3}")
@@ -320,115 +393,164 @@ class SerialPortSelector(QMainWindow):
         self.semi_auto_test()
 
         
+    def worker_pool(self):
+        """Returns the pool the unit's tasks and the GUI's background work run on."""
+        from concurrent.futures import ThreadPoolExecutor
+
+        if self.unit_pool is None:
+            # One worker per port: the S3, the H2 and the factory port
+            self.unit_pool = ThreadPoolExecutor(max_workers=3, thread_name_prefix='unit')
+        return self.unit_pool
+
     def semi_auto_test(self):
-        """Runs the semi-auto test."""
-        # Semi Auto Test
-        self.read_mac_address(self.utils.port_flashS3, self.utils.baud_flashS3)
-        self.read_mac_address(self.utils.port_flashH2, self.utils.baud_flashH2)
-        self.start_flash_s3()
-        self.start_flash_h2()
-        
-    def read_mac_address(self, port, baud):
-        """Reads the MAC address of the ESP32-S3."""
-        mac_address = self.utils.esptool_read_mac(port, baud)
-        if port == self.utils.port_flashS3:
-            self.esp32s3_mac_address_result.setText(mac_address)
-        if port == self.utils.port_flashH2:
-            self.esp32h2_mac_address_result.setText(mac_address)
-        else:
-            pass
-        
-    def start_flash_s3(self):
-        """Starts the semi-auto test in a separate thread."""
-        self.flash_thread = FlashFirmwareS3Thread(
-            self.utils.port_flashS3,
-            self.utils.baud_flashS3,
-            self.utils.address_bootloader_flashS3,
-            self.utils.address_partition_table_flashS3,
-            self.utils.address_ota_data_initial_flashS3,
-            self.utils.address_firmware_flashS3,
-            self.utils.address_dac_secure_cert_partition,
-            self.utils.address_dac_data_provider_partition
-        )
-        self.flash_thread.finished.connect(self.on_flash_finished)
-        self.flash_thread.start()
-
-    def on_flash_finished(self):
-        """Handles actions after the flash thread is finished."""
-        print("Flash process is complete.")
-        success_firmware = self.flash_thread.success_detected_firmware
-        success_certificate = self.flash_thread.success_detected_certificate
-        print(f"Success Firmware: {success_firmware}")
-        if success_firmware:
-            print("Flash firmware ESP32-S3 process was successful.")
-            self.esp32s3_firmware_flash_result.setText("Pass")
-        if success_certificate:
-            print("Flash certificate ESP32-S3 process was successful.")
-            self.esp32s3_certificate_flash_result.setText("Pass")
-        self.flash_thread.quit()  # Gracefully exit the thread
-        self.flash_thread.wait()  # Ensure the thread has finished execution
-        
-        if self.flash_thread.wait:
-            print("Flash thread is finished and rebooting device.")
-            self.reboot_device(self.utils.port_flashS3, self.utils.baud_flashS3)
-            self.factory_mode()
-            
-    def factory_data_received(self, data):
-        print(f"Received data: {data}")
-
-    def on_factory_status_changed(self, status):
-        print(f"Factory status changed: {status}")
-        if status:  # If status is True, stop the thread
-            self.esp32s3_factory_mode_result.setText("Pass")
-            self.stop_thread()
-        else:
-            self.esp32s3_factory_mode_result.setText("Fail")
+        """Runs the semi-auto test of the unit in the default fixture without blocking the GUI."""
+        from components.station.pipeline import UnitPipeline
+
+        if self.unit_run and not self.unit_run.wait(0):
+            self.display_message("Semi Auto Test", "A unit is already in progress.")
+            return
+        self.worker_pool()
+        self.s3_flash_progress_bar.setValue(0)
+        self.h2_flash_progress_bar.setValue(0)
+
+        # Semi Auto Test: read both MACs, flash the S3 and H2, reboot and run the factory
+        # sequence; the pipeline's task graph runs whatever can overlap at the same time
+        order_no = self.selected_order()
+        # The pipeline is kept between units, so the next record is staged while this one flashes
+        if self.unit_pipeline is None or self.unit_pipeline.order_no != order_no:
+            if self.unit_pipeline is not None:
+                self.unit_pipeline.close()
+            self.unit_pipeline = UnitPipeline(
+                default_station(self.utils),
+                self.utils,
+                order_no,
+                on_stage=self.unit_bridge.stage_finished.emit,
+                on_progress=lambda station, chip, progress: self.unit_bridge.flash_progress.emit(chip, progress),
+                on_factory_result=lambda station, result: self.unit_bridge.factory_step_finished.emit(
+                    result.name, result.success, result.value if result.success else result.error)
+            )
+        self.unit_run = self.unit_pipeline.start(self.unit_pool, on_finished=self.unit_bridge.unit_finished.emit)
+
+    def on_unit_stage_finished(self, station, stage, success):
+        """Shows the result of one step of the semi-auto test as soon as it is known."""
+        print(f"Stage {stage}: {'Pass' if success else 'Fail'}")
+        unit = self.unit_run
+        if stage == 'read_mac_s3':
+            self.esp32s3_mac_address_result.setText(unit.result.s3_mac if success else "Fail")
+        elif stage == 'read_mac_h2':
+            self.esp32h2_mac_address_result.setText(unit.result.h2_mac if success else "Fail")
+        elif stage == 'flash_s3':
+            # The job is missing if it could not be created; the stage's outcome is all there is then
+            job = unit.s3_job
+            certificate = job.success_detected_certificate if job is not None else success
+            firmware = job.success_detected_firmware if job is not None else success
+            self.esp32s3_certificate_flash_result.setText("Pass" if certificate else "Fail")
+            self.esp32s3_firmware_flash_result.setText("Pass" if firmware else "Fail")
+        elif stage == 'flash_h2':
+            self.esp32h2_firmware_flash_result.setText("Pass" if success else "Fail")
+
+    def on_unit_flash_progress(self, chip, progress):
+        """Shows a flash's progress on the S3 or H2 progress bar."""
+        progress_bar = self.s3_flash_progress_bar if chip == 's3' else self.h2_flash_progress_bar
+        eta_seconds = progress.eta_seconds if progress.eta_seconds is not None else -1.0
+        self.update_flash_progress(progress_bar, progress.percent, progress.offset, progress.kbit_per_second, eta_seconds)
 
-    def factory_mode(self):
-        self.serial_thread = SerialReaderThread(self.utils.port_factoryS3, self.utils.baud_factoryS3)
-        self.serial_thread.data_received.connect(self.factory_data_received)
-        self.serial_thread.factory_status_changed.connect(self.on_factory_status_changed)
-        self.serial_thread.start()
+    def on_unit_finished(self, result):
+        """Reports the outcome of the semi-auto test and the steps that bounded its cycle time."""
+        outcome = "Pass" if result.success else f"Fail ({result.detail})"
+        print(f"Unit {result.serial_id or '-'} finished in {result.seconds:.1f}s: {outcome}, "
+              f"critical path {' > '.join(result.critical_path)}")
+        self.statusBar().showMessage(f"Unit {result.serial_id or '-'}: {outcome}")
+        self.refresh_orders()
+
+    def on_factory_step_finished(self, name, success, value):
+        """Shows the result of one factory command in the Semi Auto Test group."""
+        print(f"Factory step {name}: {'Pass' if success else 'Fail'} {value}")
+        labels = {
+            'factory_mode': self.esp32s3_factory_mode_result,
+            'read_mac': self.esp32s3_read_mac_address_result,
+            'read_product_name': self.esp32s3_read_product_name_result,
+            'write_serial_number': self.esp32s3_write_serial_number_result,
+            'write_matter_qr': self.esp32s3_write_matter_qr_result,
+            'save_device_data': self.esp32s3_save_device_data_result,
+        }
+        if name in labels:
+            text = value if success and name == 'read_mac' else ("Pass" if success else "Fail")
+            labels[name].setText(text)
 
     def stop_thread(self):
-        if self.serial_thread:
-            print("Stopping the factory thread.")
-            self.serial_thread.stop()
-            self.serial_thread.quit()
-            self.serial_thread.wait()  # Wait for the thread to finish
-        else:
-            print("No factory thread to stop.")
-
-    def start_flash_h2(self):
-        """Starts the ESP32H2 firmware flashing process in a separate thread."""
-        self.flash_h2_thread = FlashFirmwareH2Thread(
-            self.utils.port_flashH2,
-            self.utils.baud_flashH2,
-            self.utils.command_flashH2,
-            self.utils.address_bootloader_flashH2,
-            self.utils.address_partition_table_flashH2,
-            self.utils.address_firmware_flashH2
-        )
-        self.flash_h2_thread.finished.connect(self.on_flash_h2_finished)
-        self.flash_h2_thread.start()
-        
-    def on_flash_h2_finished(self):
-        """Handles actions after the ESP32H2 firmware flashing thread is finished."""
-        print("ESP32H2 firmware flashing process is complete.")
-        success = self.flash_h2_thread.success_detected
-        if success:
-            print("ESP32H2 firmware flashing was successful.")
-            self.esp32h2_firmware_flash_result.setText("Pass")
+        if self.unit_run and not self.unit_run.wait(0):
+            print("Stopping the unit in progress.")
+            self.unit_run.cancel()
         else:
-            print("ESP32H2 firmware flashing failed.")
-            self.esp32h2_firmware_flash_result.setText("Fail")
-        self.flash_h2_thread.quit()
-        self.flash_h2_thread.wait()
-        
-    def reboot_device(self, port, baud):
-        """Reboots the device using esptool."""
-        self.utils.esptool_reboot(port, baud)
+            print("No unit to stop.")
+
+    def update_flash_progress(self, progress_bar, percent, offset, kbit_per_second, eta_seconds):
+        """Shows a write's progress, measured throughput and remaining time."""
+        progress_bar.setValue(percent)
+        eta = f", {eta_seconds:.0f}s left" if eta_seconds >= 0 else ''
+        progress_bar.setFormat(f"%p% at 0x{offset:x} ({kbit_per_second:.0f} kbit/s{eta})")
         
+    def load_device_data(self):
+        """Imports device_data.txt into the device database in a background thread."""
+        from components.devicedata.devicedata import DeviceDataImportThread
+
+        if self.import_thread and self.import_thread.isRunning():
+            self.display_message("Load Device Data", "An import is already in progress.")
+            return
+        self.import_thread = DeviceDataImportThread('device_data.txt')
+        self.import_thread.progress.connect(lambda rows: self.statusBar().showMessage(f"Importing device data: {rows} rows"))
+        self.import_thread.import_finished.connect(self.on_device_data_imported)
+        self.import_thread.import_failed.connect(lambda error: self.display_message("Load Device Data", error))
+        self.import_thread.start()
+
+    def on_device_data_imported(self, rows, skipped, rows_per_second):
+        """Reports the result of a device data import."""
+        message = f"{rows} devices imported ({rows_per_second:.0f} rows/s)."
+        if skipped:
+            message += f" {skipped} line(s) skipped, malformed or with a cert id another serial id holds."
+        self.statusBar().showMessage(message)
+        self.refresh_orders()
+        self.display_message("Load Device Data", message)
+
+    def start_all_stations(self):
+        """Runs a unit on every fixture defined in config.ini in parallel."""
+        if self.station_scheduler and self.station_scheduler.is_running():
+            self.display_message("Stations", "A multi-station run is already in progress.")
+            return
+        self.station_fixtures.apply(self.port_monitor.ports())
+        stations = self.station_fixtures.stations
+        print(f"Starting {len(stations)} station(s): {stations}")
+        if self.station_scheduler:
+            self.station_scheduler.close()
+        self.station_scheduler = self.create_station_scheduler()
+        self.station_scheduler.start()
+
+    def create_station_scheduler(self):
+        """Creates a scheduler for the configured stations that reports to the GUI."""
+        from components.station.station import StationScheduler
+
+        return StationScheduler(
+            self.station_fixtures.stations,
+            utils=self.utils,
+            order_no=self.selected_order(),
+            on_state_changed=self.station_bridge.state_changed.emit,
+            on_progress=self.station_bridge.progress_changed.emit
+        )
+
+    def on_station_state_changed(self, name, state):
+        """Shows the latest state change of a station in the status bar."""
+        self.statusBar().showMessage(f"Station {name}: {state}")
+
+    def on_station_progress_changed(self, finished, total):
+        """Reports overall multi-station progress and the results once every station is done."""
+        print(f"Stations finished: {finished}/{total}")
+        if finished == total:
+            self.station_scheduler.wait()
+            self.refresh_orders()
+            results = "\n".join(f"{name}: {state}" for name, state in self.station_scheduler.snapshot().items())
+            self.display_message("Stations", results)
+
     def display_message(self, title, message):
         """Displays a message box."""
         QMessageBox.information(
@@ -440,9 +562,38 @@ class SerialPortSelector(QMainWindow):
 
     def print_selected_order_id(self):
         """Prints the currently selected Order ID."""
-        selected_order_id = self.order_id_combo_box.currentText()
+        selected_order_id = self.selected_order()
         print(f"Selected Order ID: {selected_order_id}")
 
+    def selected_order(self):
+        """Returns the order number selected in the Order ID combo box."""
+        return self.order_id_combo_box.currentData() or self.order_id_combo_box.currentText()
+
+    def refresh_orders(self):
+        """Counts every order's units on the worker pool, then refreshes the Order ID combo box."""
+        self.worker_pool().submit(self.count_orders)
+
+    def count_orders(self):
+        """Reads the order file and the device database; runs on the worker pool."""
+        from components.devicedata.orders import get_order_index
+
+        try:
+            self.startup_bridge.orders_counted.emit(get_order_index('device_data.txt').counts())
+        except Exception as e:
+            print(f"Could not count the orders: {e}")
+
+    def fill_order_combo_box(self, summaries):
+        """Lists every order with its remaining units in the Order ID combo box, keeping the selection."""
+        selected = self.selected_order()
+        self.order_id_combo_box.blockSignals(True)
+        self.order_id_combo_box.clear()
+        for order in summaries:
+            self.order_id_combo_box.addItem(
+                f"{order['order_no']} ({order['remaining']} of {order['total']} left)", order['order_no'])
+        index = self.order_id_combo_box.findData(selected)
+        self.order_id_combo_box.setCurrentIndex(max(index, 0))
+        self.order_id_combo_box.blockSignals(False)
+
     def check_esptool(self):
         """Checks the functionality of esptool and shows a message box."""
         if not self.utils.check_functionality():
@@ -468,16 +619,144 @@ class SerialPortSelector(QMainWindow):
 
     def select_ports_automatically(self):
         """Automatically selects the ports based on detected devices."""
-        ports = self.serialcom.get_serial_ports_as_str()
+        # Ports with a USB selector are found by adapter identity, the others by name
+        station = default_station(self.utils)
+        devices = FixtureMap([station]).assign(self.port_monitor.ports())[station.name]
         
-        # Update the combo boxes based on detected ports
-        if '/dev/ttyUSB0' in ports:
-            self.flash_port_combo_box.setCurrentText('/dev/ttyUSB0')
-            self.flash_baud_rate_combo_box.setCurrentText('460800')
-        if '/dev/ttyUSB1' in ports:
-            self.factory_port_combo_box.setCurrentText('/dev/ttyUSB1')
-            self.factory_baud_rate_combo_box.setCurrentText('115200')
-        if '/dev/ttyUSB2' in ports:
-            self.h2_flash_port_combo_box.setCurrentText('/dev/ttyUSB2')
-            self.h2_flash_baud_rate_combo_box.setCurrentText('921600')
+        # Update the combo boxes based on detected ports, with the configured (or calibrated) baud rates
+        if devices['s3']:
+            self.flash_port_combo_box.setCurrentText(devices['s3'])
+            self.flash_baud_rate_combo_box.setCurrentText(self.utils.flash_baud(devices['s3'], self.utils.baud_flashS3))
+        if devices['factory']:
+            self.factory_port_combo_box.setCurrentText(devices['factory'])
+            self.factory_baud_rate_combo_box.setCurrentText(self.utils.baud_factoryS3)
+        if devices['h2']:
+            self.h2_flash_port_combo_box.setCurrentText(devices['h2'])
+            self.h2_flash_baud_rate_combo_box.setCurrentText(self.utils.flash_baud(devices['h2'], self.utils.baud_flashH2))
+
+    def refresh_port_combo_boxes(self):
+        """Lists the ports present now in every port combo box, keeping the selections that still exist."""
+        ports = sorted(self.port_monitor.ports())
+        for combo_box in (self.flash_port_combo_box, self.factory_port_combo_box, self.h2_flash_port_combo_box):
+            selected = combo_box.currentText()
+            combo_box.blockSignals(True)
+            combo_box.clear()
+            combo_box.addItems(ports)
+            if selected in ports:
+                combo_box.setCurrentText(selected)
+            combo_box.blockSignals(False)
+
+    def on_port_added(self, device, identity):
+        """Re-selects the ports when a jig is plugged in and auto-starts its station once all its boards are there."""
+        print(f"Port added: {device} ({identity})")
+        self.refresh_port_combo_boxes()
+        self.select_ports_automatically()
+        self.statusBar().showMessage(f"{device} connected")
+
+        ports = self.port_monitor.ports()
+        if device not in ports:
+            return
+        complete = self.station_fixtures.apply(ports)
+        name = self.station_fixtures.station_of(ports[device])
+        station = next((station for station in self.station_fixtures.stations if station.name == name), None)
+        if station is None or not station.auto_start or name not in complete:
+            return
+        if self.station_scheduler is None:
+            self.station_scheduler = self.create_station_scheduler()
+        if self.station_scheduler.start_station(name):
+            print(f"Station {name}: boards connected, starting")
+
+    def on_port_removed(self, device, identity):
+        """Drops an unplugged port from the port combo boxes."""
+        print(f"Port removed: {device} ({identity})")
+        self.refresh_port_combo_boxes()
+        self.statusBar().showMessage(f"{device} disconnected")
+
+    def finish_startup(self):
+        """Runs the startup work that does not need to delay the first paint of the window."""
+        from components.devicestore.devicestore import CertificateLedger
+
+        # Move certificates recorded in the legacy pickle into the ledger (no-op once imported)
+        try:
+            CertificateLedger().import_legacy_file('used_cert_ids.pkl')
+        except Exception as e:
+            print(f"Could not import used_cert_ids.pkl into the certificate ledger: {e}")
+
+        # Serve the stage timings to a Prometheus scraper if a port is configured
+        if self.utils.metrics_http_port:
+            try:
+                self.utils.get_metrics().serve(self.utils.metrics_http_port)
+            except OSError as e:
+                print(f"Could not serve metrics on port {self.utils.metrics_http_port}: {e}")
+
+        # Index firmware images and certificates once so each flash is a lookup, not a directory walk.
+        # The certificates tree holds thousands of files, so it is walked on a worker and
+        # flashing stays disabled until it is done.
+        self.start_button.setEnabled(False)
+        self.start_all_stations_action.setEnabled(False)
+        self.statusBar().showMessage("Indexing firmware images and certificates...")
+        self.worker_pool().submit(self.build_artifact_index)
+        self.refresh_orders()
+
+    def build_artifact_index(self):
+        """Builds the artifact index; runs on the worker pool."""
+        try:
+            get_artifact_index().build(self.utils.filepath_firmwareS3, self.utils.filepath_firmwareH2, self.utils.filepath_certificatesS3)
+        except Exception as e:
+            self.startup_bridge.index_built.emit(str(e) or type(e).__name__)
+            return
+        self.startup_bridge.index_built.emit('')
+
+    def on_artifact_index_built(self, error):
+        """Enables flashing once the artifact index is ready."""
+        self.start_button.setEnabled(True)
+        self.start_all_stations_action.setEnabled(True)
+        if error:
+            # Lookups index the directories on first use instead
+            print(f"Could not index firmware images and certificates: {error}")
+            self.statusBar().showMessage("Artifact index not built; images are indexed on first flash")
+        else:
+            self.statusBar().showMessage("Ready")
+
+    def closeEvent(self, event):
+        """Stops the port monitor and any unit in progress with the window."""
+        self.port_monitor.stop()
+        if self.unit_run:
+            self.unit_run.cancel()
+        if self.unit_pool:
+            self.unit_pool.shutdown(wait=False)
+        # Records staged for units that will not run go back to the pool
+        if self.unit_pipeline:
+            self.unit_pipeline.close()
+        if self.station_scheduler:
+            self.station_scheduler.close()
+        # Certificates extracted from archives are removed once the last write using them ends
+        get_artifact_index().close()
+        super().closeEvent(event)
+
+    def calibrate_baud_rates(self):
+        """Measures the fastest stable baud rate of the S3 and H2 flash ports and stores it."""
+        from components.baudrate.baudrate import BaudCalibrationThread
+
+        if self.calibration_thread and self.calibration_thread.isRunning():
+            self.display_message("Calibrate Baud Rates", "A calibration is already in progress.")
+            return
+        ports = [self.flash_port_combo_box.currentText(), self.h2_flash_port_combo_box.currentText()]
+        self.calibration_thread = BaudCalibrationThread(self.utils, [port for port in ports if port])
+        self.calibration_thread.rate_measured.connect(
+            lambda port, baud, kbps, errors: self.statusBar().showMessage(f"{port} @ {baud}: {kbps:.0f} kbit/s, {errors} error(s)")
+        )
+        self.calibration_thread.port_calibrated.connect(self.on_port_calibrated)
+        self.calibration_thread.start()
+
+    def on_port_calibrated(self, port, baud):
+        """Shows a port's calibrated baud rate in its baud rate combo box."""
+        if not baud:
+            self.display_message("Calibrate Baud Rates", f"No stable baud rate found on {port}.")
+            return
+        if port == self.flash_port_combo_box.currentText():
+            self.flash_baud_rate_combo_box.setCurrentText(str(baud))
+        if port == self.h2_flash_port_combo_box.currentText():
+            self.h2_flash_baud_rate_combo_box.setCurrentText(str(baud))
+        self.statusBar().showMessage(f"{port} calibrated to {baud} baud")
             
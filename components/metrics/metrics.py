@@ -0,0 +1,290 @@
+import json
+import os
+import threading
+import time
+
+from typing import Dict, List, Optional
+
+
+class Stage:
+    """Names of the production stages that are timed per unit."""
+    READ_MAC = 'read_mac'
+    ERASE_FLASH = 'erase_flash'
+    ERASE_FLASH_H2 = 'erase_flash_h2'
+    FLASH_CERTIFICATE = 'flash_certificate'
+    FLASH_FIRMWARE = 'flash_firmware'
+    FLASH_COMBINED = 'flash_combined'
+    FLASH_FIRMWARE_H2 = 'flash_firmware_h2'
+    REBOOT = 'reboot'
+    FACTORY_MODE = 'factory_mode'
+    # Whole semi-auto test of a unit, from the MAC read to the end of the factory sequence
+    CYCLE = 'cycle'
+
+    @staticmethod
+    def factory_command(name: str) -> str:
+        """Returns the stage name of one factory command, e.g. 'factory:write_serial_number'."""
+        return name if name == Stage.FACTORY_MODE else f'factory:{name}'
+
+
+# Upper bounds (seconds) of the duration histogram buckets
+BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+class StageStats:
+    """Running totals and a duration histogram of one stage."""
+
+    def __init__(self):
+        self.count = 0
+        self.failures = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.last_seconds = 0.0
+        self.buckets = [0] * len(BUCKETS)
+
+    def add(self, seconds: float, success: bool) -> None:
+        self.count += 1
+        self.failures += 0 if success else 1
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.last_seconds = seconds
+        for index, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[index] += 1
+
+    def to_dict(self) -> dict:
+        return {
+            'count': self.count,
+            'failures': self.failures,
+            'total_seconds': round(self.total_seconds, 3),
+            'mean_seconds': round(self.total_seconds / self.count, 3) if self.count else 0.0,
+            'max_seconds': round(self.max_seconds, 3),
+            'last_seconds': round(self.last_seconds, 3),
+        }
+
+
+class StageTimer:
+    """
+    Times one stage of one unit on the monotonic clock.
+
+    Use it as a context manager, or call stop() explicitly for stages that start and
+    end in different callbacks. The unit can still be changed before the timer stops,
+    e.g. to the MAC address a read_mac stage returned. A stage left by an exception
+    is recorded as failed.
+
+        with metrics.stage(serial_id, Stage.FLASH_FIRMWARE, port) as timer:
+            timer.success = job.flash_firmware()
+    """
+
+    def __init__(self, metrics: 'Metrics', unit: str, stage: str, port: str = ''):
+        self.metrics = metrics
+        self.unit = unit
+        self.stage = stage
+        self.port = port
+        self.success = False
+        self.detail = ''
+        self.started_at = time.time()
+        self.start = time.monotonic()
+        self.seconds = None
+
+    def stop(self, success: bool = None, unit: str = None, detail: str = None) -> float:
+        """
+        Stops the timer and records the stage; later calls do nothing.
+
+        Returns:
+            float: Duration of the stage in seconds.
+        """
+        if self.seconds is not None:
+            return self.seconds
+        self.seconds = time.monotonic() - self.start
+        if success is not None:
+            self.success = success
+        if unit is not None:
+            self.unit = unit
+        if detail is not None:
+            self.detail = detail
+        self.metrics.record(self.unit, self.stage, self.seconds, self.success, self.port, self.detail, self.started_at)
+        return self.seconds
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.stop(False, detail=f"{exc_type.__name__}: {exc}")
+        else:
+            self.stop()
+        return False
+
+
+class Metrics:
+    """
+    Stage timings of every unit, stored in the device database and summarised per stage.
+
+    Each recorded stage is written to the stage_timings table and added to in-memory
+    per-stage totals. After every record the totals are exported to a file, in the
+    Prometheus text format or, for a .json path, as JSON; serve() exposes the same
+    data over HTTP at /metrics and /metrics.json.
+
+    Args:
+        db_name (str): Device database the timings are stored in.
+        export_path (str, optional): File the totals are written to; empty disables it.
+    """
+
+    def __init__(self, db_name: str = 'device_data.db', export_path: str = ''):
+        from components.devicestore.devicestore import StageTimingStore
+
+        self.store = StageTimingStore(db_name)
+        self.export_path = export_path
+        self._lock = threading.Lock()
+        self._export_lock = threading.Lock()
+        self._stages: Dict[str, StageStats] = {}
+        self._ports: Dict[str, float] = {}
+        self._server = None
+
+    def stage(self, unit: str, stage: str, port: str = '') -> StageTimer:
+        """Starts timing a stage of a unit."""
+        return StageTimer(self, unit, stage, port)
+
+    def record(self, unit: str, stage: str, seconds: float, success: bool, port: str = '',
+               detail: str = '', started_at: float = None) -> None:
+        """
+        Records a stage whose duration was measured elsewhere, e.g. by the factory engine.
+
+        Args:
+            started_at (float, optional): Wall-clock start time; derived from the duration if omitted.
+        """
+        if started_at is None:
+            started_at = time.time() - seconds
+        print(f"Stage {stage} of {unit or port}: {seconds:.3f}s {'ok' if success else 'failed'}")
+        with self._lock:
+            self._stages.setdefault(stage, StageStats()).add(seconds, success)
+        try:
+            self.store.record(unit or port, stage, started_at, seconds, success, port, detail)
+        except Exception as e:
+            print(f"Could not store the timing of {stage}: {e}")
+        if self.export_path:
+            self.export(self.export_path)
+
+    def record_throughput(self, unit: str, port: str, address: int, bytes: int, seconds: float, kbit_per_second: float) -> None:
+        """
+        Records the effective throughput esptool reported for one written region.
+
+        The last throughput of every port is exported, so a slow cable or port shows
+        up as a low value rather than as a timeout.
+        """
+        with self._lock:
+            self._ports[port] = kbit_per_second
+        try:
+            self.store.record_throughput(unit or port, port, address, bytes, seconds, kbit_per_second)
+        except Exception as e:
+            print(f"Could not store the throughput of 0x{address:x} on {port}: {e}")
+        if self.export_path:
+            self.export(self.export_path)
+
+    def snapshot(self) -> Dict[str, dict]:
+        """Returns the totals of every stage recorded by this process."""
+        with self._lock:
+            return {stage: stats.to_dict() for stage, stats in self._stages.items()}
+
+    def to_json(self) -> str:
+        with self._lock:
+            ports = {port: {'last_kbit_per_second': round(speed, 1)} for port, speed in self._ports.items()}
+        return json.dumps({'generated_at': time.strftime('%Y-%m-%dT%H:%M:%S'), 'stages': self.snapshot(), 'ports': ports}, indent=2)
+
+    def to_prometheus(self) -> str:
+        """Returns the totals in the Prometheus text exposition format."""
+        with self._lock:
+            stages = {stage: (stats.count, stats.failures, stats.total_seconds, list(stats.buckets))
+                      for stage, stats in sorted(self._stages.items())}
+            ports = sorted(self._ports.items())
+        lines = [
+            '# HELP factory_stage_seconds Duration of production stages per unit.',
+            '# TYPE factory_stage_seconds histogram',
+        ]
+        for stage, (count, _, total, buckets) in stages.items():
+            for bound, bucket in zip(BUCKETS, buckets):
+                lines.append(f'factory_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {bucket}')
+            lines.append(f'factory_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {count}')
+            lines.append(f'factory_stage_seconds_sum{{stage="{stage}"}} {total:.6f}')
+            lines.append(f'factory_stage_seconds_count{{stage="{stage}"}} {count}')
+        lines.append('# HELP factory_stage_failures_total Failed runs of production stages.')
+        lines.append('# TYPE factory_stage_failures_total counter')
+        for stage, (_, failures, _, _) in stages.items():
+            lines.append(f'factory_stage_failures_total{{stage="{stage}"}} {failures}')
+        lines.append('# HELP factory_flash_kbit_per_second Effective throughput of the last region flashed on a port.')
+        lines.append('# TYPE factory_flash_kbit_per_second gauge')
+        for port, speed in ports:
+            lines.append(f'factory_flash_kbit_per_second{{port="{port}"}} {speed:.1f}')
+        return '\n'.join(lines) + '\n'
+
+    def export(self, path: str) -> None:
+        """Writes the totals to a file, as JSON if it ends in .json and as Prometheus text otherwise."""
+        text = self.to_json() if path.endswith('.json') else self.to_prometheus()
+        with self._export_lock:
+            temp_path = path + '.tmp'
+            try:
+                with open(temp_path, 'w') as file:
+                    file.write(text)
+                os.replace(temp_path, path)
+            except OSError as e:
+                print(f"Could not export metrics to {path}: {e}")
+
+    def unit_timings(self, unit: str) -> List[Dict]:
+        """Returns the stored stage runs of a unit."""
+        return self.store.unit_timings(unit)
+
+    def serve(self, port: int, host: str = '0.0.0.0') -> None:
+        """Serves the totals over HTTP on a background thread."""
+        if self._server is not None:
+            return
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/metrics':
+                    body, content_type = metrics.to_prometheus(), 'text/plain; version=0.0.4'
+                elif self.path == '/metrics.json':
+                    body, content_type = metrics.to_json(), 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                data = body.encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self._server.serve_forever, name='metrics-http', daemon=True).start()
+        print(f"Serving metrics on http://{host}:{self._server.server_address[1]}/metrics")
+
+    def shutdown(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+_metrics: Dict[str, Metrics] = {}
+_metrics_lock = threading.Lock()
+
+
+def get_metrics(db_name: str = 'device_data.db', export_path: Optional[str] = None) -> Metrics:
+    """
+    Returns the process-wide metrics of a device database.
+
+    Args:
+        export_path (str, optional): Sets the export file; None keeps the current one.
+    """
+    with _metrics_lock:
+        if db_name not in _metrics:
+            _metrics[db_name] = Metrics(db_name)
+        if export_path is not None:
+            _metrics[db_name].export_path = export_path
+        return _metrics[db_name]
@@ -0,0 +1,227 @@
+import threading
+
+from typing import Callable, Dict, List, Optional
+
+try:
+    import pyudev
+except ImportError:
+    pyudev = None
+
+
+class PortInfo:
+    """A serial port and the USB adapter behind it."""
+
+    def __init__(self, device: str, vid: int = None, pid: int = None, serial_number: str = '', location: str = ''):
+        self.device = device
+        self.vid = vid
+        self.pid = pid
+        self.serial_number = serial_number or ''
+        self.location = location or ''
+
+    @classmethod
+    def from_comport(cls, info) -> 'PortInfo':
+        return cls(info.device, info.vid, info.pid, info.serial_number, info.location)
+
+    @property
+    def identity(self) -> str:
+        """"vid:pid:serial@location" for USB adapters, the device name otherwise."""
+        if self.vid is None:
+            return self.device
+        return f"{self.vid:04x}:{self.pid:04x}:{self.serial_number}@{self.location}"
+
+    def __eq__(self, other):
+        return isinstance(other, PortInfo) and (self.device, self.identity) == (other.device, other.identity)
+
+    def __hash__(self):
+        return hash((self.device, self.identity))
+
+    def __repr__(self):
+        return f"PortInfo({self.device!r}, {self.identity!r})"
+
+
+class UsbSelector:
+    """
+    Matches the USB adapter of a fixture port.
+
+    The selector text has the form "vid:pid[:serial][@location]", e.g.
+    "10c4:ea60:0001@1-1.2" or "1a86:55d4@1-1.3". Leaving out a part, or writing "*",
+    matches any value, so a jig can be pinned by its adapter's serial number, by the
+    USB socket it is plugged into, or both.
+    """
+
+    def __init__(self, text: str):
+        self.text = text.strip()
+        ids, _, location = self.text.partition('@')
+        parts = ids.split(':')
+        if len(parts) < 2:
+            raise ValueError(f"USB selector '{text}' must start with vid:pid")
+        self.vid = None if parts[0] in ('', '*') else int(parts[0], 16)
+        self.pid = None if parts[1] in ('', '*') else int(parts[1], 16)
+        self.serial_number = None if len(parts) < 3 or parts[2] in ('', '*') else ':'.join(parts[2:])
+        self.location = None if location in ('', '*') else location
+
+    def matches(self, port: PortInfo) -> bool:
+        if port.vid is None:
+            return False
+        return ((self.vid is None or self.vid == port.vid) and
+                (self.pid is None or self.pid == port.pid) and
+                (self.serial_number is None or self.serial_number == port.serial_number) and
+                (self.location is None or self.location == port.location))
+
+    def __repr__(self):
+        return f"UsbSelector({self.text!r})"
+
+
+def list_ports() -> Dict[str, PortInfo]:
+    """Returns the serial ports present right now, keyed by device name."""
+    import serial.tools.list_ports
+
+    return {info.device: PortInfo.from_comport(info) for info in serial.tools.list_ports.comports()}
+
+
+class PortMonitor:
+    """
+    Watches serial ports come and go.
+
+    The port list is diffed against the previous one every `interval` seconds. When
+    pyudev is installed, tty events from udev trigger a diff right away, so a replug
+    is noticed in milliseconds rather than at the next poll. Callbacks run on the
+    monitor's thread:
+
+        on_added(port_info)
+        on_removed(port_info)
+    """
+
+    def __init__(self, interval: float = 1.0, on_added: Callable[[PortInfo], None] = None,
+                 on_removed: Callable[[PortInfo], None] = None, lister: Callable[[], Dict[str, PortInfo]] = list_ports):
+        self.interval = interval
+        self.on_added = on_added
+        self.on_removed = on_removed
+        self.lister = lister
+        self._ports: Dict[str, PortInfo] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._observer = None
+
+    def ports(self) -> Dict[str, PortInfo]:
+        """Returns the ports seen at the last scan."""
+        with self._lock:
+            return dict(self._ports)
+
+    def scan(self) -> None:
+        """Diffs the current ports against the last scan and reports the changes."""
+        current = self.lister()
+        with self._lock:
+            previous, self._ports = self._ports, current
+        # A port whose device name now belongs to another adapter counts as removed and added
+        for device, port in previous.items():
+            if current.get(device) != port and self.on_removed:
+                self.on_removed(port)
+        for device, port in current.items():
+            if previous.get(device) != port and self.on_added:
+                self.on_added(port)
+
+    def start(self) -> None:
+        """Scans once, then keeps watching on a background thread."""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self.scan()
+        if pyudev is not None:
+            try:
+                context = pyudev.Context()
+                udev_monitor = pyudev.Monitor.from_netlink(context)
+                udev_monitor.filter_by('tty')
+                self._observer = pyudev.MonitorObserver(udev_monitor, callback=lambda device: self._wake.set())
+                self._observer.start()
+            except Exception as e:
+                print(f"udev port events unavailable, polling only: {e}")
+                self._observer = None
+        self._thread = threading.Thread(target=self._run, name='port-monitor', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer = None
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            try:
+                self.scan()
+            except Exception as e:
+                print(f"Port scan failed: {e}")
+
+
+class FixtureMap:
+    """
+    Finds each station's ports by the USB identity of their adapters.
+
+    Stations whose roles have a USB selector get the device name of the matching
+    port, whatever ttyUSB number it enumerated as; roles without a selector keep
+    their configured device name.
+    """
+
+    ROLES = ('s3', 'h2', 'factory')
+
+    def __init__(self, stations: List):
+        self.stations = list(stations)
+
+    def _selectors(self, station) -> Dict[str, Optional[UsbSelector]]:
+        return {role: getattr(station, f'{role}_usb', None) for role in self.ROLES}
+
+    def assign(self, ports: Dict[str, PortInfo]) -> Dict[str, Dict[str, Optional[str]]]:
+        """
+        Resolves every station's ports against the ports present.
+
+        Returns:
+            Dict[str, Dict[str, Optional[str]]]: Per station name, the device of each
+            role, or None if the role's port is not present.
+        """
+        assignment = {}
+        for station in self.stations:
+            roles = {}
+            for role, selector in self._selectors(station).items():
+                if selector is None:
+                    device = getattr(station, f'{role}_port')
+                    roles[role] = device if device in ports else None
+                else:
+                    roles[role] = next((port.device for port in ports.values() if selector.matches(port)), None)
+            assignment[station.name] = roles
+        return assignment
+
+    def apply(self, ports: Dict[str, PortInfo]) -> List[str]:
+        """
+        Points each station's port attributes at the devices found for them.
+
+        Returns:
+            List[str]: Names of the stations whose every port is present.
+        """
+        complete = []
+        for station in self.stations:
+            roles = self.assign(ports)[station.name]
+            for role, device in roles.items():
+                if device is not None:
+                    setattr(station, f'{role}_port', device)
+            if all(device is not None for device in roles.values()):
+                complete.append(station.name)
+        return complete
+
+    def station_of(self, port: PortInfo) -> Optional[str]:
+        """Returns the name of the station a port belongs to, if any."""
+        for station in self.stations:
+            for role, selector in self._selectors(station).items():
+                if (selector.matches(port) if selector else getattr(station, f'{role}_port') == port.device):
+                    return station.name
+        return None
@@ -0,0 +1,31 @@
+from PyQt6.QtCore import QObject, pyqtSignal
+from components.portmonitor.monitor import PortMonitor
+
+class PortMonitorBridge(QObject):
+    port_added = pyqtSignal(str, str)  # Device, USB identity
+    port_removed = pyqtSignal(str, str)  # Device, USB identity
+
+    def __init__(self, interval=1.0, parent=None):
+        """
+        Re-emits PortMonitor events, which arrive on the monitor's thread, as Qt signals.
+
+        Args:
+            interval (float): Seconds between port scans.
+            parent (QObject, optional): Owner of the bridge.
+        """
+        super().__init__(parent)
+        self.monitor = PortMonitor(
+            interval,
+            on_added=lambda port: self.port_added.emit(port.device, port.identity),
+            on_removed=lambda port: self.port_removed.emit(port.device, port.identity)
+        )
+
+    def start(self):
+        self.monitor.start()
+
+    def stop(self):
+        self.monitor.stop()
+
+    def ports(self):
+        """Returns the ports seen at the last scan, keyed by device name."""
+        return self.monitor.ports()
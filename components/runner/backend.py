@@ -0,0 +1,587 @@
+import asyncio
+import io
+import os
+import re
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+from typing import Callable, Dict, List, Optional, Tuple
+
+from components.config.config import ESPTOOL_BACKENDS
+from components.flash.imagecache import CachedImage, get_image_cache
+from components.runner.process import (
+    CancelToken, ExitStatus, ProcessResult, classify_esptool_result, run_esptool_async
+)
+
+
+RESET_MARKER = "Hard resetting via RTS pin..."
+
+# A flash region: address as written in config.ini (e.g. '0x10000') and the image path.
+# The library backend also accepts the image's bytes in place of the path.
+Region = Tuple[str, str]
+
+VERIFY_PATTERN = re.compile(r'Verifying .* bytes @ 0x([0-9a-fA-F]+) in flash')
+# esptool's summary of a read_flash, e.g. "Read 65536 bytes at 0x0 in 0.9 seconds (589.4 kbit/s)..."
+READ_PATTERN = re.compile(r'Read (\d+) bytes at 0x[0-9a-fA-F]+ in ([\d.]+) seconds')
+
+
+class SubprocessBackend:
+    """
+    Runs every esptool operation as its own esptool.py process.
+
+    Each call connects, syncs the ROM loader, uploads the stub and resets the chip
+    when it is done, so a write_flash only succeeds if esptool reported the reset.
+    """
+
+    in_process = False
+
+    def __init__(self, tool_path: str):
+        self.tool_path = tool_path
+
+    async def read_mac_async(self, port: str, baud, timeout: float = None,
+                             cancel_token: CancelToken = None) -> ProcessResult:
+        """Runs esptool read_mac; the MAC is on the "MAC: " line of stdout."""
+        return await run_esptool_async(self.tool_path, port, baud, ['read_mac'],
+                                       timeout=timeout, cancel_token=cancel_token)
+
+    async def write_flash_async(self, port: str, baud, regions: List[Region], timeout: float = None,
+                                on_line: Callable[[str], None] = None, cancel_token: CancelToken = None,
+                                reset: bool = True, command: str = 'write_flash') -> ProcessResult:
+        """
+        Writes images to flash with one esptool run.
+
+        Args:
+            regions (List[Region]): (address, path) pairs to write.
+            reset (bool): Ignored; every run ends with a hard reset.
+            command (str): esptool command, as configured in config.ini.
+        """
+        args = [command]
+        for address, path in regions:
+            args += [address, path]
+        result = await run_esptool_async(self.tool_path, port, baud, args, timeout, on_line, cancel_token)
+        if result.ok and RESET_MARKER not in result.stdout:
+            result.status = ExitStatus.FAILED
+            result.reason = 'no_reset'
+        return result
+
+    async def verify_flash_async(self, port: str, baud, regions: List[Region], timeout: float = None,
+                                 cancel_token: CancelToken = None) -> Tuple[ProcessResult, Dict[int, bool]]:
+        """
+        Compares images with the chip's flash using one esptool verify_flash run.
+
+        Returns:
+            Tuple[ProcessResult, Dict[int, bool]]: The run and, per region offset,
+            whether the flash matched. Regions esptool did not get to are missing.
+        """
+        args = ['--after', 'no_reset', 'verify_flash']
+        for address, path in regions:
+            args += [address, path]
+        result = await run_esptool_async(self.tool_path, port, baud, args, timeout, None, cancel_token)
+        return result, parse_verify_output(result.stdout)
+
+    def verify_flash(self, port: str, baud, regions: List[Region], timeout: float = None,
+                     cancel_token: CancelToken = None) -> Tuple[ProcessResult, Dict[int, bool]]:
+        return asyncio.run(self.verify_flash_async(port, baud, regions, timeout, cancel_token))
+
+    async def erase_region_async(self, port: str, baud, ranges: List[Tuple[int, int]], timeout: float = None,
+                                 on_line: Callable[[str], None] = None,
+                                 cancel_token: CancelToken = None) -> ProcessResult:
+        """
+        Erases ranges of flash without resetting the chip, one esptool erase_region run per range.
+
+        Args:
+            ranges (List[Tuple[int, int]]): Sector-aligned (offset, size) pairs.
+            timeout (float, optional): Limit of each run.
+
+        Returns:
+            ProcessResult: The first failed run, or the last one.
+        """
+        result = None
+        for offset, size in ranges:
+            result = await run_esptool_async(self.tool_path, port, baud,
+                                             ['--after', 'no_reset', 'erase_region', hex(offset), hex(size)],
+                                             timeout, on_line, cancel_token)
+            if not result.ok:
+                break
+        return result
+
+    def erase_region(self, port: str, baud, ranges: List[Tuple[int, int]], timeout: float = None,
+                     on_line: Callable[[str], None] = None, cancel_token: CancelToken = None) -> ProcessResult:
+        return asyncio.run(self.erase_region_async(port, baud, ranges, timeout, on_line, cancel_token))
+
+    async def read_flash_async(self, port: str, baud, offset: int, size: int, timeout: float = None,
+                               cancel_token: CancelToken = None) -> ProcessResult:
+        """Reads flash into a temporary file and discards it; stdout carries esptool's "Read ..." summary."""
+        handle, path = tempfile.mkstemp(suffix='.bin')
+        os.close(handle)
+        try:
+            return await run_esptool_async(self.tool_path, port, baud,
+                                           ['--after', 'no_reset', 'read_flash', hex(offset), hex(size), path],
+                                           timeout=timeout, cancel_token=cancel_token)
+        finally:
+            os.remove(path)
+
+    def read_flash(self, port: str, baud, offset: int, size: int, timeout: float = None,
+                   cancel_token: CancelToken = None) -> ProcessResult:
+        return asyncio.run(self.read_flash_async(port, baud, offset, size, timeout, cancel_token))
+
+    async def reset_async(self, port: str, baud, timeout: float = None,
+                          cancel_token: CancelToken = None) -> ProcessResult:
+        """Resets the chip into its application with esptool run."""
+        return await run_esptool_async(self.tool_path, port, baud, ['run'],
+                                       timeout=timeout, cancel_token=cancel_token)
+
+    def read_mac(self, port: str, baud, timeout: float = None, cancel_token: CancelToken = None) -> ProcessResult:
+        return asyncio.run(self.read_mac_async(port, baud, timeout, cancel_token))
+
+    def write_flash(self, port: str, baud, regions: List[Region], timeout: float = None,
+                    on_line: Callable[[str], None] = None, cancel_token: CancelToken = None,
+                    reset: bool = True, command: str = 'write_flash') -> ProcessResult:
+        return asyncio.run(self.write_flash_async(port, baud, regions, timeout, on_line, cancel_token, reset, command))
+
+    def reset(self, port: str, baud, timeout: float = None, cancel_token: CancelToken = None) -> ProcessResult:
+        return asyncio.run(self.reset_async(port, baud, timeout, cancel_token))
+
+    def close(self, port: str = None) -> None:
+        """Nothing is kept open between runs."""
+
+
+def parse_verify_output(output: str) -> Dict[int, bool]:
+    """Returns, per region offset, whether esptool verify_flash reported a match."""
+    verified = {}
+    offset = None
+    for line in output.splitlines():
+        match = VERIFY_PATTERN.search(line)
+        if match:
+            offset = int(match.group(1), 16)
+        elif offset is not None and line.startswith('-- verify'):
+            verified[offset] = line.startswith('-- verify OK')
+            offset = None
+    return verified
+
+
+class _ThreadStdout(io.TextIOBase):
+    """
+    sys.stdout replacement that sends what a thread prints to that thread's sink.
+
+    esptool reports progress with print(); several stations run it at the same time
+    in different threads, so a plain redirect_stdout would mix their output.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.sinks: Dict[int, Callable[[str], None]] = {}
+
+    def write(self, text):
+        # The sink is detached while it runs, so whatever its callbacks print goes to the real stream
+        sink = self.sinks.pop(threading.get_ident(), None)
+        if sink is None:
+            return self.stream.write(text)
+        try:
+            sink(text)
+        finally:
+            self.sinks[threading.get_ident()] = sink
+        return len(text)
+
+    def flush(self):
+        self.stream.flush()
+
+
+_stdout_lock = threading.Lock()
+
+
+def _thread_stdout() -> _ThreadStdout:
+    with _stdout_lock:
+        if not isinstance(sys.stdout, _ThreadStdout):
+            sys.stdout = _ThreadStdout(sys.stdout)
+        return sys.stdout
+
+
+class _OutputCapture:
+    """Collects what esptool prints in the current thread and forwards whole lines."""
+
+    def __init__(self, on_line: Callable[[str], None] = None):
+        self.on_line = on_line
+        self.lines: List[str] = []
+        self._partial = ''
+
+    def write(self, text: str) -> None:
+        # esptool rewrites its progress line with '\r'; treat that as a line end as well
+        self._partial += text.replace('\r', '\n')
+        *complete, self._partial = self._partial.split('\n')
+        for line in complete:
+            if line:
+                self._emit(line + '\n')
+
+    def _emit(self, line: str) -> None:
+        self.lines.append(line)
+        if self.on_line:
+            self.on_line(line)
+
+    def __enter__(self):
+        _thread_stdout().sinks[threading.get_ident()] = self.write
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _thread_stdout().sinks.pop(threading.get_ident(), None)
+        if self._partial:
+            self._emit(self._partial + '\n')
+            self._partial = ''
+
+    @property
+    def text(self) -> str:
+        return ''.join(self.lines)
+
+
+class EsptoolSession:
+    """
+    A connected esptool stub on one port.
+
+    The ROM loader is synced and the stub uploaded once; read_mac and write_flash
+    calls after that reuse the connection until the chip is reset.
+    """
+
+    def __init__(self, esptool_module, port: str, baud):
+        self.esptool = esptool_module
+        self.port = port
+        self.baud = int(baud)
+        self.lock = threading.Lock()
+        self.esp = None
+        self.flash_size = None
+
+    @property
+    def connected(self) -> bool:
+        return self.esp is not None
+
+    def connect(self) -> None:
+        """Syncs the ROM loader, runs the stub and switches to the session's baud rate."""
+        cmds = self.esptool.cmds
+        initial_baud = min(self.esptool.loader.ESPLoader.ESP_ROM_BAUD, self.baud)
+        esp = cmds.detect_chip(self.port, initial_baud)
+        print(f"Chip is {esp.get_chip_description()}")
+        try:
+            esp = esp.run_stub()
+            if self.baud > initial_baud:
+                esp.change_baud(self.baud)
+            flash_size = cmds.detect_flash_size(esp)
+            if flash_size is not None:
+                self.flash_size = self.esptool.util.flash_size_bytes(flash_size)
+                esp.flash_set_parameters(self.flash_size)
+        except Exception:
+            esp._port.close()
+            raise
+        self.esp = esp
+
+    def read_mac(self) -> str:
+        """Returns the chip's MAC address; for chips with an EUI-64 (ESP32-H2) that one, as esptool prints it."""
+        mac = self.esp.read_mac('EUI64') or self.esp.read_mac('BASE_MAC')
+        return ':'.join(f'{byte:02x}' for byte in mac)
+
+    def read_flash(self, offset: int, size: int) -> str:
+        """Reads flash and returns esptool's summary line for it; the stub checks the data's digest."""
+        start = time.time()
+        self.esp.read_flash(offset, size)
+        seconds = time.time() - start
+        return f"Read {size} bytes at 0x{offset:x} in {seconds:.3f} seconds ({size / seconds * 8 / 1000:.1f} kbit/s)...\n"
+
+    def flash_md5(self, ranges: List[Tuple[int, int]]) -> List[str]:
+        """Returns the MD5 hex digest of each (offset, size) range of flash."""
+        return [self.esp.flash_md5sum(offset, size) for offset, size in ranges]
+
+    def erase_region(self, ranges: List[Tuple[int, int]]) -> None:
+        """Erases sector-aligned (offset, size) ranges of flash with the stub, printing a summary per range."""
+        for offset, size in ranges:
+            start = time.time()
+            self.esp.erase_region(offset, size)
+            print(f"Erased {size} bytes at 0x{offset:08x} in {time.time() - start:.1f} seconds")
+
+    def write_flash(self, regions: List[Region]) -> None:
+        """
+        Writes images to flash without resetting the chip afterwards.
+
+        Image files come from the process-wide image cache, so their compressed
+        payload and checksums are computed once and reused for every board. Like
+        esptool's write_flash, each region is checked against the chip and the flash
+        size before it is written, and its flash MD5 is verified afterwards.
+        """
+        images = []
+        for address, image in regions:
+            if isinstance(image, (bytes, bytearray, memoryview)):
+                images.append((int(address, 0), CachedImage.from_bytes(image, f'<{len(image)} bytes for {address}>')))
+            else:
+                images.append((int(address, 0), get_image_cache().get(image)))
+
+        for offset, image in images:
+            self._check_image(offset, image)
+        for offset, image in sorted(images, key=lambda item: item[0]):
+            self._write_image(offset, image)
+
+        if self.esp.IS_STUB:
+            # Leave the stub in flash mode without running the application, as esptool does
+            self.esp.flash_begin(0, 0)
+            self.esp.flash_defl_finish(False)
+
+    def _check_image(self, offset: int, image: CachedImage) -> None:
+        FatalError = self.esptool.util.FatalError
+        if self.flash_size and offset + image.size > self.flash_size:
+            raise FatalError(f"{image.path} (0x{image.size:x} bytes) at 0x{offset:x} does not fit "
+                             f"in 0x{self.flash_size:x} bytes of flash")
+        # Application and bootloader images carry the chip they were built for
+        header = image.read(0, 24)
+        if len(header) == 24 and header[0] == 0xE9:
+            chip_id = struct.unpack('<H', header[12:14])[0]
+            if chip_id != self.esp.IMAGE_CHIP_ID:
+                raise FatalError(f"{image.path} is not an {self.esp.CHIP_NAME} image.")
+
+    def _write_image(self, offset: int, image: CachedImage) -> None:
+        loader = self.esptool.loader
+        esp = self.esp
+        payload = image.compressed
+        blocks = image.blocks(esp.FLASH_WRITE_SIZE)
+        esp.flash_defl_begin(image.size, len(payload), offset)
+
+        start = time.time()
+        timeout = loader.DEFAULT_TIMEOUT
+        written = 0
+        for seq, (block_start, uncompressed) in enumerate(blocks):
+            print(f"Writing at 0x{offset + written:08x}... ({100 * (seq + 1) // len(blocks)} %)")
+            written += uncompressed
+            block_timeout = max(loader.DEFAULT_TIMEOUT, loader.timeout_per_mb(loader.ERASE_WRITE_TIMEOUT_PER_MB, uncompressed))
+            if not esp.IS_STUB:
+                timeout = block_timeout  # ROM code writes block to flash before ACKing
+            esp.flash_defl_block(payload[block_start:block_start + esp.FLASH_WRITE_SIZE], seq, timeout=timeout)
+            if esp.IS_STUB:
+                timeout = block_timeout
+        if esp.IS_STUB:
+            # The stub acks blocks before writing them; this read returns once the last one is written
+            esp.read_reg(loader.ESPLoader.CHIP_DETECT_MAGIC_REG_ADDR, timeout=timeout)
+
+        seconds = time.time() - start
+        speed = f" (effective {image.size / seconds * 8 / 1000:.1f} kbit/s)" if seconds > 0 else ''
+        print(f"Wrote {image.size} bytes ({len(payload)} compressed) at 0x{offset:08x} in {seconds:.1f} seconds{speed}...")
+
+        if esp.flash_md5sum(offset, image.size) != image.md5:
+            raise self.esptool.util.FatalError("MD5 of file does not match data in flash!")
+        print("Hash of data verified.")
+
+    def hard_reset(self) -> None:
+        """Resets the chip into its application and closes the port."""
+        try:
+            self.esp.hard_reset()
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        if self.esp is not None:
+            try:
+                self.esp._port.close()
+            except Exception:
+                pass
+            self.esp = None
+
+
+class LibraryBackend:
+    """
+    Runs esptool in-process and keeps one connected stub session per port.
+
+    A unit's read_mac, certificate write and firmware write all reuse the session
+    opened by the first of them; reset() hard-resets the chip and closes the session
+    so the port is free for the factory test. Operations on the same port are
+    serialized, different ports run in parallel.
+
+    Cancelling or timing out closes the port under esptool, which makes the running
+    operation fail and drops the session.
+    """
+
+    in_process = True
+
+    def __init__(self):
+        import esptool
+        import esptool.cmds
+        import esptool.loader
+        import esptool.util
+        self.esptool = esptool
+        self._lock = threading.Lock()
+        self._sessions: Dict[str, EsptoolSession] = {}
+
+    def session(self, port: str, baud) -> EsptoolSession:
+        """Returns the session of a port, creating it if needed (not yet connected)."""
+        with self._lock:
+            session = self._sessions.get(port)
+            if session is None or session.baud != int(baud):
+                if session is not None:
+                    session.close()
+                session = EsptoolSession(self.esptool, port, baud)
+                self._sessions[port] = session
+            return session
+
+    def _run(self, command: List[str], port: str, baud, operation: Callable[[EsptoolSession], Optional[str]],
+             timeout: float = None, on_line: Callable[[str], None] = None,
+             cancel_token: CancelToken = None, connect: bool = True) -> ProcessResult:
+        start = time.monotonic()
+        session = self.session(port, baud)
+        stopped = {'status': None}
+
+        def stop(status):
+            stopped['status'] = status
+            session.close()
+
+        timer = threading.Timer(timeout, stop, (ExitStatus.TIMEOUT,)) if timeout else None
+        cancel = lambda: stop(ExitStatus.CANCELLED)
+
+        with session.lock, _OutputCapture(on_line) as output:
+            if cancel_token:
+                cancel_token._register(cancel)
+            if timer:
+                timer.start()
+            try:
+                if connect and not session.connected:
+                    session.connect()
+                value = operation(session)
+                if value:
+                    output.write(value)
+                status, stderr = ExitStatus.OK, ''
+            except Exception as e:
+                session.close()
+                status, stderr = stopped['status'] or ExitStatus.FAILED, f"A fatal error occurred: {e}"
+            finally:
+                if timer:
+                    timer.cancel()
+                if cancel_token:
+                    cancel_token._unregister(cancel)
+
+        result = ProcessResult(command, status, 0 if status == ExitStatus.OK else 2,
+                               output.text, stderr, time.monotonic() - start)
+        return classify_esptool_result(result)
+
+    def read_mac(self, port: str, baud, timeout: float = None, cancel_token: CancelToken = None) -> ProcessResult:
+        """Reads the MAC over the port's session; stdout carries a "MAC: " line like esptool's."""
+        return self._run(['read_mac'], port, baud, lambda session: f"MAC: {session.read_mac()}\n",
+                         timeout, None, cancel_token)
+
+    def write_flash(self, port: str, baud, regions: List[Region], timeout: float = None,
+                    on_line: Callable[[str], None] = None, cancel_token: CancelToken = None,
+                    reset: bool = True, command: str = 'write_flash') -> ProcessResult:
+        """
+        Writes images over the port's session.
+
+        Args:
+            reset (bool): Hard-reset the chip and close the session afterwards. Pass
+                False when more writes for the same unit follow.
+        """
+        def write(session):
+            session.write_flash(regions)
+            if reset:
+                session.hard_reset()
+
+        args = [command] + [item for region in regions for item in region]
+        return self._run(args, port, baud, write, timeout, on_line, cancel_token)
+
+    def erase_region(self, port: str, baud, ranges: List[Tuple[int, int]], timeout: float = None,
+                     on_line: Callable[[str], None] = None, cancel_token: CancelToken = None) -> ProcessResult:
+        """Erases (offset, size) ranges of flash over the port's session, which stays open for the writes."""
+        args = ['erase_region'] + [value for offset, size in ranges for value in (hex(offset), hex(size))]
+        return self._run(args, port, baud, lambda session: session.erase_region(ranges), timeout, on_line, cancel_token)
+
+    def flash_md5(self, port: str, baud, ranges: List[Tuple[int, int]], timeout: float = None,
+                  cancel_token: CancelToken = None) -> Tuple[ProcessResult, List[str]]:
+        """
+        Hashes ranges of the chip's flash over the port's session.
+
+        Args:
+            ranges (List[Tuple[int, int]]): (offset, size) pairs.
+
+        Returns:
+            Tuple[ProcessResult, List[str]]: The run and one MD5 hex digest per range,
+            empty if the run failed.
+        """
+        digests = []
+        result = self._run(['flash_md5'], port, baud, lambda session: digests.extend(session.flash_md5(ranges)),
+                           timeout, None, cancel_token)
+        return result, digests if result.ok else []
+
+    def read_flash(self, port: str, baud, offset: int, size: int, timeout: float = None,
+                   cancel_token: CancelToken = None) -> ProcessResult:
+        """Reads flash over the port's session; stdout carries a "Read ..." summary like esptool's."""
+        return self._run(['read_flash', hex(offset), hex(size)], port, baud,
+                         lambda session: session.read_flash(offset, size), timeout, None, cancel_token)
+
+    def reset(self, port: str, baud, timeout: float = None, cancel_token: CancelToken = None) -> ProcessResult:
+        """Hard-resets the chip. Without an open session only the RTS line is toggled; no sync is needed."""
+        def reset(session):
+            if session.connected:
+                session.hard_reset()
+                return
+            import serial
+            from esptool.reset import HardReset
+            with serial.Serial(port, session.baud) as serial_port:
+                print(RESET_MARKER)
+                HardReset(serial_port)()
+
+        return self._run(['run'], port, baud, reset, timeout, None, cancel_token, connect=False)
+
+    async def read_mac_async(self, port: str, baud, timeout: float = None,
+                             cancel_token: CancelToken = None) -> ProcessResult:
+        return await asyncio.to_thread(self.read_mac, port, baud, timeout, cancel_token)
+
+    async def write_flash_async(self, port: str, baud, regions: List[Region], timeout: float = None,
+                                on_line: Callable[[str], None] = None, cancel_token: CancelToken = None,
+                                reset: bool = True, command: str = 'write_flash') -> ProcessResult:
+        return await asyncio.to_thread(self.write_flash, port, baud, regions, timeout, on_line, cancel_token, reset, command)
+
+    async def erase_region_async(self, port: str, baud, ranges: List[Tuple[int, int]], timeout: float = None,
+                                 on_line: Callable[[str], None] = None,
+                                 cancel_token: CancelToken = None) -> ProcessResult:
+        return await asyncio.to_thread(self.erase_region, port, baud, ranges, timeout, on_line, cancel_token)
+
+    async def reset_async(self, port: str, baud, timeout: float = None,
+                          cancel_token: CancelToken = None) -> ProcessResult:
+        return await asyncio.to_thread(self.reset, port, baud, timeout, cancel_token)
+
+    def close(self, port: str = None) -> None:
+        """Closes the session of one port, or of every port."""
+        with self._lock:
+            ports = [port] if port else list(self._sessions)
+            sessions = [self._sessions.pop(name) for name in ports if name in self._sessions]
+        for session in sessions:
+            with session.lock:
+                session.close()
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_esptool_backend(name: str = 'subprocess', tool_path: str = 'esptool.py'):
+    """
+    Returns the process-wide esptool backend.
+
+    Args:
+        name (str): 'subprocess' or 'library', from esptool_backend in config.ini.
+        tool_path (str): esptool executable for the subprocess backend.
+
+    Returns:
+        SubprocessBackend or LibraryBackend. The library backend falls back to the
+        subprocess one if the esptool package cannot be imported.
+    """
+    name = (name or 'subprocess').strip().lower()
+    if name not in ESPTOOL_BACKENDS:
+        print(f"Unknown esptool backend '{name}', using subprocess.")
+        name = 'subprocess'
+    with _backends_lock:
+        if name == 'library':
+            if 'library' not in _backends:
+                try:
+                    _backends['library'] = LibraryBackend()
+                except ImportError as e:
+                    print(f"esptool library backend unavailable ({e}), using subprocess.")
+                    _backends['library'] = None
+            if _backends['library'] is not None:
+                return _backends['library']
+        key = ('subprocess', tool_path)
+        if key not in _backends:
+            _backends[key] = SubprocessBackend(tool_path)
+        return _backends[key]
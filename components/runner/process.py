@@ -0,0 +1,204 @@
+import asyncio
+import threading
+import time
+
+from typing import Callable, List, Optional
+
+
+class ExitStatus:
+    """How a process run ended."""
+    OK = 'ok'
+    FAILED = 'failed'
+    TIMEOUT = 'timeout'
+    CANCELLED = 'cancelled'
+    NOT_FOUND = 'not_found'
+
+
+# esptool error messages and the failure reason they indicate, checked in order
+ESPTOOL_FAILURE_REASONS = (
+    ('could not open port', 'port_unavailable'),
+    ('Permission denied', 'port_unavailable'),
+    ('Device or resource busy', 'port_busy'),
+    ('Failed to connect', 'no_response'),
+    ('No serial data received', 'no_response'),
+    ('Wrong boot mode detected', 'boot_mode'),
+    ('A fatal error occurred', 'fatal'),
+)
+
+
+class ProcessResult:
+    """Outcome of one process run."""
+
+    def __init__(self, command: List[str], status: str, returncode: Optional[int] = None,
+                 stdout: str = '', stderr: str = '', seconds: float = 0.0):
+        self.command = command
+        self.status = status
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.seconds = seconds
+        self.reason = ''
+
+    @property
+    def ok(self) -> bool:
+        return self.status == ExitStatus.OK
+
+    def __repr__(self):
+        reason = f", reason={self.reason!r}" if self.reason else ''
+        return f"ProcessResult({self.status}, returncode={self.returncode}{reason}, {self.seconds:.2f}s)"
+
+
+class CancelToken:
+    """Lets another thread cancel a process run in progress."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cancelled = False
+        self._callbacks = []
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+    def cancel(self) -> None:
+        """Cancels every run this token was passed to."""
+        with self._lock:
+            self._cancelled = True
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def _register(self, callback: Callable[[], None]) -> None:
+        with self._lock:
+            if not self._cancelled:
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def _unregister(self, callback: Callable[[], None]) -> None:
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+
+def classify_esptool_result(result: ProcessResult) -> ProcessResult:
+    """Fills in result.reason for a failed esptool run from its output."""
+    if result.status != ExitStatus.FAILED:
+        return result
+    output = result.stdout + result.stderr
+    for marker, reason in ESPTOOL_FAILURE_REASONS:
+        if marker in output:
+            result.reason = reason
+            break
+    return result
+
+
+async def run_process_async(command: List[str], timeout: float = None,
+                            on_line: Callable[[str], None] = None,
+                            cancel_token: CancelToken = None) -> ProcessResult:
+    """
+    Runs a command, streaming its stdout line by line.
+
+    Args:
+        command (List[str]): Program and arguments.
+        timeout (float, optional): Kill the process after this many seconds.
+        on_line (Callable[[str], None], optional): Called with every stdout line as it arrives.
+        cancel_token (CancelToken, optional): Kills the process when cancelled.
+
+    Returns:
+        ProcessResult: Exit status, return code and the collected output.
+    """
+    start = time.monotonic()
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+        )
+    except (FileNotFoundError, PermissionError) as e:
+        return ProcessResult(command, ExitStatus.NOT_FOUND, stderr=str(e), seconds=time.monotonic() - start)
+
+    stdout_lines = []
+
+    async def read_stdout():
+        while True:
+            raw = await process.stdout.readline()
+            if not raw:
+                break
+            line = raw.decode('utf-8', errors='replace')
+            stdout_lines.append(line)
+            if on_line:
+                on_line(line)
+
+    async def communicate():
+        stderr, _ = await asyncio.gather(process.stderr.read(), read_stdout())
+        await process.wait()
+        return stderr
+
+    loop = asyncio.get_running_loop()
+    task = asyncio.ensure_future(communicate())
+
+    def cancel():
+        loop.call_soon_threadsafe(task.cancel)
+
+    if cancel_token:
+        cancel_token._register(cancel)
+    try:
+        stderr = await asyncio.wait_for(task, timeout)
+        status = ExitStatus.OK if process.returncode == 0 else ExitStatus.FAILED
+    except asyncio.TimeoutError:
+        stderr, status = b'', ExitStatus.TIMEOUT
+    except asyncio.CancelledError:
+        stderr, status = b'', ExitStatus.CANCELLED
+        if not (cancel_token and cancel_token.cancelled):
+            _kill(process)
+            raise
+    finally:
+        if cancel_token:
+            cancel_token._unregister(cancel)
+        _kill(process)
+
+    if process.returncode is None:
+        await process.wait()
+    return ProcessResult(command, status, process.returncode, ''.join(stdout_lines),
+                         stderr.decode('utf-8', errors='replace'), time.monotonic() - start)
+
+
+def _kill(process) -> None:
+    if process.returncode is None:
+        try:
+            process.kill()
+        except ProcessLookupError:
+            pass
+
+
+def run_process(command: List[str], timeout: float = None,
+                on_line: Callable[[str], None] = None,
+                cancel_token: CancelToken = None) -> ProcessResult:
+    """Blocking wrapper around run_process_async for worker threads."""
+    return asyncio.run(run_process_async(command, timeout, on_line, cancel_token))
+
+
+async def run_esptool_async(tool_path: str, port: str, baud, args: List[str], timeout: float = None,
+                            on_line: Callable[[str], None] = None,
+                            cancel_token: CancelToken = None) -> ProcessResult:
+    """
+    Runs one esptool command against a port.
+
+    Args:
+        tool_path (str): esptool executable, as configured in config.ini.
+        port (str): Serial port of the chip.
+        baud: Baud rate.
+        args (List[str]): esptool command and its arguments, e.g. ['read_mac'].
+
+    Returns:
+        ProcessResult: The run's result with the failure reason classified.
+    """
+    command = [tool_path, '--port', port, '--baud', str(baud)] + list(args)
+    result = await run_process_async(command, timeout, on_line, cancel_token)
+    return classify_esptool_result(result)
+
+
+def run_esptool(tool_path: str, port: str, baud, args: List[str], timeout: float = None,
+                on_line: Callable[[str], None] = None,
+                cancel_token: CancelToken = None) -> ProcessResult:
+    """Blocking wrapper around run_esptool_async for worker threads."""
+    return asyncio.run(run_esptool_async(tool_path, port, baud, args, timeout, on_line, cancel_token))
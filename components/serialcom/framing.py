@@ -0,0 +1,33 @@
+class LineFramer:
+    """
+    Splits a serial byte stream into text lines.
+
+    Bytes are buffered until a newline arrives, so a line split across several reads
+    is still delivered whole. Overlong lines without a newline are flushed once they
+    reach max_line_length so the buffer cannot grow without bound.
+    """
+
+    def __init__(self, max_line_length=4096, encoding='utf-8'):
+        self.max_line_length = max_line_length
+        self.encoding = encoding
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        """Adds received bytes and returns the complete lines, stripped of whitespace."""
+        self.buffer.extend(data)
+        lines = []
+        while True:
+            newline = self.buffer.find(b'\n')
+            if newline < 0:
+                if len(self.buffer) >= self.max_line_length:
+                    newline = len(self.buffer) - 1
+                else:
+                    break
+            raw = bytes(self.buffer[:newline + 1])
+            del self.buffer[:newline + 1]
+            lines.append(raw.decode(self.encoding, errors='replace').strip())
+        return lines
+
+    def reset(self):
+        """Discards any partial line."""
+        self.buffer.clear()
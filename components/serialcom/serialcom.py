@@ -3,12 +3,13 @@ import serial.tools.list_ports
 import time
 
 from PyQt6.QtCore import QThread, pyqtSignal
-from components.utils.utils import Utils
+from components.utils.utils import get_utils
+from components.serialcom.framing import LineFramer
 
 
 class SerialCommunicator:
     def __init__(self):
-        self.utils = Utils()
+        self.utils = get_utils()
         self.serial_ports = self.get_serial_ports()
         self.ser = None  # Initialize serial object to None
 
@@ -25,13 +26,28 @@ class SerialReaderThread(QThread):
     data_received = pyqtSignal(str)
     factory_status_changed = pyqtSignal(bool)
 
-    def __init__(self, port, baud):
+    def __init__(self, port, baud, read_timeout=0.5, prompt_timeout=None, utils=None):
+        """
+        Args:
+            port (str): Factory port of the ESP32-S3.
+            baud (int): Baud rate of the factory port.
+            read_timeout (float): Longest a single blocking read waits for data. This
+                bounds how long stop() can take when the platform cannot cancel a read.
+            prompt_timeout (float, optional): Give up and report a failed factory mode if
+                the device has not sent its "." prompt within this many seconds.
+            utils (Utils, optional): Settings the factory password and the LED test
+                command are read from; the shared ones by default.
+        """
         super().__init__()
+        self.utils = utils or get_utils()
         self.port = port
         self.baud = baud
+        self.read_timeout = read_timeout
+        self.prompt_timeout = prompt_timeout
         self.serial_conn = None
         self.running = True
         self.factory_status = False
+        self.framer = LineFramer()
 
     def run(self):
         self.factory_mode()
@@ -40,27 +56,51 @@ class SerialReaderThread(QThread):
     def factory_mode(self):
         try:
             self.factory_status = False
-            # Open the serial port
-            self.serial_conn = serial.Serial(self.port, self.baud, timeout=1)
+            self.framer.reset()
+            # Open the serial port; reads block for up to read_timeout instead of polling
+            self.serial_conn = serial.Serial(self.port, self.baud, timeout=self.read_timeout)
+            deadline = time.monotonic() + self.prompt_timeout if self.prompt_timeout else None
             while self.running:
-                if self.serial_conn.in_waiting > 0:
-                    data = self.serial_conn.readline().decode('utf-8').strip()
+                # Block until at least one byte arrives, then take everything already buffered
+                chunk = self.serial_conn.read(max(1, self.serial_conn.in_waiting))
+                for data in self.framer.feed(chunk):
                     # Emit the signal with the received data
                     self.data_received.emit(data)
-                    if data == ".":
-                        self.write_data("polyaire&ADT\r\n") # Factory Mode Password
-                        self.write_data(" FF:3;RGB-1\r\n") # Set RGB to red for testing
+                    if data == "." and not self.factory_status:
+                        # Same password the factory sequence sends, factory_esp32s3_password in config.ini
+                        self.write_data(self.utils.command_factory_password + "\r\n")
+                        red_led = self.utils.config.get('manual_test', 'redLed_command', fallback='').strip()
+                        if red_led:
+                            self.write_data(red_led + "\r\n")  # Set RGB to red for testing
                         self.factory_status = True
                         self.factory_status_changed.emit(self.factory_status)  # Emit status change
+                if deadline and not self.factory_status and time.monotonic() > deadline:
+                    self.data_received.emit(f"Error: no factory prompt from {self.port} within {self.prompt_timeout}s")
+                    self.factory_status_changed.emit(False)
+                    break
         except serial.SerialException as e:
-            self.data_received.emit(f"Error: {e}")
+            if self.running:
+                self.data_received.emit(f"Error: {e}")
+        finally:
+            self.close()
 
     def stop(self):
+        """Stops the reader; a read in progress is cancelled rather than waited out."""
         self.running = False
-        # Ensure to close the serial connection in stop() as well
-        if self.serial_conn and self.serial_conn.is_open:
-            self.serial_conn.close()
-            self.serial_conn = None
+        conn = self.serial_conn
+        if conn and conn.is_open and hasattr(conn, 'cancel_read'):
+            try:
+                conn.cancel_read()
+            except Exception:
+                pass
+        if not self.isRunning():
+            self.close()
+
+    def close(self):
+        """Closes the serial connection."""
+        conn, self.serial_conn = self.serial_conn, None
+        if conn and conn.is_open:
+            conn.close()
     
     def write_data(self, data_to_write):
         """Write data to the serial port."""
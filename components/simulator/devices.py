@@ -0,0 +1,141 @@
+import os
+import select
+import threading
+import time
+import tty
+
+from typing import Callable, Dict, Optional
+
+from components.serialcom.framing import LineFramer
+
+
+PROMPT = '.'
+COMMAND_PREFIXES = ('FF:1;', 'FF:2;', 'FF:3;')
+
+
+class FactoryDevice:
+    """
+    A simulated ESP32-S3 in factory mode on a pseudo-terminal.
+
+    The app opens `port` like a USB-serial adapter. While the port is open and
+    the password has not been sent, the device prints its "." prompt every
+    prompt_interval seconds. After the password it answers the FF:3;... commands of
+    config.ini: writes are acknowledged with "OK", reads return what was written
+    last (the product name, serial number, Matter QR or the device's MAC). Closing
+    the port counts as unplugging the board, so the next unit starts at the prompt
+    again with a new MAC.
+
+    Args:
+        password (str): Factory mode password, factory_esp32s3_password in config.ini.
+        product_name (str): Product name before one is written.
+        prompt_interval (float): Seconds between two prompts.
+        latency (float): Seconds the device takes to answer a command.
+        save_seconds (float): Seconds saveDevData takes, for the flash write behind it.
+        time_scale (float): Multiplies every delay.
+        on_line (Callable[[str], None], optional): Called with every line received.
+    """
+
+    def __init__(self, password: str, product_name: str = '', prompt_interval: float = 0.5,
+                 latency: float = 0.02, save_seconds: float = 0.3, time_scale: float = 1.0,
+                 on_line: Optional[Callable[[str], None]] = None):
+        self.password = password
+        self.default_product_name = product_name
+        self.prompt_interval = prompt_interval * time_scale
+        self.latency = latency * time_scale
+        self.save_seconds = save_seconds * time_scale
+        self.on_line = on_line
+        self.framer = LineFramer()
+        self.units = 0  # Boards served, counted when their identity was saved
+        self._master = None
+        self._thread = None
+        self._running = False
+        self._new_board()
+
+        master, slave = os.openpty()
+        # Raw mode sticks to the terminal after the slave is closed, so nothing is echoed back
+        tty.setraw(slave)
+        self.port = os.ttyname(slave)
+        os.close(slave)
+        self._master = master
+
+    def _new_board(self) -> None:
+        self.factory_mode = False
+        self.mac = '34:85:18:' + ':'.join(f'{byte:02x}' for byte in os.urandom(3))
+        self.data: Dict[str, str] = {'PRD': self.default_product_name, 'SRN': '', 'MTQRS': ''}
+        self.framer.reset()
+
+    def start(self) -> 'FactoryDevice':
+        self._running = True
+        self._thread = threading.Thread(target=self._serve, name=f'sim-factory-{os.path.basename(self.port)}', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._running = False
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        if self._master is not None:
+            os.close(self._master)
+            self._master = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def _write(self, line: str) -> None:
+        os.write(self._master, (line + '\r\n').encode('utf-8'))
+
+    def _serve(self) -> None:
+        connected = False
+        while self._running:
+            readable, _, _ = select.select([self._master], [], [], self.prompt_interval)
+            if not readable:
+                # Nothing to read and no hang-up: the app has the port open
+                connected = True
+                if not self.factory_mode:
+                    self._write(PROMPT)
+                continue
+            try:
+                chunk = os.read(self._master, 4096)
+            except OSError:
+                # EIO: nobody has the port open, i.e. the board was unplugged
+                if connected:
+                    self._new_board()
+                    connected = False
+                time.sleep(self.prompt_interval)
+                continue
+            connected = True
+            for line in self.framer.feed(chunk):
+                self._handle(line.strip())
+
+    def _handle(self, line: str) -> None:
+        if not line:
+            return
+        if self.on_line:
+            self.on_line(line)
+        if not self.factory_mode:
+            self.factory_mode = line == self.password
+            return
+        for prefix in COMMAND_PREFIXES:
+            if line.startswith(prefix):
+                time.sleep(self.latency)
+                self._write(self._answer(line[len(prefix):]))
+                return
+
+    def _answer(self, command: str) -> str:
+        if command == 'MAC?':
+            return f"MAC: {self.mac}"
+        if command.endswith('?'):
+            key = command[:-1]
+            return f"{key}: {self.data[key]}" if key in self.data else f"{key}: "
+        if command == 'saveDevData':
+            time.sleep(self.save_seconds)
+            self.units += 1
+            return 'OK'
+        key, separator, value = command.partition('-')
+        if separator:
+            self.data[key] = value
+        return 'OK'
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Stand-in for esptool.py that talks to no hardware.
+
+It takes esptool's command line (--port, --baud, --before/--after and the
+read_mac, write_flash, verify_flash, read_flash, erase_region, erase_flash and run
+commands), prints the lines esptool prints for them and takes about as long as
+esptool does on a real board: a connection and stub upload per run, writes at the
+UART rate of the compressed image and erases at the flash's erase rate.
+
+The chip is an ESP32-H2 if the port name contains "h2", otherwise an ESP32-S3.
+Every read_mac returns a new MAC address, as if a new board had been plugged in.
+
+Environment:
+    SIM_TIME_SCALE  Multiplies every delay, e.g. 0.05 for benchmark runs (default 1).
+    SIM_FAIL_RATE   Probability that a write_flash fails half way (default 0).
+    SIM_STATE_DIR   Directory where written images are remembered per port, so that
+                    verify_flash matches what an earlier write_flash wrote.
+"""
+import hashlib
+import json
+import os
+import random
+import sys
+import time
+import zlib
+
+VERSION = 'v4.7.0'
+RESET_MARKER = 'Hard resetting via RTS pin...'
+
+# Seconds to sync the ROM loader and to upload and start the stub
+CONNECT_SECONDS = 0.6
+STUB_SECONDS = 0.35
+# UART frame of one byte (8N1) and the flash's erase rate
+BITS_PER_BYTE = 10
+ERASE_SECONDS_PER_MB = 3.0
+# Compressed bytes the stub takes per write block
+FLASH_WRITE_SIZE = 0x4000
+SECTOR_SIZE = 0x1000
+
+CHIPS = {
+    'ESP32-S3': ('ESP32-S3 (QFN56) (revision v0.2)', 'WiFi, BLE, Embedded PSRAM 8MB (AP_3v3)', '34:85:18', '8MB'),
+    'ESP32-H2': ('ESP32-H2 (revision v0.1)', 'BLE, IEEE802.15.4', '60:55:f9', '4MB'),
+}
+
+
+class Failure(Exception):
+    """Ends the run like esptool's FatalError."""
+
+
+class Simulation:
+    def __init__(self, port: str, baud: int, after: str):
+        self.port = port
+        self.baud = baud
+        self.after = after
+        self.scale = float(os.environ.get('SIM_TIME_SCALE', '1'))
+        self.fail_rate = float(os.environ.get('SIM_FAIL_RATE', '0'))
+        self.state_dir = os.environ.get('SIM_STATE_DIR', '')
+        self.chip = 'ESP32-H2' if 'h2' in os.path.basename(port).lower() else 'ESP32-S3'
+
+    def sleep(self, seconds: float) -> None:
+        time.sleep(seconds * self.scale)
+
+    def connect(self) -> None:
+        description, features, _, _ = CHIPS[self.chip]
+        say(f"esptool.py {VERSION}")
+        say(f"Serial port {self.port}")
+        say("Connecting....")
+        self.sleep(CONNECT_SECONDS)
+        say(f"Chip is {description}")
+        say(f"Features: {features}")
+        say("Crystal is 40MHz")
+        say("Uploading stub...")
+        self.sleep(STUB_SECONDS)
+        say("Running stub...")
+        say("Stub running...")
+        if self.baud > 115200:
+            say(f"Changing baud rate to {self.baud}")
+            say("Changed.")
+
+    def finish(self) -> None:
+        say("")
+        say("Leaving...")
+        if self.after == 'no_reset':
+            say("Staying in bootloader.")
+        else:
+            say(RESET_MARKER)
+
+    def _state_path(self) -> str:
+        return os.path.join(self.state_dir, hashlib.md5(self.port.encode()).hexdigest() + '.json')
+
+    def load_state(self) -> dict:
+        if not self.state_dir:
+            return {}
+        try:
+            with open(self._state_path()) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def save_state(self, state: dict) -> None:
+        if self.state_dir:
+            os.makedirs(self.state_dir, exist_ok=True)
+            with open(self._state_path(), 'w') as file:
+                json.dump(state, file)
+
+    def forget(self, state: dict, start: int, end: int) -> None:
+        """Drops the images an erase or write of start..end destroyed."""
+        for offset, (size, _) in list(state.items()):
+            if int(offset) < end and start < int(offset) + size:
+                del state[offset]
+
+    def read_mac(self) -> None:
+        prefix = CHIPS[self.chip][2]
+        say("MAC: " + prefix + ''.join(f':{byte:02x}' for byte in os.urandom(3)))
+
+    def write_flash(self, pairs) -> None:
+        say("Configuring flash size...")
+        state = self.load_state()
+        images = sorted(((int(address, 0), path) for address, path in pairs), key=lambda image: image[0])
+        fail_at = random.randrange(len(images)) if random.random() < self.fail_rate else None
+        for index, (offset, path) in enumerate(images):
+            with open(path, 'rb') as file:
+                data = file.read()
+            compressed = zlib.compress(data, 9)
+            end = offset + len(data)
+            say(f"Flash will be erased from 0x{offset:08x} to 0x{-(-end // SECTOR_SIZE) * SECTOR_SIZE - 1:08x}...")
+            say(f"Compressed {len(data)} bytes to {len(compressed)}...")
+            blocks = max(1, -(-len(compressed) // FLASH_WRITE_SIZE))
+            seconds = 0.0
+            for block in range(blocks):
+                if fail_at == index and block >= blocks // 2:
+                    raise Failure("Serial data stream stopped: Possible serial noise or corruption.")
+                size = min(FLASH_WRITE_SIZE, len(compressed) - block * FLASH_WRITE_SIZE)
+                seconds += size * BITS_PER_BYTE / self.baud
+                self.sleep(size * BITS_PER_BYTE / self.baud)
+                say(f"Writing at 0x{offset + len(data) * block // blocks:08x}... ({100 * (block + 1) // blocks} %)")
+            seconds = max(seconds, 0.001)
+            say(f"Wrote {len(data)} bytes ({len(compressed)} compressed) at 0x{offset:08x} in {seconds:.1f} seconds "
+                f"(effective {len(data) * 8 / seconds / 1000:.1f} kbit/s)...")
+            say("Hash of data verified.")
+            self.forget(state, offset, end)
+            state[str(offset)] = (len(data), hashlib.md5(data).hexdigest())
+        self.save_state(state)
+
+    def verify_flash(self, pairs) -> None:
+        state = self.load_state()
+        say("Configuring flash size...")
+        mismatched = False
+        for address, path in pairs:
+            offset = int(address, 0)
+            with open(path, 'rb') as file:
+                data = file.read()
+            say(f"Verifying 0x{len(data):x} ({len(data)}) bytes @ 0x{offset:08x} in flash against {path}...")
+            self.sleep(0.05 + len(data) / (1 << 20) * 0.1)
+            if state.get(str(offset)) == [len(data), hashlib.md5(data).hexdigest()]:
+                say("-- verify OK (digest matched)")
+            else:
+                say("-- verify FAILED (digest mismatch)")
+                mismatched = True
+        if mismatched:
+            raise Failure("Verify failed.")
+
+    def read_flash(self, offset: int, size: int, path: str) -> None:
+        self.sleep(size * BITS_PER_BYTE / self.baud)
+        with open(path, 'wb') as file:
+            file.write(b'\xff' * size)
+        say(f"Read {size} bytes at 0x{offset:x} in {size * BITS_PER_BYTE / self.baud:.1f} seconds "
+            f"({self.baud / BITS_PER_BYTE * 8 / 1000:.1f} kbit/s)...")
+
+    def erase(self, offset: int, size: int) -> None:
+        seconds = size / (1 << 20) * ERASE_SECONDS_PER_MB
+        self.sleep(seconds)
+        state = self.load_state()
+        self.forget(state, offset, offset + size)
+        self.save_state(state)
+        say(f"Erase completed successfully in {seconds:.1f} seconds.")
+
+    def flash_size(self) -> int:
+        return int(CHIPS[self.chip][3][:-2]) << 20
+
+
+def say(line: str) -> None:
+    print(line, flush=True)
+
+
+def parse(argv):
+    """Splits esptool's command line into its options and the command with its arguments."""
+    options = {'port': '', 'baud': '115200', 'before': 'default_reset', 'after': 'hard_reset'}
+    rest = []
+    index = 0
+    while index < len(argv):
+        arg = argv[index]
+        if arg.startswith('--') and arg[2:] in options and index + 1 < len(argv):
+            options[arg[2:]] = argv[index + 1]
+            index += 2
+            continue
+        if arg in ('-p', '-b') and index + 1 < len(argv):
+            options['port' if arg == '-p' else 'baud'] = argv[index + 1]
+            index += 2
+            continue
+        rest.append(arg)
+        index += 1
+    # Command options such as write_flash's --flash_mode are accepted and ignored
+    words = [arg for arg in rest if not arg.startswith('-')]
+    return options, words[0] if words else '', words[1:]
+
+
+def main(argv=None) -> int:
+    options, command, args = parse(sys.argv[1:] if argv is None else argv)
+    if not command:
+        print("usage: esptool [--port PORT] [--baud BAUD] {read_mac,write_flash,verify_flash,read_flash,"
+              "erase_region,erase_flash,run} ...", file=sys.stderr)
+        return 2
+
+    simulation = Simulation(options['port'], int(options['baud']), options['after'])
+    try:
+        simulation.connect()
+        if command == 'read_mac':
+            simulation.read_mac()
+        elif command == 'write_flash':
+            simulation.write_flash(list(zip(args[::2], args[1::2])))
+        elif command == 'verify_flash':
+            simulation.verify_flash(list(zip(args[::2], args[1::2])))
+        elif command == 'read_flash':
+            simulation.read_flash(int(args[0], 0), int(args[1], 0), args[2])
+        elif command == 'erase_region':
+            say("Erasing region (may be slow depending on size)...")
+            simulation.erase(int(args[0], 0), int(args[1], 0))
+        elif command == 'erase_flash':
+            say("Erasing flash (this may take a while)...")
+            simulation.erase(0, simulation.flash_size())
+        elif command != 'run':
+            raise Failure(f"Unsupported command {command}")
+        simulation.finish()
+    except (Failure, OSError, IndexError, ValueError) as e:
+        say(f"\nA fatal error occurred: {e}")
+        return 2
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
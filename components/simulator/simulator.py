@@ -0,0 +1,132 @@
+import configparser
+import os
+import sys
+import uuid
+
+from typing import List
+
+from components.simulator.devices import FactoryDevice
+
+
+FAKE_ESPTOOL = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_esptool.py')
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Sizes of a generated certificate bundle, as esp-matter-mfg-tool writes them
+SECURE_CERT_SIZE = 0x2000
+DATA_PROVIDER_SIZE = 0x6000
+
+
+class SimulatedLine:
+    """
+    A production line of simulated stations, ready for the app to run against.
+
+    start() writes a config.ini for `stations` jigs into the directory. Their S3
+    and H2 ports are names the fake esptool understands; their factory ports are the
+    pseudo-terminals of FactoryDevice instances. It also generates certificate
+    bundles for `units` devices and imports their records into the directory's
+    device_data.db under order_no. The firmware images are the base config's, or
+    the repository's firmware/ directory when those do not exist.
+
+    Run the app with the directory as the working directory, so the device store,
+    certificate ledger and metrics it opens by default are the simulated ones.
+
+    Args:
+        directory (str): Where the config, database and certificates are written.
+        stations (int): Number of jigs.
+        units (int): Device records to create.
+        config_file (str): Base configuration; every other setting is taken from it.
+        time_scale (float): Multiplies every simulated delay, e.g. 0.05 for quick runs.
+        fail_rate (float): Probability that a simulated write_flash fails.
+        order_no (str): Order the records are created under.
+    """
+
+    def __init__(self, directory: str, stations: int = 1, units: int = 10, config_file: str = 'config.ini',
+                 time_scale: float = 1.0, fail_rate: float = 0.0, order_no: str = 'SIM'):
+        self.directory = os.path.abspath(directory)
+        self.stations = stations
+        self.units = units
+        self.base_config = config_file
+        self.time_scale = time_scale
+        self.fail_rate = fail_rate
+        self.order_no = order_no
+        self.config_file = os.path.join(self.directory, 'config.ini')
+        self.devices: List[FactoryDevice] = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def start(self) -> 'SimulatedLine':
+        os.makedirs(self.directory, exist_ok=True)
+        # The fake esptool runs as a child process and reads its settings from the environment
+        os.environ['SIM_TIME_SCALE'] = str(self.time_scale)
+        os.environ['SIM_FAIL_RATE'] = str(self.fail_rate)
+        os.environ['SIM_STATE_DIR'] = os.path.join(self.directory, 'flash')
+
+        parser = configparser.ConfigParser()
+        parser.read(self.base_config)
+        password = parser.get('factory_esp32s3', 'factory_esp32s3_password', fallback='')
+        product_name = parser.get('read_product_name', 'read_product_name_data', fallback='')
+        self.devices = [FactoryDevice(password, product_name, time_scale=self.time_scale).start()
+                        for _ in range(self.stations)]
+
+        certificates = os.path.join(self.directory, 'certificates')
+        self.write_config(parser, certificates)
+        self.create_records(certificates)
+        return self
+
+    def stop(self) -> None:
+        for device in self.devices:
+            device.stop()
+        self.devices = []
+
+    def write_config(self, parser: configparser.ConfigParser, certificates: str) -> None:
+        # tool_path is run as it is, so a wrapper pins the interpreter the simulation runs with
+        tool_path = os.path.join(self.directory, 'esptool')
+        with open(tool_path, 'w') as file:
+            file.write(f'#!/bin/sh\nexec "{sys.executable}" "{FAKE_ESPTOOL}" "$@"\n')
+        os.chmod(tool_path, 0o755)
+        parser['DEFAULT']['tool_path'] = tool_path
+        parser['DEFAULT']['esptool_backend'] = 'subprocess'
+        parser['DEFAULT']['baud_profile_file'] = os.path.join(self.directory, 'baud_profiles.json')
+        parser['DEFAULT']['metrics_file'] = os.path.join(self.directory, 'metrics.prom')
+        parser['DEFAULT']['metrics_http_port'] = '0'
+        for section, key, fallback in (('flash_firmware_esp32s3', 'flash_firmware_esp32s3_filepath', 'firmware/s3'),
+                                       ('flash_firmware_esp32h2', 'flash_firmware_esp32h2_filepath', 'firmware/h2')):
+            if not os.path.isdir(parser.get(section, key, fallback='')):
+                parser[section][key] = os.path.join(ROOT, fallback)
+        parser['flash_dac_esp32s3']['flash_cert_esp32s3_filepath'] = certificates
+
+        for section in [section for section in parser.sections() if section.startswith('station_')]:
+            parser.remove_section(section)
+        for index, device in enumerate(self.devices, 1):
+            parser[f'station_{index}'] = {
+                's3_port': f'/dev/sim-s3-{index}',
+                'h2_port': f'/dev/sim-h2-{index}',
+                'factory_port': device.port,
+            }
+        with open(self.config_file, 'w') as file:
+            parser.write(file)
+
+    def create_records(self, certificates: str) -> None:
+        """Generates certificate bundles and imports one device record per bundle."""
+        from components.devicedata.importer import DeviceDataImporter
+
+        device_data = os.path.join(self.directory, 'device_data.txt')
+        with open(device_data, 'w') as file:
+            for number in range(1, self.units + 1):
+                serial_id = f'SIM{number:06d}'
+                cert_id = str(uuid.uuid4())
+                bundle = os.path.join(certificates, serial_id, 'espsecurecert', 'out', cert_id)
+                os.makedirs(bundle, exist_ok=True)
+                with open(os.path.join(bundle, f'{cert_id}_esp_secure_cert.bin'), 'wb') as cert:
+                    cert.write(os.urandom(SECURE_CERT_SIZE))
+                with open(os.path.join(bundle, f'{cert_id}-partition.bin'), 'wb') as partition:
+                    partition.write(os.urandom(DATA_PROVIDER_SIZE))
+                file.write(f"order-no: {self.order_no}, mac-address: , serial-id: {serial_id}, cert-id: {cert_id}, "
+                           f"esp-secure-cert-partition: , commissionable-data-provider-partition: , "
+                           f"qrcode: MT:SIM{number:06d}, manualcode: {number:011d}, discriminator: {number % 4096}, "
+                           f"passcode: {20202021 + number}\n")
+        DeviceDataImporter(os.path.join(self.directory, 'device_data.db')).import_file(device_data)
@@ -0,0 +1,287 @@
+import threading
+import time
+
+from concurrent.futures import Executor
+from typing import Callable, Dict, Iterable, List, Optional
+
+from components.runner.process import CancelToken
+
+
+class TaskStatus:
+    """States of a task in a graph run."""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    PASSED = 'passed'
+    FAILED = 'failed'
+    SKIPPED = 'skipped'
+
+
+class TaskGraphError(ValueError):
+    """Raised when a task graph names an unknown dependency or has a cycle."""
+
+
+class Task:
+    """
+    One step of a unit, e.g. flashing the S3.
+
+    Args:
+        name (str): Task name; also the stage name its result is reported under.
+        action (Callable[[CancelToken], bool]): Does the work and returns True on
+            success. It should pass the token to the esptool runs or jobs it starts,
+            so a timed-out attempt stops instead of holding its port.
+        after (Iterable[str]): Tasks that must have passed before this one starts.
+        resource (str): Tasks with the same resource, e.g. a serial port, never run
+            at the same time.
+        retries (int): Extra attempts after a failed or timed-out one.
+        timeout (float, optional): Seconds one attempt may take before it is cancelled.
+    """
+
+    def __init__(self, name: str, action: Callable[[CancelToken], bool], after: Iterable[str] = (),
+                 resource: str = '', retries: int = 0, timeout: float = None):
+        self.name = name
+        self.action = action
+        self.after = tuple(after)
+        self.resource = resource
+        self.retries = retries
+        self.timeout = timeout
+
+    def __repr__(self):
+        return f"Task({self.name!r}, after={self.after}, resource={self.resource!r})"
+
+
+class TaskResult:
+    """Outcome of one task; seconds add up all of its attempts."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.status = TaskStatus.PENDING
+        self.attempts = 0
+        self.seconds = 0.0
+        self.error = ''
+
+    @property
+    def success(self) -> bool:
+        return self.status == TaskStatus.PASSED
+
+    def __repr__(self):
+        return f"TaskResult({self.name!r}, {self.status}, attempts={self.attempts}, {self.seconds:.3f}s)"
+
+
+class TaskGraph:
+    """
+    The steps of one unit and what each of them waits for.
+
+        graph = TaskGraph()
+        graph.add('read_mac', read_mac, resource=s3_port)
+        graph.add('flash', flash, after=['read_mac'], resource=s3_port, retries=1)
+    """
+
+    def __init__(self):
+        self.tasks: Dict[str, Task] = {}
+
+    def add(self, name: str, action: Callable[[CancelToken], bool], after: Iterable[str] = (),
+            resource: str = '', retries: int = 0, timeout: float = None) -> Task:
+        """Adds a task; see Task for the arguments."""
+        if name in self.tasks:
+            raise TaskGraphError(f"Task {name} is defined twice")
+        task = Task(name, action, after, resource, retries, timeout)
+        self.tasks[name] = task
+        return task
+
+    def dependants(self, name: str) -> List[str]:
+        """Returns every task that waits, directly or not, for the named one."""
+        found = []
+        frontier = [name]
+        while frontier:
+            current = frontier.pop()
+            for task in self.tasks.values():
+                if current in task.after and task.name not in found:
+                    found.append(task.name)
+                    frontier.append(task.name)
+        return found
+
+    def order(self) -> List[str]:
+        """
+        Returns the task names so that every task comes after its dependencies.
+
+        Raises:
+            TaskGraphError: If a dependency is unknown or the tasks form a cycle.
+        """
+        for task in self.tasks.values():
+            unknown = [name for name in task.after if name not in self.tasks]
+            if unknown:
+                raise TaskGraphError(f"Task {task.name} waits for unknown task(s) {', '.join(unknown)}")
+        ordered = []
+        remaining = list(self.tasks.values())
+        while remaining:
+            ready = [task for task in remaining if all(name in ordered for name in task.after)]
+            if not ready:
+                raise TaskGraphError(f"Tasks {', '.join(task.name for task in remaining)} wait for each other")
+            ordered += [task.name for task in ready]
+            remaining = [task for task in remaining if task not in ready]
+        return ordered
+
+    def critical_path(self, seconds: Dict[str, float]) -> List[str]:
+        """
+        Returns the chain of dependent tasks that took longest, which bounds the cycle time.
+
+        Args:
+            seconds (Dict[str, float]): Duration per task name; missing tasks count as 0.
+        """
+        finish: Dict[str, float] = {}
+        previous: Dict[str, Optional[str]] = {}
+        for name in self.order():
+            before = max(self.tasks[name].after, key=lambda dependency: finish[dependency], default=None)
+            finish[name] = (finish[before] if before else 0.0) + seconds.get(name, 0.0)
+            previous[name] = before
+        path = []
+        name = max(finish, key=finish.get, default=None)
+        while name:
+            path.append(name)
+            name = previous[name]
+        return path[::-1]
+
+
+class GraphRun:
+    """
+    Runs a task graph on an executor, starting each task as soon as it can.
+
+    A task starts once its dependencies passed and its resource is free, so tasks on
+    different ports overlap and tasks on the same port queue up. A failed task (after
+    its retries) skips everything that waits for it; the other branches carry on.
+    Nothing blocks between tasks: completions schedule the next tasks from the worker
+    that finished, so many graphs can share one bounded pool. The callbacks run on
+    worker threads:
+
+        on_task_started(task_name)
+        on_task_finished(task_result)
+        on_finished(graph_run)
+
+    Args:
+        graph (TaskGraph): Tasks to run.
+        executor (Executor): Pool the tasks run on.
+    """
+
+    def __init__(self, graph: TaskGraph, executor: Executor,
+                 on_task_started: Optional[Callable[[str], None]] = None,
+                 on_task_finished: Optional[Callable[[TaskResult], None]] = None,
+                 on_finished: Optional[Callable[['GraphRun'], None]] = None):
+        self.graph = graph
+        self.executor = executor
+        self.on_task_started = on_task_started
+        self.on_task_finished = on_task_finished
+        self.on_finished = on_finished
+        self.order = graph.order()
+        self.results: Dict[str, TaskResult] = {name: TaskResult(name) for name in self.order}
+        self._lock = threading.Lock()
+        self._busy = set()
+        self._tokens: Dict[str, CancelToken] = {}
+        self._cancelled = False
+        self._done = threading.Event()
+
+    @property
+    def success(self) -> bool:
+        return all(result.success for result in self.results.values())
+
+    def start(self) -> 'GraphRun':
+        self._start(self._ready())
+        return self
+
+    def wait(self, timeout: float = None) -> bool:
+        """Blocks until every task has passed, failed or been skipped; False on timeout."""
+        return self._done.wait(timeout)
+
+    def cancel(self) -> None:
+        """Skips the tasks that have not started and cancels the running ones."""
+        with self._lock:
+            self._cancelled = True
+            tokens = list(self._tokens.values())
+        for token in tokens:
+            token.cancel()
+
+    def _ready(self) -> List[Task]:
+        """Claims the resources of every task that can start now; call with the lock released."""
+        ready = []
+        finished = False
+        with self._lock:
+            for name in self.order:
+                task, result = self.graph.tasks[name], self.results[name]
+                if result.status != TaskStatus.PENDING:
+                    continue
+                if self._cancelled:
+                    result.status, result.error = TaskStatus.SKIPPED, 'cancelled'
+                    continue
+                if not all(self.results[dependency].success for dependency in task.after):
+                    continue
+                if task.resource and task.resource in self._busy:
+                    continue
+                if task.resource:
+                    self._busy.add(task.resource)
+                result.status = TaskStatus.RUNNING
+                ready.append(task)
+            if not ready and not any(result.status == TaskStatus.RUNNING for result in self.results.values()):
+                finished = not self._done.is_set()
+                self._done.set()
+        if finished and self.on_finished:
+            self.on_finished(self)
+        return ready
+
+    def _start(self, tasks: List[Task]) -> None:
+        for task in tasks:
+            if self.on_task_started:
+                self.on_task_started(task.name)
+            self.executor.submit(self._attempt, task)
+
+    def _attempt(self, task: Task) -> None:
+        result = self.results[task.name]
+        token = CancelToken()
+        timed_out = threading.Event()
+        with self._lock:
+            self._tokens[task.name] = token
+            cancelled = self._cancelled
+        if cancelled:
+            token.cancel()
+
+        def expire():
+            timed_out.set()
+            token.cancel()
+
+        timer = threading.Timer(task.timeout, expire) if task.timeout else None
+        start = time.monotonic()
+        if timer:
+            timer.start()
+        try:
+            success, error = bool(task.action(token)), ''
+        except Exception as e:
+            success, error = False, f"{type(e).__name__}: {e}"
+        finally:
+            if timer:
+                timer.cancel()
+        if timed_out.is_set():
+            success, error = False, f"timed out after {task.timeout:g}s"
+        elif not success and not error:
+            error = 'cancelled' if token.cancelled else 'failed'
+
+        with self._lock:
+            self._tokens.pop(task.name, None)
+            result.attempts += 1
+            result.seconds += time.monotonic() - start
+            retry = not success and result.attempts <= task.retries and not self._cancelled
+            if retry:
+                print(f"Task {task.name}: attempt {result.attempts} {error}, retrying.")
+            else:
+                result.status, result.error = (TaskStatus.PASSED, '') if success else (TaskStatus.FAILED, error)
+                if task.resource:
+                    self._busy.discard(task.resource)
+                if not success:
+                    for name in self.graph.dependants(task.name):
+                        if self.results[name].status == TaskStatus.PENDING:
+                            self.results[name].status = TaskStatus.SKIPPED
+                            self.results[name].error = f"{task.name} failed"
+        if retry:
+            self.executor.submit(self._attempt, task)
+            return
+
+        if self.on_task_finished:
+            self.on_task_finished(result)
+        self._start(self._ready())
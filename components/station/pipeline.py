@@ -0,0 +1,408 @@
+import asyncio
+import threading
+import time
+
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+from components.devicestore.devicestore import DeviceStore
+from components.factory.engine import FactoryCommandEngine, FactoryResult, FactorySequence
+from components.flash.jobs import FlashH2Job, FlashS3Job
+from components.metrics.metrics import Stage
+from components.runner.process import CancelToken
+from components.station.graph import GraphRun, TaskGraph, TaskResult
+from components.station.prefetch import CertificatePrefetcher, StagingError
+from components.station.station import Station
+from components.utils.utils import Utils
+
+# Seconds a task may take beyond the timeout of the esptool run or serial wait inside it
+TIMEOUT_MARGIN = 10.0
+# Esptool runs of one S3 flash attempt: erase, certificate and firmware
+S3_FLASH_RUNS = 3
+
+# Unit detail when a task fails, unless the task reported a more precise one
+FAILURE_DETAILS = {
+    'read_mac_s3': 'MAC address could not be read',
+    'read_mac_h2': 'MAC address could not be read',
+    'claim': 'order exhausted',
+    'flash_s3': 'flashing failed',
+    'flash_h2': 'flashing failed',
+    'reboot': 'reboot failed',
+    'factory_mode': 'factory mode not reached',
+    'factory_commands': 'factory sequence failed',
+}
+
+
+class UnitResult:
+    """
+    Outcome of one unit run through the pipeline.
+
+    stages maps every stage that ran to {'success', 'seconds', 'detail'}; detail
+    names the reason of a failed unit, e.g. 'order exhausted'. critical_path lists
+    the chain of stages that bounded the unit's cycle time.
+    """
+
+    def __init__(self, station: str, order_no: str):
+        self.station = station
+        self.order_no = order_no
+        self.serial_id = ''
+        self.s3_mac = ''
+        self.h2_mac = ''
+        self.stages: Dict[str, dict] = {}
+        self.critical_path = []
+        self.success = False
+        self.detail = ''
+        self.seconds = 0.0
+
+    def add_stage(self, name: str, success: bool, seconds: float, detail: str = '') -> bool:
+        self.stages[name] = {'success': success, 'seconds': round(seconds, 3), 'detail': detail}
+        return success
+
+    def to_dict(self) -> dict:
+        return {
+            'station': self.station,
+            'order': self.order_no,
+            'serial_id': self.serial_id,
+            's3_mac': self.s3_mac,
+            'h2_mac': self.h2_mac,
+            'success': self.success,
+            'detail': self.detail,
+            'seconds': round(self.seconds, 3),
+            'stages': self.stages,
+            'critical_path': self.critical_path,
+        }
+
+
+class _FactorySession:
+    """
+    The factory port of one unit, held open from factory mode to the last command.
+
+    The engine lives on an event loop thread of its own, so the graph's tasks can
+    hand it coroutines from whichever worker they run on.
+    """
+
+    def __init__(self, port: str, baud: str):
+        self.port = port
+        self.baud = baud
+        self.serial_conn = None
+        self.engine = None
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name=f'factory-{port}', daemon=True)
+        self.thread.start()
+
+    def call(self, coroutine, cancel_token: CancelToken = None):
+        """Runs a coroutine on the session's loop and returns its result; the token cancels it."""
+        future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+        if cancel_token is None:
+            return future.result()
+        cancel_token._register(future.cancel)
+        try:
+            return future.result()
+        finally:
+            cancel_token._unregister(future.cancel)
+
+    def open(self, cancel_token: CancelToken = None) -> FactoryCommandEngine:
+        import serial
+
+        self.serial_conn = serial.Serial(self.port, self.baud, timeout=0.1)
+        engine = FactoryCommandEngine(self.serial_conn, on_line=lambda line: print(f"[{self.port}] {line}"))
+        self.call(engine.start(), cancel_token)
+        self.engine = engine
+        return engine
+
+    def close(self) -> None:
+        if self.engine is not None:
+            self.call(self.engine.close())
+            self.engine = None
+        if self.serial_conn is not None:
+            self.serial_conn.close()
+            self.serial_conn = None
+        if self.loop.is_running():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.loop.close()
+
+
+class UnitRun:
+    """
+    One unit going through the pipeline, as returned by UnitPipeline.start.
+
+    result fills in while the unit runs; wait() blocks until it is final.
+    """
+
+    def __init__(self, pipeline: 'UnitPipeline', on_finished: Optional[Callable[[UnitResult], None]] = None):
+        self.pipeline = pipeline
+        self.station = pipeline.station
+        self.utils = pipeline.utils
+        self.on_finished = on_finished
+        self.result = UnitResult(self.station.name, pipeline.order_no)
+        self.record = None
+        self.staged = None
+        self.flashed = False
+        self.s3_job = None
+        self.session = None
+        self.sequence = None
+        self.details: Dict[str, str] = {}
+        self.graph_run = None
+        self._start = time.monotonic()
+        self._timer = pipeline.metrics.stage(self.station.s3_port, Stage.CYCLE, self.station.s3_port)
+        self._finished = threading.Event()
+
+    def graph(self) -> TaskGraph:
+        """
+        Builds the unit's task graph.
+
+        Both MACs are read at once. The S3 is flashed as soon as the unit's record
+        is claimed, the H2 as soon as its MAC is read, and the factory step starts once
+        the S3 rebooted and the H2 flash passed. Every esptool task may retry once;
+        the factory tasks run exactly once, as they change the device's identity.
+        """
+        station, utils = self.station, self.utils
+        probe_timeout = utils.timeout_esptool_probe + TIMEOUT_MARGIN
+        flash_timeout = utils.timeout_esptool_flash + TIMEOUT_MARGIN
+
+        graph = TaskGraph()
+        graph.add('read_mac_s3', self.read_mac_s3, resource=station.s3_port, retries=1, timeout=probe_timeout)
+        graph.add('read_mac_h2', self.read_mac_h2, resource=station.h2_port, retries=1, timeout=probe_timeout)
+        # A unit whose H2 does not answer must not use up a certificate
+        graph.add('claim', self.claim, after=['read_mac_s3', 'read_mac_h2'])
+        graph.add('flash_s3', self.flash_s3, after=['claim'], resource=station.s3_port, retries=1,
+                  timeout=S3_FLASH_RUNS * flash_timeout)
+        graph.add('flash_h2', self.flash_h2, after=['read_mac_h2'], resource=station.h2_port, retries=1,
+                  timeout=flash_timeout)
+        graph.add('reboot', self.reboot, after=['flash_s3'], resource=station.s3_port, retries=1, timeout=probe_timeout)
+        if self.pipeline.factory:
+            sequence = self.pipeline.factory_sequence(self)
+            steps = len(sequence.commands)
+            mode_timeout = sequence.prompt_timeout + TIMEOUT_MARGIN if sequence.prompt_timeout else None
+            graph.add('factory_mode', self.factory_mode, after=['reboot', 'flash_h2'], resource=station.factory_port,
+                      timeout=mode_timeout)
+            graph.add('factory_commands', self.factory_commands, after=['factory_mode'], resource=station.factory_port,
+                      timeout=steps * sequence.timeout * (sequence.retries + 1) + TIMEOUT_MARGIN)
+            self.sequence = sequence
+        return graph
+
+    def start(self, executor: Executor) -> 'UnitRun':
+        self.graph_run = GraphRun(self.graph(), executor, on_task_finished=self._task_finished, on_finished=self._finish)
+        self.graph_run.start()
+        return self
+
+    def wait(self, timeout: float = None) -> bool:
+        return self._finished.wait(timeout)
+
+    def cancel(self) -> None:
+        if self.graph_run:
+            self.graph_run.cancel()
+
+    def _task_finished(self, task: TaskResult) -> None:
+        self.result.add_stage(task.name, task.success, task.seconds, '' if task.success else self.details.get(task.name, task.error))
+        if self.pipeline.on_stage:
+            self.pipeline.on_stage(self.station.name, task.name, task.success)
+
+    def _finish(self, graph_run: GraphRun) -> None:
+        result = self.result
+        try:
+            if self.staged is not None and not self.flashed:
+                self.pipeline.prefetcher.release(self.staged)
+            if self.session is not None:
+                self.session.close()
+                self.session = None
+        except Exception as e:
+            print(f"Station {self.station.name}: cleaning up after the unit failed: {e}")
+
+        result.success = graph_run.success
+        failed = next((task for task in graph_run.results.values() if not task.success and task.attempts), None)
+        if failed:
+            result.detail = self.details.get(failed.name) or FAILURE_DETAILS.get(failed.name) or failed.error
+        elif not result.success:
+            result.detail = 'cancelled'
+        result.critical_path = graph_run.graph.critical_path({name: task.seconds for name, task in graph_run.results.items()})
+        result.seconds = time.monotonic() - self._start
+        self._timer.stop(result.success, unit=result.serial_id or None, detail=result.detail)
+        self._finished.set()
+        if self.on_finished:
+            self.on_finished(result)
+
+    def _read_mac(self, port: str, baud: str, cancel_token: CancelToken) -> str:
+        return asyncio.run(self.utils.esptool_read_mac_async(port, baud, cancel_token=cancel_token)) or ''
+
+    def read_mac_s3(self, cancel_token: CancelToken) -> bool:
+        self.result.s3_mac = self._read_mac(self.station.s3_port, self.station.s3_baud, cancel_token)
+        return bool(self.result.s3_mac)
+
+    def read_mac_h2(self, cancel_token: CancelToken) -> bool:
+        self.result.h2_mac = self._read_mac(self.station.h2_port, self.station.h2_baud, cancel_token)
+        return bool(self.result.h2_mac)
+
+    def claim(self, cancel_token: CancelToken) -> bool:
+        # Usually staged while the previous unit flashed, so this is a queue pop
+        try:
+            self.staged = self.pipeline.prefetcher.take()
+        except StagingError as e:
+            self.details['claim'] = str(e)
+            return False
+        if self.staged is None:
+            return False
+        self.record = self.staged.record
+        self.result.serial_id = self.staged.serial_id
+        return True
+
+    def flash_s3(self, cancel_token: CancelToken) -> bool:
+        utils, job = self.utils, self.s3_job
+        if job is None:
+            job = self.s3_job = FlashS3Job(
+                self.station.s3_port,
+                self.station.s3_baud,
+                utils.address_bootloader_flashS3,
+                utils.address_partition_table_flashS3,
+                utils.address_ota_data_initial_flashS3,
+                utils.address_firmware_flashS3,
+                utils.address_dac_secure_cert_partition,
+                utils.address_dac_data_provider_partition,
+                on_progress=self._progress('s3'),
+                utils=utils,
+                station=self.station.name
+            )
+            job.serial_id = self.staged.serial_id
+            job.cert_uuid = self.staged.cert_uuid
+            job.staged = self.staged
+        job.cancel_token = cancel_token
+        # A retry after the certificate reached the board only has the firmware left to write
+        success = job.flash_firmware() if job.success_detected_certificate else job.run()
+        if job.success_detected_certificate and not self.flashed:
+            self.flashed = self.pipeline.store.mark_flashed(self.result.serial_id, self.result.s3_mac)
+        return success
+
+    def flash_h2(self, cancel_token: CancelToken) -> bool:
+        utils = self.utils
+        job = FlashH2Job(
+            self.station.h2_port,
+            self.station.h2_baud,
+            utils.command_flashH2,
+            utils.address_bootloader_flashH2,
+            utils.address_partition_table_flashH2,
+            utils.address_firmware_flashH2,
+            # The H2 may finish before the S3's record is claimed; its runs are then timed under its MAC
+            unit=self.result.serial_id or self.result.h2_mac,
+            on_progress=self._progress('h2'),
+            utils=utils
+        )
+        job.cancel_token = cancel_token
+        return job.run()
+
+    def reboot(self, cancel_token: CancelToken) -> bool:
+        return asyncio.run(self.utils.esptool_reboot_async(self.station.s3_port, self.station.s3_baud,
+                                                           cancel_token=cancel_token, unit=self.result.serial_id))
+
+    def factory_mode(self, cancel_token: CancelToken) -> bool:
+        import serial
+
+        self.session = _FactorySession(self.station.factory_port, self.station.factory_baud)
+        try:
+            engine = self.session.open(cancel_token)
+        except serial.SerialException as e:
+            self.details['factory_mode'] = str(e)
+            return False
+        return self.session.call(self.sequence.enter_factory_mode(engine), cancel_token)
+
+    def factory_commands(self, cancel_token: CancelToken) -> bool:
+        success = self.session.call(self.sequence.run_commands(self.session.engine, self.result.serial_id,
+                                                               self.record.get('qrcode') or ''), cancel_token)
+        failed = next((result for result in self.sequence.results if not result.success), None)
+        if failed:
+            self.details['factory_commands'] = f"{failed.name}: {failed.error}"
+        return success
+
+    def _progress(self, chip: str):
+        if self.pipeline.on_progress is None:
+            return None
+        return lambda progress: self.pipeline.on_progress(self.station.name, chip, progress)
+
+
+class UnitPipeline:
+    """
+    Runs the semi-auto test of one unit on one station without Qt.
+
+    The steps form a task graph (see UnitRun.graph): read both MAC addresses,
+    take the next record of the order, flash the S3 (certificate and firmware) and
+    the H2, reboot the S3 and run the factory sequence on its factory port. Steps on
+    different ports overlap; steps on the same port queue up. A record whose
+    certificate never reached the board is released again; one whose certificate
+    was written is marked flashed.
+
+    Records come from a CertificatePrefetcher, which claims and checks the next
+    unit's record and certificate while the current unit flashes. Call close()
+    when no more units will run, so a staged record is not left claimed.
+
+    The callbacks are invoked from worker threads:
+
+        on_stage(station_name, stage, success)
+        on_progress(station_name, chip, flash_progress)    chip is 's3' or 'h2'
+        on_factory_result(station_name, factory_result)
+
+    Args:
+        station (Station): Fixture the unit sits in.
+        utils (Utils): Loaded configuration.
+        order_no (str): Order the unit's record is claimed from.
+        store (DeviceStore, optional): Device records; defaults to device_data.db.
+        factory (bool, optional): Runs the factory sequence after flashing.
+    """
+
+    def __init__(self, station: Station, utils: Utils, order_no: str, store: DeviceStore = None,
+                 factory: bool = True, on_stage: Optional[Callable[[str, str, bool], None]] = None,
+                 on_progress: Optional[Callable[[str, str, object], None]] = None,
+                 on_factory_result: Optional[Callable[[str, FactoryResult], None]] = None):
+        self.station = station
+        # The station's own overrides win over the file's settings
+        self.utils = station.utils or utils
+        self.order_no = order_no
+        self.store = store or DeviceStore()
+        self.factory = factory
+        self.on_stage = on_stage
+        self.on_progress = on_progress
+        self.on_factory_result = on_factory_result
+        self.metrics = utils.get_metrics()
+        self.prefetcher = CertificatePrefetcher(self.store, order_no, station.name, self.utils)
+
+    def start(self, executor: Executor, on_finished: Optional[Callable[[UnitResult], None]] = None) -> UnitRun:
+        """
+        Starts one unit on a shared worker pool and returns immediately.
+
+        Args:
+            executor (Executor): Pool the unit's tasks run on.
+            on_finished (Callable[[UnitResult], None], optional): Called from a worker
+                thread with the final result.
+        """
+        return UnitRun(self, on_finished).start(executor)
+
+    def run(self) -> UnitResult:
+        """Runs every step of one unit and returns its outcome."""
+        # One worker per port: the S3, the H2 and the factory port
+        with ThreadPoolExecutor(max_workers=3, thread_name_prefix=f'unit-{self.station.name}') as pool:
+            unit = self.start(pool)
+            unit.wait()
+        return unit.result
+
+    def close(self) -> None:
+        """Returns the records staged for units that will not run to the pool."""
+        self.prefetcher.close()
+
+    def factory_sequence(self, unit: UnitRun) -> FactorySequence:
+        port = self.station.factory_port
+
+        def on_result(result):
+            self.metrics.record(unit.result.serial_id, Stage.factory_command(result.name), result.seconds,
+                                result.success, port, result.error)
+            if self.on_factory_result:
+                self.on_factory_result(self.station.name, result)
+
+        return FactorySequence(
+            self.utils.factory_commands(),
+            self.utils.command_factory_password,
+            product_name=self.utils.data_read_product_name,
+            # 0 in config.ini means no deadline, as for SerialReaderThread
+            prompt_timeout=float(self.utils.prompt_timeout_factoryS3) or None,
+            timeout=float(self.utils.timeout_factory_command),
+            retries=int(self.utils.retries_factory_command),
+            on_result=on_result
+        )
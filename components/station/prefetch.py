@@ -0,0 +1,293 @@
+import os
+import threading
+
+from collections import deque
+from typing import Dict, List, Optional
+
+from components.artifacts.archive import ArchiveError, ArchivedFile, source_digest, source_name, source_size
+from components.artifacts.artifacts import SECURE_CERT_SUFFIX, get_artifact_index
+from components.devicestore.devicestore import CertificateLedger, DeviceStore
+from components.flash.partitions import Partition, read_partition_table
+from components.utils.utils import Utils
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Records rejected in a row before staging stops; so many bad bundles point at the station, not the records
+MAX_CONSECUTIVE_REJECTS = 5
+
+
+class CertificateError(Exception):
+    """Raised when a device record's certificate bundle is missing or unusable."""
+
+
+class StagingError(Exception):
+    """Raised when a station cannot stage any record, e.g. its certificates directory is missing or unreadable."""
+
+
+def certificate_uuid(record: Dict) -> str:
+    """
+    Returns the UUID of a record's certificate bundle.
+
+    device_data.txt names the bundle's esp_secure_cert file; its UUID prefix is
+    what the bundle is stored under. Records without that column use the cert id.
+    """
+    file_name = os.path.basename(record.get('esp_secure_cert_partition') or '')
+    if file_name.endswith(SECURE_CERT_SUFFIX):
+        return file_name[:-len(SECURE_CERT_SUFFIX)]
+    return record.get('cert_id') or ''
+
+
+class StagedCertificate:
+    """
+    A claimed device record whose certificate bundle was found, checked and reserved.
+
+    regions are the (label, address, source) tuples FlashS3Job writes, a source being
+    a path or a file in a certificate archive; digests are the SHA-256 of every file
+    when it was checked.
+    """
+
+    def __init__(self, record: Dict, cert_uuid: str, regions: List[tuple], digests: Dict[str, str]):
+        self.record = record
+        self.serial_id = record['serial_id']
+        self.cert_uuid = cert_uuid
+        self.regions = regions
+        self.digests = digests
+        self._stats = {label: _stat(path) for label, _, path in regions}
+
+    def unchanged(self) -> bool:
+        """Returns True if no file of the bundle was replaced or rewritten since it was checked."""
+        return all(_stat(path) == self._stats[label] for label, _, path in self.regions)
+
+    def __repr__(self):
+        return f"StagedCertificate({self.serial_id!r}, {self.cert_uuid!r})"
+
+
+def _stat(source) -> tuple:
+    # An archived file changes only when its archive is replaced
+    path = source.archive.path if isinstance(source, ArchivedFile) else source
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return ()
+    return stat.st_size, stat.st_mtime_ns
+
+
+def verify_certificate(record: Dict, certs_dir: str, addresses: Dict[str, int],
+                       partitions: List[Partition] = ()) -> StagedCertificate:
+    """
+    Resolves a record's certificate bundle and checks it can be written.
+
+    Both binaries must exist under certs_dir, loose or in a certificate archive,
+    carry the file names the record lists (when it lists them), be non-empty and fit
+    the partition at their address. Archived binaries must also still match the
+    hash recorded when they were packed.
+
+    Args:
+        record (Dict): Claimed device record.
+        certs_dir (str): Root of the certificates tree.
+        addresses (Dict[str, int]): Flash address of 'secure_cert' and 'data_provider'.
+        partitions (List[Partition]): The S3's partition table, if known.
+
+    Raises:
+        CertificateError: If the bundle is missing, does not fit or an archived
+            binary does not match its recorded hash.
+        ArchiveError: If an archive under certs_dir cannot be read.
+        OSError: If a binary cannot be read.
+    """
+    cert_uuid = certificate_uuid(record)
+    if not cert_uuid:
+        raise CertificateError("record names no certificate")
+    cert = get_artifact_index().certificate(cert_uuid, certs_dir)
+    expected = {
+        'secure_cert': record.get('esp_secure_cert_partition') or '',
+        'data_provider': record.get('commissionable_data_provider_partition') or '',
+    }
+
+    regions, digests = [], {}
+    for label, address in addresses.items():
+        source = cert.get(label)
+        if source is None:
+            raise CertificateError(f"{label} of {cert_uuid} not found in {certs_dir}")
+        if expected[label] and source_name(source) != os.path.basename(expected[label]):
+            raise CertificateError(f"{label} is {source_name(source)}, the record lists {expected[label]}")
+        size = source_size(source)
+        if size == 0:
+            raise CertificateError(f"{source} is empty")
+        partition = next((partition for partition in partitions if partition.offset <= address < partition.end), None)
+        if partition is not None and address + size > partition.end:
+            raise CertificateError(f"{source} ({size} bytes) does not fit partition {partition.name} at 0x{address:x}")
+        regions.append((label, address, source))
+        try:
+            digests[label] = source_digest(source)
+        except ArchiveError as e:
+            raise CertificateError(str(e)) from None
+    if len(set(digests.values())) < len(digests):
+        raise CertificateError(f"the binaries of {cert_uuid} are identical")
+    return StagedCertificate(record, cert_uuid, regions, digests)
+
+
+class CertificatePrefetcher:
+    """
+    Keeps a station's next units ready to flash while the current one is busy.
+
+    Staging a unit claims the next free record of the order, resolves and checks its
+    certificate bundle (see verify_certificate) and reserves the certificate in the
+    ledger, all on a background thread. take() hands out a staged unit and starts
+    staging the following one, so the certificate lookup and checks are off the
+    unit's critical path. A record whose bundle fails the checks is rejected in the
+    device store and the next one is tried. Errors that are not the record's own,
+    such as an unreadable certificates directory, return the record to the pool and
+    raise StagingError, as do MAX_CONSECUTIVE_REJECTS rejections in a row.
+
+    Args:
+        store (DeviceStore): Device records.
+        order_no (str): Order the records are claimed from.
+        station (str): Station the records are claimed for.
+        utils (Utils): Station settings: certificate directory and partition addresses.
+        ledger (CertificateLedger, optional): Certificate reservations.
+        depth (int): Units kept staged ahead of the current one.
+    """
+
+    def __init__(self, store: DeviceStore, order_no: str, station: str, utils: Utils,
+                 ledger: CertificateLedger = None, depth: int = 1):
+        self.store = store
+        self.order_no = order_no
+        self.station = station
+        self.utils = utils
+        self.ledger = ledger or CertificateLedger()
+        self.depth = depth
+        self._ready: deque = deque()
+        self._condition = threading.Condition()
+        self._staging = False
+        self._exhausted = False
+        self._closed = False
+
+    def take(self) -> Optional[StagedCertificate]:
+        """
+        Returns the next staged unit, staging it now if none is ready.
+
+        Returns:
+            Optional[StagedCertificate]: None once the order has no usable records left.
+
+        Raises:
+            StagingError: If the station's certificates cannot be read.
+        """
+        with self._condition:
+            while self._staging and not self._ready:
+                self._condition.wait()
+            staged = self._ready.popleft() if self._ready else None
+        while staged is not None and not staged.unchanged():
+            # The bundle changed on disk after it was checked; check it again
+            print(f"Prefetch: certificate bundle of {staged.serial_id} changed since it was staged, checking it again.")
+            staged = self._restage(staged)
+        if staged is None:
+            staged = self._stage()
+        self.prefetch()
+        return staged
+
+    def prefetch(self) -> None:
+        """Starts staging in the background until depth units are ready."""
+        with self._condition:
+            if self._staging or self._exhausted or self._closed or len(self._ready) >= self.depth:
+                return
+            self._staging = True
+        threading.Thread(target=self._fill, name=f'prefetch-{self.station}', daemon=True).start()
+
+    def close(self) -> None:
+        """Returns the records staged but not taken to the pool."""
+        with self._condition:
+            self._closed = True
+            while self._staging:
+                self._condition.wait()
+            staged, self._ready = list(self._ready), deque()
+        for unit in staged:
+            self.release(unit)
+
+    def release(self, staged: StagedCertificate) -> None:
+        """Returns a staged record whose certificate was never written to the pool, with its reservation."""
+        self.store.release(staged.serial_id)
+        self.ledger.release(staged.cert_uuid, staged.serial_id)
+
+    def _fill(self) -> None:
+        try:
+            while True:
+                with self._condition:
+                    if self._closed or len(self._ready) >= self.depth:
+                        break
+                staged = self._stage()
+                if staged is None:
+                    break
+                with self._condition:
+                    self._ready.append(staged)
+                    self._condition.notify_all()
+        except Exception as e:
+            print(f"Prefetch: staging for station {self.station} failed: {e}")
+        finally:
+            with self._condition:
+                self._staging = False
+                self._condition.notify_all()
+
+    def _stage(self) -> Optional[StagedCertificate]:
+        """Claims records until one has a usable certificate; None when the order is exhausted."""
+        rejected = 0
+        while True:
+            record = self.store.claim_next(self.order_no, self.station)
+            if record is None:
+                with self._condition:
+                    self._exhausted = True
+                return None
+            try:
+                staged = self._check(record)
+            except CertificateError as e:
+                rejected += 1
+                if rejected >= MAX_CONSECUTIVE_REJECTS:
+                    raise StagingError(f"{rejected} records in a row have unusable certificates, the last: {e}") from None
+                continue
+            with self._condition:
+                self._exhausted = False
+            return staged
+
+    def _restage(self, staged: StagedCertificate) -> Optional[StagedCertificate]:
+        try:
+            return self._check(staged.record)
+        except CertificateError:
+            return self._stage()
+
+    def _check(self, record: Dict) -> StagedCertificate:
+        """
+        Checks and reserves a claimed record's certificate.
+
+        Raises:
+            CertificateError: The record's bundle is unusable; the record was rejected.
+            StagingError: The station's certificates cannot be read; the record was released.
+        """
+        utils, serial_id = self.utils, record['serial_id']
+        certs_dir = utils.filepath_certificatesS3 or os.path.join(ROOT, 'certificates')
+        addresses = {
+            'secure_cert': int(utils.address_dac_secure_cert_partition, 0),
+            'data_provider': int(utils.address_dac_data_provider_partition, 0),
+        }
+        try:
+            if not os.path.isdir(certs_dir):
+                raise OSError(f"certificates directory {certs_dir} does not exist")
+            partition_table = get_artifact_index().firmware_images(utils.filepath_firmwareS3, 'rc')['partition-table']
+            partitions = read_partition_table(partition_table) if partition_table else []
+            staged = verify_certificate(record, certs_dir, addresses, partitions)
+        except CertificateError as e:
+            print(f"Prefetch: rejecting {serial_id}: {e}")
+            self.store.reject(serial_id)
+            raise
+        except (ArchiveError, OSError) as e:
+            # Not the record's fault; it goes back to the pool for when the station is fixed
+            self.store.release(serial_id)
+            raise StagingError(f"Certificates of station {self.station} cannot be read: {e}") from None
+
+        # Reserve the DAC now, so it can never be issued to another serial id
+        if not self.ledger.reserve(staged.cert_uuid, staged.serial_id, station=self.station):
+            entry = self.ledger.entry(staged.cert_uuid)
+            print(f"Prefetch: rejecting {serial_id}: certificate {staged.cert_uuid} was already issued "
+                  f"({entry['status']} for {entry['serial_id']})")
+            self.store.reject(serial_id)
+            raise CertificateError(f"certificate {staged.cert_uuid} was already issued")
+        print(f"Prefetch: {serial_id} staged with certificate {staged.cert_uuid}")
+        return staged
@@ -0,0 +1,297 @@
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from components.portmonitor.monitor import UsbSelector
+from components.utils.utils import Utils, get_utils
+
+
+class StationState:
+    """States a station moves through during a scheduler run."""
+    IDLE = 'idle'
+    QUEUED = 'queued'
+    FLASHING = 'flashing'
+    REBOOTING = 'rebooting'
+    TESTING = 'testing'
+    PASSED = 'passed'
+    FAILED = 'failed'
+
+
+class Station:
+    """
+    A single fixture (jig) on the line.
+
+    Each fixture wires one ESP32-S3 flash port, one ESP32-H2 flash port and one
+    ESP32-S3 factory port. Baud rates default to the global values from config.ini,
+    and utils carries the settings the station's jobs run with.
+    A port with a USB selector is found by its adapter's identity; its port name is
+    then only the last place it was seen.
+    """
+
+    def __init__(self, name: str, s3_port: str, h2_port: str, factory_port: str,
+                 s3_baud: str = '', h2_baud: str = '', factory_baud: str = '',
+                 s3_usb: str = '', h2_usb: str = '', factory_usb: str = '', auto_start: bool = False,
+                 utils: Utils = None):
+        self.name = name
+        self.s3_port = s3_port
+        self.h2_port = h2_port
+        self.factory_port = factory_port
+        self.s3_baud = s3_baud
+        self.h2_baud = h2_baud
+        self.factory_baud = factory_baud
+        self.s3_usb = UsbSelector(s3_usb) if s3_usb.strip() else None
+        self.h2_usb = UsbSelector(h2_usb) if h2_usb.strip() else None
+        self.factory_usb = UsbSelector(factory_usb) if factory_usb.strip() else None
+        self.auto_start = auto_start
+        # Settings with this station's overrides; None uses the scheduler's
+        self.utils = utils
+
+    def __repr__(self):
+        return f"Station({self.name!r}, s3={self.s3_port}, h2={self.h2_port}, factory={self.factory_port})"
+
+
+def load_stations(config_file: str = 'config.ini', utils: Utils = None) -> List[Station]:
+    """
+    Builds the fixtures defined by the [station_*] sections of the config file.
+
+    A station section can override any setting of the file, e.g. an H2 baud rate or
+    a firmware path, besides its ports; settings it does not list are the file's
+    own. When no station sections are present, a single station is built from the
+    global flash and factory ports so existing single-fixture setups keep working.
+
+    Args:
+        config_file (str): Path to the configuration file.
+        utils (Utils, optional): Already loaded Utils instance; its validated
+            settings are reused instead of reading the file again.
+
+    Returns:
+        List[Station]: The configured stations, in file order.
+
+    Raises:
+        ConfigError: The file, or one of its station sections, has invalid values.
+    """
+    if utils is None:
+        utils = get_utils(config_file)
+
+    stations = [_station(name, utils.for_station(name)) for name in utils.settings.stations]
+    if not stations:
+        stations.append(default_station(utils))
+    return stations
+
+
+def default_station(utils: Utils) -> Station:
+    """Builds the single-fixture station from the global flash and factory ports."""
+    return _station('default', utils)
+
+
+def _station(name: str, utils: Utils) -> Station:
+    return Station(
+        name,
+        utils.port_flashS3,
+        utils.port_flashH2,
+        utils.port_factoryS3,
+        utils.baud_flashS3,
+        utils.baud_flashH2,
+        utils.baud_factoryS3,
+        utils.usb_flashS3,
+        utils.usb_flashH2,
+        utils.usb_factoryS3,
+        utils.station_auto_start,
+        utils=utils,
+    )
+
+
+class _StationRun:
+    """Per-station bookkeeping for one scheduler run."""
+
+    def __init__(self, station: Station):
+        self.station = station
+        self.state = StationState.IDLE
+        self.unit = None
+        self.messages = []
+
+
+class StationScheduler:
+    """
+    Runs one unit on each of many stations concurrently.
+
+    Every station's unit is a task graph (see UnitPipeline): its MAC reads, S3 and
+    H2 flashes, reboot and factory steps run on one bounded worker pool shared by
+    all stations, so the number of esptool processes running at once never exceeds
+    max_workers, and a station waiting on one port never holds a worker another
+    station could use. Stations can also be started one at a time with
+    start_station, e.g. when the port monitor sees a jig's boards plugged in.
+    Progress is reported through two callbacks, which are invoked from worker threads:
+
+        on_state_changed(station_name, state)
+        on_progress(finished_stations, total_stations)
+
+    Args:
+        stations (List[Station]): Fixtures to run.
+        utils (Utils, optional): Loaded configuration; defaults to config.ini.
+        order_no (str): Order every station claims its unit's record from.
+        factory (bool): Runs the factory sequence after flashing.
+        max_workers (int, optional): Tasks running at once; defaults to two per station.
+    """
+
+    ACTIVE_STATES = (StationState.QUEUED, StationState.FLASHING, StationState.REBOOTING, StationState.TESTING)
+
+    def __init__(self, stations: List[Station], utils: Utils = None, order_no: str = '', factory: bool = True,
+                 max_workers: int = None,
+                 on_state_changed: Optional[Callable[[str, str], None]] = None,
+                 on_progress: Optional[Callable[[int, int], None]] = None):
+        self.utils = utils or get_utils()
+        self.stations = list(stations)
+        self.order_no = order_no
+        self.factory = factory
+        self.max_workers = max_workers or max(1, 2 * len(self.stations))
+        self.on_state_changed = on_state_changed
+        self.on_progress = on_progress
+
+        self._lock = threading.Lock()
+        self._runs: Dict[str, _StationRun] = {}
+        # One pipeline per station, so its next record is staged while the current unit runs
+        self._pipelines = {}
+        self._executor = None
+        self._done = threading.Event()
+
+    def start(self) -> None:
+        """Starts every station's unit on the worker pool and returns immediately."""
+        if self._executor is not None:
+            raise RuntimeError("Scheduler is already running.")
+
+        self._runs = {}
+        self._done.clear()
+        if not self.stations:
+            self._done.set()
+            return
+
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='station')
+        for station in self.stations:
+            self._submit(station)
+
+    def start_station(self, name: str) -> bool:
+        """
+        Starts one station's unit, starting the worker pool if it is idle.
+
+        Args:
+            name (str): Station name.
+
+        Returns:
+            bool: False if the station is still busy with a previous run.
+        """
+        station = next((station for station in self.stations if station.name == name), None)
+        if station is None:
+            raise KeyError(f"Unknown station {name}")
+        with self._lock:
+            run = self._runs.get(name)
+            if run is not None and run.state in self.ACTIVE_STATES:
+                return False
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='station')
+            self._done.clear()
+        self._submit(station)
+        return True
+
+    def _submit(self, station: Station) -> None:
+        from components.station.pipeline import UnitPipeline
+
+        run = _StationRun(station)
+        with self._lock:
+            self._runs[station.name] = run
+            executor = self._executor
+            pipeline = self._pipelines.get(station.name)
+            if pipeline is None:
+                pipeline = self._pipelines[station.name] = UnitPipeline(
+                    station, self.utils, self.order_no, factory=self.factory, on_stage=self._stage_finished)
+        self._set_state(run, StationState.QUEUED)
+        try:
+            run.unit = pipeline.start(executor, on_finished=lambda result: self._finish(run, result))
+        except Exception as e:
+            print(f"Station {station.name}: unit could not be started: {e}")
+            self._finish(run, None)
+
+    def wait(self, timeout: float = None) -> bool:
+        """
+        Blocks until every station has finished.
+
+        Returns:
+            bool: True if all stations finished within the timeout.
+        """
+        finished = self._done.wait(timeout)
+        with self._lock:
+            executor = self._executor if finished and self._done.is_set() else None
+            if executor is not None:
+                self._executor = None
+        if executor is not None:
+            executor.shutdown(wait=True)
+        return finished
+
+    def run(self) -> Dict[str, str]:
+        """Runs all stations to completion and returns their final states."""
+        self.start()
+        self.wait()
+        self.close()
+        return self.snapshot()
+
+    def is_running(self) -> bool:
+        """Returns True while any station of the current run is still in progress."""
+        return self._executor is not None and not self._done.is_set()
+
+    def snapshot(self) -> Dict[str, str]:
+        """Returns the current state of every station, keyed by station name."""
+        with self._lock:
+            return {name: run.state for name, run in self._runs.items()}
+
+    def messages(self, station_name: str) -> List[tuple]:
+        """Returns the (title, message) pairs reported for a station's unit."""
+        with self._lock:
+            return list(self._runs[station_name].messages)
+
+    def _set_state(self, run: _StationRun, state: str) -> None:
+        with self._lock:
+            if run.state == state:
+                return
+            run.state = state
+        print(f"Station {run.station.name}: {state}")
+        if self.on_state_changed:
+            self.on_state_changed(run.station.name, state)
+
+    def close(self) -> None:
+        """Returns the records staged for the stations' next units to the pool."""
+        with self._lock:
+            pipelines, self._pipelines = list(self._pipelines.values()), {}
+        for pipeline in pipelines:
+            pipeline.close()
+
+    def _stage_finished(self, name: str, stage: str, success: bool) -> None:
+        # The S3 leg sets the pace: its record is flashed once claimed, then rebooted and tested
+        following = {'claim': StationState.FLASHING, 'flash_s3': StationState.REBOOTING}
+        if self.factory:
+            following['reboot'] = StationState.TESTING
+        if success and stage in following:
+            with self._lock:
+                run = self._runs[name]
+            self._set_state(run, following[stage])
+
+    def _finish(self, run: _StationRun, result) -> None:
+        passed = result is not None and result.success
+        with self._lock:
+            if result is None:
+                run.messages.append(("Error", "Unit could not be started."))
+            elif passed:
+                run.messages.append(("Success", f"Unit {result.serial_id} passed in {result.seconds:.1f}s."))
+            else:
+                run.messages.append(("Error", f"Unit {result.serial_id or '-'} failed: {result.detail}"))
+
+        self._set_state(run, StationState.PASSED if passed else StationState.FAILED)
+        if self.on_progress:
+            with self._lock:
+                finished = sum(1 for other in self._runs.values() if other.state not in self.ACTIVE_STATES)
+                total = len(self._runs)
+            self.on_progress(finished, total)
+        # A station started meanwhile keeps the scheduler running
+        with self._lock:
+            if all(other.state not in self.ACTIVE_STATES for other in self._runs.values()):
+                self._done.set()
@@ -1,14 +1,43 @@
-import subprocess
-import configparser
 import os
-import sqlite3
+import threading
 
-from typing import List
+from typing import TYPE_CHECKING, Dict, List
+
+from components.baudrate.profiles import DEFAULT_CALIBRATION_RATES
+from components.config.config import Settings, load_settings
+from components.metrics.metrics import Stage
+
+# The esptool runners, the device database and the artifact index are imported on
+# first use, so loading the configuration stays cheap at startup
+if TYPE_CHECKING:
+    from components.runner.process import CancelToken
+
+
+def _address(address) -> str:
+    """Formats a flash address from the settings as esptool is given it, '' if unset."""
+    return f'0x{address:X}' if address is not None else ''
 
 class Utils:
-    def __init__(self, config_file: str = 'config.ini'):
+    """
+    Settings read from config.ini, plus the esptool helpers that use them.
+
+    The file is validated against the settings model in components/config and a
+    ConfigError lists every problem in it. An instance is read-only once loaded; use
+    get_utils() to share the one already parsed instead of reading the file again.
+    """
+
+    def __init__(self, config_file: str = 'config.ini', settings: Settings = None):
         # Initialize instance variables with default values
         self.tool_path = ''
+        self.esptool_backend = 'subprocess'
+        self.baud_profile_file = 'baud_profiles.json'
+        self.calibration_rates = list(DEFAULT_CALIBRATION_RATES)
+        self.timeout_esptool_probe = 30.0
+        self.timeout_esptool_flash = 300.0
+        self.port_monitor_interval = 1.0
+        self.station_auto_start = False
+        self.metrics_file = 'metrics.prom'
+        self.metrics_http_port = 0
         self.order_file_path = ''
         self.filepath_firmwareS3 = ''
         self.filepath_certificatesS3 = ''
@@ -23,6 +52,9 @@ class Utils:
         # Flash firmware ports for ESP32-S3 and ESP32-H2
         self.port_flashS3 = ''
         self.port_flashH2 = ''
+        # USB adapter selectors (vid:pid[:serial][@location]) that find the ports by identity
+        self.usb_flashS3 = ''
+        self.usb_flashH2 = ''
         
         # Flash firmware baud rates for ESP32-S3 and ESP32-H2
         self.baud_flashS3 = ''
@@ -31,9 +63,23 @@ class Utils:
         # Flash Command
         self.command_flashS3 = ''
         self.command_flashH2 = ''
+        self.combined_flashS3 = False
+        self.differential_flashS3 = False
+        self.differential_flashH2 = False
         
         # Factory Command
         self.command_factory_password = ''
+        self.command_read_mac = ''
+        self.command_write_product_name = ''
+        self.command_read_product_name = ''
+        self.data_read_product_name = ''
+        self.command_write_serial_number = ''
+        self.command_read_serial_number = ''
+        self.command_write_matter_qr = ''
+        self.command_read_matter_qr = ''
+        self.command_save_device_data = ''
+        self.timeout_factory_command = '2.0'
+        self.retries_factory_command = '2'
         
         # Flash firmware addresses for ESP32-S3 and ESP32-H2
         self.address_bootloader_flashS3 = ''
@@ -51,59 +97,182 @@ class Utils:
         # Factory port and baud for ESP32-S3
         self.port_factoryS3 = ''
         self.baud_factoryS3 = ''
+        self.usb_factoryS3 = ''
+        self.read_timeout_factoryS3 = '0.5'
+        self.prompt_timeout_factoryS3 = '0'
+        
+        # Erase, esptool and DAC flags
+        self.enable_erase_flashS3 = False
+        self.enable_erase_flashH2 = False
+        self.command_erase_flashS3 = 'erase_flash'
+        self.command_erase_flashH2 = 'erase_flash'
+        self.use_esptool_flashS3 = False
+        self.use_esptool_flashH2 = False
+        self.use_esptool_dac = False
+        self.command_dac = 'write_flash'
         
         # Load configuration from the config file
-        self.config_reader(config_file)
+        self.config_file = config_file
+        self.config = None
+        self.settings = None
+        self._stations = {}
+        self.config_reader(config_file, settings)
+        self._frozen = True
+
+    def __setattr__(self, name, value):
+        if getattr(self, '_frozen', False):
+            raise AttributeError(f"Configuration is read-only, cannot set {name}")
+        super().__setattr__(name, value)
 
-    def config_reader(self, config_file: str) -> None:
+    def config_reader(self, config_file: str, settings: Settings = None) -> None:
         """
-        Reads configuration values from a config.ini file and stores them in instance variables.
-        
+        Reads and validates config.ini and stores its values in instance variables.
+
+        Addresses are kept as the hex strings esptool is given and bauds as strings;
+        the typed values are available as self.settings.
+
         Args:
             config_file (str): Path to the configuration file.
+            settings (Settings, optional): Already validated settings to use instead.
+
+        Raises:
+            ConfigError: The file is missing or has invalid values.
         """
-        config = configparser.ConfigParser()
-        config.read(config_file)
-        
-        # Read values from the config file and store them in instance variables
-        self.tool_path = config['DEFAULT'].get('tool_path', self.tool_path)
-        self.order_file_path = config['DEFAULT'].get('order_file_path', self.order_file_path)
-        
-        self.command_flashS3 = config['flash_firmware_esp32s3'].get('flash_firmware_esp32s3_command', self.command_flashS3)
-        self.command_flashH2 = config['flash_firmware_esp32h2'].get('flash_firmware_esp32h2_command', self.command_flashH2)
-        
-        self.address_start_erase_flashS3 = config['erase_flash_esp32s3'].get('erase_flash_esp32s3_start_address', self.address_start_erase_flashS3)
-        self.address_end_erase_flashS3 = config['erase_flash_esp32s3'].get('erase_flash_esp32s3_end_address', self.address_end_erase_flashS3)
-        
-        self.address_start_erase_flashH2 = config['erase_flash_esp32h2'].get('erase_flash_esp32h2_start_address', self.address_start_erase_flashS3)
-        self.address_end_erase_flashH2 = config['erase_flash_esp32h2'].get('erase_flash_esp32h2_end_address', self.address_end_erase_flashS3)    
-    
-        self.port_flashS3 = config['flash_firmware_esp32s3'].get('flash_firmware_esp32s3_port', self.port_flashS3)
-        self.port_flashH2 = config['flash_firmware_esp32h2'].get('flash_firmware_esp32h2_port', self.port_flashH2)
-        
-        self.baud_flashS3 = config['flash_firmware_esp32s3'].get('flash_firmware_esp32s3_baud', self.baud_flashS3)
-        self.baud_flashH2 = config['flash_firmware_esp32h2'].get('flash_firmware_esp32h2_baud', self.baud_flashH2)
-        
-        self.filepath_firmwareS3 = config['flash_firmware_esp32s3'].get('flash_firmware_esp32s3_filepath', self.filepath_firmwareS3)
-        self.address_bootloader_flashS3 = config['flash_firmware_esp32s3'].get('flash_firmware_esp32s3_bootloader_address', self.address_bootloader_flashS3)
-        self.address_partition_table_flashS3 = config['flash_firmware_esp32s3'].get('flash_firmware_esp32s3_partition_table_address', self.address_partition_table_flashS3)
-        self.address_ota_data_initial_flashS3 = config['flash_firmware_esp32s3'].get('flash_firmware_esp32s3_ota_data_initial_address', self.address_ota_data_initial_flashS3)
-        self.address_firmware_flashS3 = config['flash_firmware_esp32s3'].get('flash_firmware_esp32s3_address', self.address_firmware_flashS3)
-        
-        self.filepath_firmwareH2 = config['flash_firmware_esp32h2'].get('flash_firmware_esp32h2_filepath', self.filepath_firmwareH2)
-        self.address_bootloader_flashH2 = config['flash_firmware_esp32h2'].get('flash_firmware_esp32h2_bootloader_address', self.address_bootloader_flashH2)
-        self.address_partition_table_flashH2 = config['flash_firmware_esp32h2'].get('flash_firmware_esp32h2_partition_table_address', self.address_partition_table_flashH2)
-        self.address_firmware_flashH2 = config['flash_firmware_esp32h2'].get('flash_firmware_esp32h2_address', self.address_firmware_flashH2)
-        
-        self.filepath_certificatesS3 = config['flash_dac_esp32s3'].get('flash_cert_esp32s3_filepath', self.filepath_certificatesS3)
-        self.address_dac_secure_cert_partition = config['flash_dac_esp32s3'].get('flash_dac_esp32s3_secure_cert_partition', self.address_dac_secure_cert_partition)
-        self.address_dac_data_provider_partition = config['flash_dac_esp32s3'].get('flash_dac_esp32s3_data_provider_partition', self.address_dac_data_provider_partition)
-        
-        self.port_factoryS3 = config['factory_esp32s3'].get('factory_esp32s3_port', self.port_factoryS3)
-        self.baud_factoryS3 = config['factory_esp32s3'].get('factory_esp32s3_baud', self.baud_factoryS3)
-        
-        self.command_factory_password = config['factory_esp32s3'].get('factory_esp32s3_password', self.command_factory_password)
+        settings = settings or load_settings(config_file)
+        self.settings = settings
+        # Kept so sections the model does not cover are read without parsing the file again
+        self.config = settings.parser
+
+        general = settings.general
+        self.tool_path = general.tool_path
+        self.esptool_backend = general.esptool_backend
+        self.baud_profile_file = general.baud_profile_file
+        if general.baud_calibration_rates:
+            self.calibration_rates = list(general.baud_calibration_rates)
+        self.timeout_esptool_probe = general.esptool_probe_timeout
+        self.timeout_esptool_flash = general.esptool_flash_timeout
+        self.port_monitor_interval = general.port_monitor_interval
+        self.station_auto_start = general.station_auto_start
+        self.metrics_file = general.metrics_file
+        self.metrics_http_port = general.metrics_http_port
+        self.order_file_path = general.order_file_path
+
+        for suffix, erase in (('S3', settings.erase_s3), ('H2', settings.erase_h2)):
+            setattr(self, f'enable_erase_flash{suffix}', erase.enable)
+            setattr(self, f'command_erase_flash{suffix}', erase.command)
+            setattr(self, f'address_start_erase_flash{suffix}', _address(erase.start_address))
+            setattr(self, f'address_end_erase_flash{suffix}', _address(erase.end_address))
+
+        for suffix, flash in (('S3', settings.flash_s3), ('H2', settings.flash_h2)):
+            setattr(self, f'filepath_firmware{suffix}', flash.filepath)
+            setattr(self, f'port_flash{suffix}', flash.port)
+            setattr(self, f'usb_flash{suffix}', flash.usb)
+            setattr(self, f'baud_flash{suffix}', str(flash.baud))
+            setattr(self, f'command_flash{suffix}', flash.command)
+            setattr(self, f'use_esptool_flash{suffix}', flash.use_esptool)
+            setattr(self, f'differential_flash{suffix}', flash.differential)
+            setattr(self, f'address_bootloader_flash{suffix}', _address(flash.bootloader_address))
+            setattr(self, f'address_partition_table_flash{suffix}', _address(flash.partition_table_address))
+            setattr(self, f'address_firmware_flash{suffix}', _address(flash.firmware_address))
+        self.combined_flashS3 = settings.flash_s3.combined
+        self.address_ota_data_initial_flashS3 = _address(settings.flash_s3.ota_data_initial_address)
+
+        dac = settings.dac
+        self.filepath_certificatesS3 = dac.filepath
+        self.command_dac = dac.command
+        self.use_esptool_dac = dac.use_esptool
+        self.address_dac_secure_cert_partition = _address(dac.secure_cert_partition)
+        self.address_dac_data_provider_partition = _address(dac.data_provider_partition)
+
+        factory = settings.factory
+        self.port_factoryS3 = factory.port
+        self.baud_factoryS3 = str(factory.baud)
+        self.usb_factoryS3 = factory.usb
+        self.read_timeout_factoryS3 = factory.read_timeout
+        self.prompt_timeout_factoryS3 = factory.prompt_timeout
+        self.command_factory_password = factory.password
+        self.timeout_factory_command = factory.command_timeout
+        self.retries_factory_command = factory.command_retries
+
+        commands = settings.factory_commands
+        self.command_read_mac = commands['read_mac']
+        self.command_write_product_name = commands['write_product_name']
+        self.command_read_product_name = commands['read_product_name']
+        self.data_read_product_name = settings.product_name
+        self.command_write_serial_number = commands['write_serial_number']
+        self.command_read_serial_number = commands['read_serial_number']
+        self.command_write_matter_qr = commands['write_matter_qr']
+        self.command_read_matter_qr = commands['read_matter_qr']
+        self.command_save_device_data = commands['save_device_data']
+
+    def for_station(self, name: str) -> 'Utils':
+        """
+        Returns the settings a station runs with: these, with its [station_<name>] overrides.
+
+        Stations without overrides share this instance.
+        """
+        settings = self.settings.station(name)
+        if settings is self.settings:
+            return self
+        if name not in self._stations:
+            self._stations[name] = Utils(self.config_file, settings)
+        return self._stations[name]
+
+    def factory_commands(self) -> dict:
+        """
+        Returns the factory test commands keyed by step name.
+
+        Returns:
+            dict: Command strings for FactorySequence.
+        """
+        return {
+            'read_mac': self.command_read_mac,
+            'write_product_name': self.command_write_product_name,
+            'read_product_name': self.command_read_product_name,
+            'write_serial_number': self.command_write_serial_number,
+            'read_serial_number': self.command_read_serial_number,
+            'write_matter_qr': self.command_write_matter_qr,
+            'read_matter_qr': self.command_read_matter_qr,
+            'save_device_data': self.command_save_device_data,
+        }
         
+    def get_esptool_backend(self):
+        """
+        Returns the esptool backend selected by esptool_backend in config.ini.
+
+        Returns:
+            SubprocessBackend or LibraryBackend: Shared by every Utils instance.
+        """
+        from components.runner.backend import get_esptool_backend
+
+        return get_esptool_backend(self.esptool_backend, self.tool_path)
+
+    def get_metrics(self):
+        """
+        Returns the stage timing recorder, exporting to metrics_file from config.ini.
+
+        Returns:
+            Metrics: Shared by every Utils instance.
+        """
+        from components.metrics.metrics import get_metrics
+
+        return get_metrics(export_path=self.metrics_file)
+
+    def flash_baud(self, port: str, baud) -> str:
+        """
+        Returns the baud rate to flash a port at.
+
+        Args:
+            port (str): Flash port.
+            baud: Baud rate from config.ini.
+
+        Returns:
+            str: The rate calibrated for the port's adapter, or the configured one.
+        """
+        from components.baudrate.profiles import get_baud_profiles
+
+        return get_baud_profiles(self.baud_profile_file).baud_for(port, baud)
+
     def check_functionality(self) -> bool:
         """
         Check if esptool is functioning correctly.
@@ -111,178 +280,188 @@ class Utils:
         Returns:
             bool: True if esptool is working, False otherwise.
         """
-        try:
-            # Attempt to run esptool with no arguments to check if it's available
-            result = subprocess.run([self.tool_path], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        from components.runner.process import ExitStatus, run_process
 
-            # Check if esptool provides a help message (i.e., no unrecognized argument errors)
-            if "usage:" in result.stdout or "usage:" in result.stderr:
-                print("esptool is functioning correctly.")
-                return True
-            else:
-                print("esptool encountered an error:", result.stderr.strip())
-                return False
+        if self.get_esptool_backend().in_process:
+            print("esptool is running in-process.")
+            return True
 
-        except FileNotFoundError:
+        # Attempt to run esptool with no arguments to check if it's available
+        result = run_process([self.tool_path], timeout=self.timeout_esptool_probe)
+
+        if result.status == ExitStatus.NOT_FOUND:
             print("esptool is not installed or not found in the system PATH.")
             return False
-        except Exception as e:
-            print(f"An error occurred while checking esptool: {e}")
+        if result.status == ExitStatus.TIMEOUT:
+            print("esptool did not respond in time.")
             return False
 
+        # Check if esptool provides a help message (i.e., no unrecognized argument errors)
+        if "usage:" in result.stdout or "usage:" in result.stderr:
+            print("esptool is functioning correctly.")
+            return True
+        print("esptool encountered an error:", result.stderr.strip())
+        return False
+
     def read_order(self, file_path: str = None) -> List[str]:
         """
         Read the order from the given file or from the config file if not provided.
 
+        Served from the shared order index, so only lines appended since the last
+        call are parsed.
+
         Args:
             file_path (str, optional): Path to the file containing order numbers.
 
         Returns:
             List[str]: A list of unique order numbers found in the file.
         """
+        from components.devicedata.orders import get_order_index
+
         if file_path is None:
             file_path = self.order_file_path
-
-        order_numbers = []
-        try:
-            with open(file_path, 'r') as file:
-                for line in file:
-                    if 'order-no' in line:
-                        order_number = line.split('order-no: ')[1].split(',')[0].strip()
-                        if order_number not in order_numbers:
-                            order_numbers.append(order_number)
-        except FileNotFoundError:
-            print(f"File not found: {file_path}")
-        except Exception as e:
-            print(f"An error occurred while reading the file: {e}")
-        
-        return order_numbers
+        return get_order_index(file_path).orders()
 
     def find_bin_path(self, keyword, search_directory):
-        for root, dirs, files in os.walk(search_directory):
-            for file in files:
-                if file.endswith(".bin") and keyword in file:
-                    return os.path.join(root, file)
-        return None
+        """
+        Find the first .bin file under search_directory whose name contains keyword.
+
+        Lookups are served from the shared artifact index, so the directory is only
+        walked the first time it is searched and again when its contents change.
+        """
+        from components.artifacts.artifacts import get_artifact_index
+
+        return get_artifact_index().find(keyword, search_directory)
     
     def process_device_data(self, device_data_file: str, db_name: str = 'device_data.db') -> None:
         """
         Processes the device data from a file and stores it into an SQLite database.
-        
+
+        Records are upserted on serial_id, so loading the same file again updates the
+        existing rows instead of duplicating them.
+
         Args:
             device_data_file (str): Path to the file containing device data.
             db_name (str, optional): Name of the SQLite database file. Defaults to 'device_data.db'.
         """
-        # Connect to the SQLite database (or create it if it doesn't exist)
-        conn = sqlite3.connect(db_name)
-        cursor = conn.cursor()
-
-        # Create the table if it doesn't exist
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS devices (
-                order_no TEXT,
-                mac_address TEXT,
-                serial_id TEXT,
-                cert_id TEXT,
-                esp_secure_cert_partition TEXT,
-                commissionable_data_provider_partition TEXT,
-                qrcode TEXT,
-                manualcode TEXT,
-                discriminator INTEGER,
-                passcode INTEGER
-            )
-        ''')
-
-        # Read and parse the device data file
-        try:
-            with open(device_data_file, 'r') as file:
-                for line in file:
-                    if 'order-no' in line:
-                        # Parse each field from the line
-                        order_no = line.split('order-no: ')[1].split(',')[0].strip()
-                        mac_address = line.split('mac-address: ')[1].split(',')[0].strip()
-                        serial_id = line.split('serial-id: ')[1].split(',')[0].strip()
-                        cert_id = line.split('cert-id: ')[1].split(',')[0].strip()
-                        esp_secure_cert_partition = line.split('esp-secure-cert-partition: ')[1].split(',')[0].strip()
-                        commissionable_data_provider_partition = line.split('commissionable-data-provider-partition: ')[1].split(',')[0].strip()
-                        qrcode = line.split('qrcode: ')[1].split(',')[0].strip()
-                        manualcode = line.split('manualcode: ')[1].split(',')[0].strip()
-                        discriminator = int(line.split('discriminator: ')[1].split(',')[0].strip())
-                        passcode = int(line.split('passcode: ')[1].strip())
-
-                        # Insert the data into the database
-                        cursor.execute('''
-                            INSERT INTO devices (order_no, mac_address, serial_id, cert_id, esp_secure_cert_partition,
-                                                commissionable_data_provider_partition, qrcode, manualcode, discriminator, passcode)
-                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                        ''', (order_no, mac_address, serial_id, cert_id, esp_secure_cert_partition,
-                                commissionable_data_provider_partition, qrcode, manualcode, discriminator, passcode))
+        from components.devicedata.importer import DeviceDataImporter
 
+        try:
+            result = DeviceDataImporter(db_name).import_file(device_data_file)
+            print(f"Device data processing complete and stored in the database: {result}")
         except FileNotFoundError:
             print(f"File not found: {device_data_file}")
         except Exception as e:
             print(f"An error occurred while processing the device data: {e}")
-        finally:
-            # Commit the changes and close the database connection
-            conn.commit()
-            conn.close()
-            print("Device data processing complete and stored in the database.")
-                        
-    def esptool_read_mac(self, port: str, baud: int) -> str:
+
+    async def esptool_read_mac_async(self, port: str, baud: int, cancel_token: 'CancelToken' = None) -> str:
         """
-        Read the MAC address of the ESP32 device using esptool.
-        
+        Read the MAC address of the ESP32 device using esptool, without blocking the caller's event loop.
+
         Args:
             port (str): Port where the ESP32 device is connected.
             baud (int): Baud rate for the serial communication.
-        
+            cancel_token (CancelToken, optional): Cancels the read.
+
         Returns:
-            str: MAC address of the ESP32 device.
+            str: MAC address of the ESP32 device, or None if it could not be read.
         """
-        try:
-            # Run esptool to read the MAC address
-            result = subprocess.run(
-                [self.tool_path, '--port', port, '--baud', str(baud), 'read_mac'],
-                stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
-            )
+        baud = self.flash_baud(port, baud)
+        # Recorded under the MAC address once it is known
+        with self.get_metrics().stage(port, Stage.READ_MAC, port) as timer:
+            result = await self.get_esptool_backend().read_mac_async(port, baud, timeout=self.timeout_esptool_probe,
+                                                                      cancel_token=cancel_token)
+            if not result.ok:
+                print(f"Reading the MAC address on {port} failed: {result.status} {result.reason} {result.stderr.strip()}")
+                timer.detail = result.status
+                return None
 
             # Extract the MAC address from the output
             for line in result.stdout.splitlines():
                 if "MAC:" in line:
                     mac_address = line.split('MAC: ')[1].strip()
                     print(f"MAC address: {mac_address}")
+                    timer.unit, timer.success = mac_address, True
                     return mac_address
 
             # If MAC address is not found in the output
             print("MAC address not found in the output.")
+            timer.detail = 'no MAC in output'
             return None
 
-        except Exception as e:
-            print(f"An error occurred while reading the MAC address: {e}")
-            return None
-    
-    def esptool_reboot(self, port: str, baud: int) -> None:
+    def esptool_read_mac(self, port: str, baud: int) -> str:
         """
-        Reboot the ESP32 device using esptool.
+        Read the MAC address of the ESP32 device using esptool.
         
         Args:
             port (str): Port where the ESP32 device is connected.
             baud (int): Baud rate for the serial communication.
+        
+        Returns:
+            str: MAC address of the ESP32 device.
         """
-        try:
-            # Run esptool to reboot the device
-            result = subprocess.run(
-                [self.tool_path, '--port', port, '--baud', str(baud), 'run'],
-                stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
-            )
+        import asyncio
+
+        return asyncio.run(self.esptool_read_mac_async(port, baud))
+
+    async def esptool_reboot_async(self, port: str, baud: int, cancel_token: 'CancelToken' = None, unit: str = '') -> bool:
+        """
+        Reboot the ESP32 device using esptool, without blocking the caller's event loop.
+
+        Args:
+            port (str): Port where the ESP32 device is connected.
+            baud (int): Baud rate for the serial communication.
+            cancel_token (CancelToken, optional): Cancels the reboot.
+            unit (str, optional): Serial id the reboot is timed under; defaults to the port.
 
+        Returns:
+            bool: True if esptool reported the hard reset.
+        """
+        baud = self.flash_baud(port, baud)
+        with self.get_metrics().stage(unit, Stage.REBOOT, port) as timer:
+            result = await self.get_esptool_backend().reset_async(port, baud, timeout=self.timeout_esptool_probe,
+                                                                   cancel_token=cancel_token)
             print(f"Command output: {result.stdout.strip()}")
-            
+
             # Check if the device is successfully rebooted
-            if "Hard resetting via RTS pin..." in result.stdout:
+            timer.success = result.ok and "Hard resetting via RTS pin..." in result.stdout
+            if timer.success:
                 print("Device rebooted successfully.")
-            else:
-                print("Device reboot failed.")
-                
-        except Exception as e:
-            print(f"An error occurred while rebooting the device: {e}")
+                return True
+            print(f"Device reboot failed: {result.status} {result.reason}")
+            timer.detail = result.reason or result.status
+            return False
+
+    def esptool_reboot(self, port: str, baud: int, unit: str = '') -> bool:
+        """
+        Reboot the ESP32 device using esptool.
+        
+        Args:
+            port (str): Port where the ESP32 device is connected.
+            baud (int): Baud rate for the serial communication.
+            unit (str, optional): Serial id the reboot is timed under; defaults to the port.
+        """
+        import asyncio
+
+        return asyncio.run(self.esptool_reboot_async(port, baud, unit=unit))
+
+
+_utils: Dict[str, Utils] = {}
+_utils_lock = threading.Lock()
+
+
+def get_utils(config_file: str = 'config.ini') -> Utils:
+    """
+    Returns the process-wide settings of a config file.
+
+    The file is parsed the first time it is asked for; every later caller shares
+    the same read-only instance.
+
+    Args:
+        config_file (str): Path to the configuration file.
+    """
+    key = os.path.abspath(config_file)
+    with _utils_lock:
+        if key not in _utils:
+            _utils[key] = Utils(config_file)
+        return _utils[key]
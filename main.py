@@ -1,13 +1,32 @@
 import sys
 import logging
-from PyQt6.QtWidgets import QApplication
-from components.gui.gui import SerialPortSelector
+
+from components.cli.cli import COMMANDS
 
 def main():
+    # Headless commands never import Qt, which keeps them fast on the line PCs
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        from components.cli.cli import main as cli_main
+        sys.exit(cli_main(sys.argv[1:]))
+
+    from PyQt6.QtWidgets import QApplication, QMessageBox
+    from components.config.config import ConfigError
+    from components.utils.utils import get_utils
+
     app = QApplication(sys.argv)
+    # Refuse to start on a bad config.ini rather than fail in the middle of a flash
+    try:
+        get_utils()
+    except ConfigError as e:
+        print(e, file=sys.stderr)
+        QMessageBox.critical(None, "Configuration Error", str(e))
+        sys.exit(2)
+
+    from components.gui.gui import SerialPortSelector
+
     window = SerialPortSelector()
     window.show()
-    
+
     logging.basicConfig(
         level=logging.INFO,
         format='%(asctime)s - %(levelname)s - %(funcName)s - %(message)s',